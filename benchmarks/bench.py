@@ -0,0 +1,272 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+Benchmarks the live and replay downloaders against :mod:`benchmarks.origin`.
+
+Each scenario is run in a new process, with the origin in another process, so that
+the CPU time and peak RSS measured are those of the downloader alone::
+
+    python -m benchmarks.bench --output results.json
+    python -m benchmarks.bench --scenario live --scenario live-lossy --segment-duration 0.5
+    python -m benchmarks.bench --baseline results.json    # exits with 1 on a regression
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:     # pragma: no cover
+    # not available on Windows
+    resource = None
+
+import requests
+
+try:
+    from instagram_private_api_extensions import live, replay
+except ImportError:     # pragma: no cover
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from instagram_private_api_extensions import live, replay
+
+
+# name => (downloader, origin options, downloader options)
+SCENARIOS = OrderedDict([
+    ('live', ('live', {}, {})),
+    ('live-adaptive', ('live', {}, {'adaptive_polling': True})),
+    ('live-lossy', ('live', {'error_rate': 0.05, 'latency': 0.05, 'seed': 1}, {'max_connection_error_retry': 1})),
+    ('live-switch', ('live', {'switch_every': 5}, {})),
+    ('replay', ('replay', {}, {})),
+])
+
+# result key => True if higher is better
+REGRESSION_CHECKS = OrderedDict([
+    ('throughput_bps', True),
+    ('edge_latency_p95', False),
+    ('lost_segments', False),
+    ('cpu_seconds', False),
+    ('peak_rss_mb', False),
+])
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+def _usage():
+    """CPU seconds used and peak RSS in MB of this process."""
+    if not resource:
+        return 0.0, 0.0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak_rss = usage.ru_maxrss / (1024.0 * 1024.0) if sys.platform == 'darwin' else usage.ru_maxrss / 1024.0
+    return usage.ru_utime + usage.ru_stime, peak_rss
+
+
+def _start_origin(options):
+    cmd = [sys.executable, '-m', 'benchmarks.origin', '--port', '0']
+    for k, v in sorted(options.items()):
+        cmd.extend(['--' + k.replace('_', '-'), str(v)])
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    live_mpd_url = proc.stdout.readline().decode('utf-8').strip()
+    replay_mpd_url = proc.stdout.readline().decode('utf-8').strip()
+    if not live_mpd_url:
+        proc.wait()
+        raise RuntimeError('Origin failed to start: {0!s}'.format(' '.join(cmd)))
+    return proc, live_mpd_url, replay_mpd_url
+
+
+def _origin_stats(mpd_url):
+    return requests.get(mpd_url.split('/live/')[0].split('/replay/')[0] + '/stats', timeout=10).json()
+
+
+def run_live(mpd_url, output_dir, options):
+    cpu_started, _ = _usage()
+    started = time.time()
+    dl = live.Downloader(mpd=mpd_url, output_dir=output_dir, **options)
+    dl.run()
+    wall = time.time() - started
+    cpu_ended, peak_rss = _usage()
+
+    stats = _origin_stats(mpd_url)
+    published = stats['published']
+    edge_latencies = []
+    downloaded_bytes = 0
+    downloaded = 0
+    for segment, published_at in published.items():
+        segment_file = os.path.join(output_dir, segment)
+        if not os.path.isfile(segment_file):
+            continue
+        downloaded += 1
+        downloaded_bytes += os.path.getsize(segment_file)
+        if published_at > stats['started_at']:
+            # segments in the initial backlog were published before the downloader started
+            edge_latencies.append(os.path.getmtime(segment_file) - published_at)
+
+    snapshot = dl.metrics.snapshot()
+    return OrderedDict([
+        ('wall_seconds', wall),
+        ('segments_published', len(published)),
+        ('segments_downloaded', downloaded),
+        ('lost_segments', len(published) - downloaded),
+        ('gaps', len(dl.gaps)),
+        ('bytes', downloaded_bytes),
+        ('throughput_bps', downloaded_bytes / wall if wall else 0.0),
+        ('segment_bytes_per_second', snapshot['bytes_per_second']),
+        ('edge_latency_p50', _percentile(edge_latencies, 50)),
+        ('edge_latency_p95', _percentile(edge_latencies, 95)),
+        ('edge_latency_max', max(edge_latencies) if edge_latencies else None),
+        ('mpd_polls', snapshot['mpd_polls']),
+        ('segment_retries', snapshot['segment_retries']),
+        ('cpu_seconds', cpu_ended - cpu_started),
+        ('peak_rss_mb', peak_rss),
+    ])
+
+
+def run_replay(mpd_url, output_dir, options):
+    mpd = requests.get(mpd_url, timeout=10).text
+    cpu_started, _ = _usage()
+    started = time.time()
+    dl = replay.Downloader(mpd=mpd, output_dir=output_dir, **options)
+    dl.download(os.path.join(output_dir, 'replay.mp4'), skipffmpeg=True, cleartempfiles=False)
+    wall = time.time() - started
+    cpu_ended, peak_rss = _usage()
+
+    downloaded_bytes = sum([os.path.getsize(os.path.join(output_dir, f)) for f in os.listdir(output_dir)])
+    return OrderedDict([
+        ('wall_seconds', wall),
+        ('bytes', downloaded_bytes),
+        ('throughput_bps', downloaded_bytes / wall if wall else 0.0),
+        ('cpu_seconds', cpu_ended - cpu_started),
+        ('peak_rss_mb', peak_rss),
+    ])
+
+
+def run_scenario(name, origin_overrides):
+    """Run a scenario in this process and return its results."""
+    engine, origin_options, downloader_options = SCENARIOS[name]
+    origin_options = dict(origin_options)
+    origin_options.update(origin_overrides)
+    proc, live_mpd_url, replay_mpd_url = _start_origin(origin_options)
+    output_dir = tempfile.mkdtemp(prefix='bench-{0!s}-'.format(name))
+    try:
+        if engine == 'live':
+            return run_live(live_mpd_url, output_dir, downloader_options)
+        return run_replay(replay_mpd_url, output_dir, downloader_options)
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline.
+
+    :param results: dict of results keyed by scenario
+    :param baseline: dict of baseline results keyed by scenario
+    :param tolerance: fraction by which a result may be worse than the baseline
+    :return: list of regression messages
+    """
+    regressions = []
+    for name, result in results.items():
+        for key, higher_is_better in REGRESSION_CHECKS.items():
+            value = result.get(key)
+            base = baseline.get(name, {}).get(key)
+            if value is None or base is None:
+                continue
+            if higher_is_better:
+                regressed = value < base * (1 - tolerance)
+            else:
+                regressed = value > base * (1 + tolerance) and value != base
+            if regressed:
+                regressions.append('{0!s} {1!s}: {2:.4g} (baseline {3:.4g})'.format(name, key, value, base))
+    return regressions
+
+
+def _format_table(results):
+    keys = []
+    for result in results.values():
+        keys.extend([k for k in result.keys() if k not in keys])
+    lines = ['{0:<26}'.format('') + ''.join(['{0:>16}'.format(name) for name in results.keys()])]
+    for key in keys:
+        cells = []
+        for result in results.values():
+            value = result.get(key)
+            cells.append('{0:>16}'.format('-' if value is None else '{0:.4g}'.format(value)))
+        lines.append('{0:<26}'.format(key) + ''.join(cells))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the live and replay downloaders')
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS.keys()),
+                        help='Scenario to run, can be repeated. Defaults to all.')
+    parser.add_argument('--segment-duration', type=float)
+    parser.add_argument('--segments', type=int)
+    parser.add_argument('--video-size', type=int)
+    parser.add_argument('--audio-size', type=int)
+    parser.add_argument('--replay-size', type=int)
+    parser.add_argument('--output', metavar='RESULTS_JSON', help='Save the results')
+    parser.add_argument('--baseline', metavar='RESULTS_JSON', help='Compare the results with earlier results')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Fraction by which a result may be worse than the baseline')
+    parser.add_argument('--child', metavar='SCENARIO', help=argparse.SUPPRESS)
+    parser.add_argument('-v', action='store_true', help='Verbose')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.v else logging.ERROR)
+    origin_overrides = dict([
+        (k, getattr(args, k)) for k in ('segment_duration', 'segments', 'video_size', 'audio_size', 'replay_size')
+        if getattr(args, k) is not None])
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, origin_overrides)))
+        return 0
+
+    results = OrderedDict()
+    child_args = []
+    for k, v in sorted(origin_overrides.items()):
+        child_args.extend(['--' + k.replace('_', '-'), str(v)])
+    if args.v:
+        child_args.append('-v')
+    for name in args.scenario or SCENARIOS.keys():
+        sys.stderr.write('Running {0!s}...\n'.format(name))
+        # a new process for each scenario so that the usage of one does not skew another
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.bench', '--child', name] + child_args,
+            cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        results[name] = json.loads(output.decode('utf-8').strip().splitlines()[-1], object_pairs_hook=OrderedDict)
+
+    print(_format_table(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            sys.stderr.write('Regression: {0!s}\n'.format(regression))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':      # pragma: no cover
+    sys.exit(main())
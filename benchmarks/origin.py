@@ -0,0 +1,344 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+A local stand-in for the IG DASH origin, for benchmarking the live and replay downloaders.
+
+Serves a live stream with a rolling ``SegmentTimeline`` mpd that is published in real time,
+and a replay mpd with one audio and one video file::
+
+    python -m benchmarks.origin --port 8001 --segments 60 --error-rate 0.02 --switch-every 10
+
+- ``/live/mpd/<stream_id>.mpd``: the live mpd, cached for an hour once the stream has ended
+- ``/replay/<stream_id>.mpd``: the replay mpd
+- ``/stats``: json with the request counts and the publish time of each live segment
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:     # pragma: no cover
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+LIVE_MPD_TEMPLATE = '''<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="dynamic" minimumUpdatePeriod="PT{update_period:d}S" \
+profiles="urn:mpeg:dash:profile:isoff-live:2011">
+<Period id="0" start="PT0S">
+<AdaptationSet segmentAlignment="true">
+{video_representations}</AdaptationSet>
+<AdaptationSet segmentAlignment="true">
+<Representation id="{stream_id}a" mimeType="audio/mp4" codecs="mp4a.40.2" audioSamplingRate="44100" \
+bandwidth="{audio_bandwidth:d}">
+<SegmentTemplate initialization="../dash-ld/{stream_id}-init.m4a" media="../dash-ld/{stream_id}-$Time$.m4a" \
+timescale="{timescale:d}"><SegmentTimeline>{audio_timeline}</SegmentTimeline></SegmentTemplate>
+</Representation>
+</AdaptationSet>
+</Period>
+</MPD>
+'''
+
+VIDEO_REPRESENTATION_TEMPLATE = '''<Representation id="{stream_id}v{track}" mimeType="video/mp4" codecs="avc1.64001e" \
+width="{width:d}" height="{height:d}" bandwidth="{video_bandwidth:d}" FBQualityLabel="{label}">
+<SegmentTemplate initialization="../dash-{track}/{stream_id}-init.m4v" media="../dash-{track}/{stream_id}-$Time$.m4v" \
+timescale="{timescale:d}"><SegmentTimeline>{video_timeline}</SegmentTimeline></SegmentTemplate>
+</Representation>
+'''
+
+REPLAY_MPD_TEMPLATE = '''<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT0H{minutes:d}M{seconds:.3f}S">
+<Period duration="PT0H{minutes:d}M{seconds:.3f}S">
+<AdaptationSet segmentAlignment="true">
+<Representation id="{stream_id}a" mimeType="audio/mp4" codecs="mp4a.40.2" audioSamplingRate="44100" bandwidth="50598">
+<BaseURL>{base_url}/replay/{stream_id}_audio.mp4</BaseURL>
+</Representation>
+</AdaptationSet>
+<AdaptationSet segmentAlignment="true">
+<Representation id="{stream_id}v" mimeType="video/mp4" codecs="avc1.64001e" width="396" height="704" \
+bandwidth="762528" FBQualityLabel="396w">
+<BaseURL>{base_url}/replay/{stream_id}_video.mp4</BaseURL>
+</Representation>
+</AdaptationSet>
+</Period>
+</MPD>
+'''
+
+# (track, width, height, label) of the video representations cycled through by resolution switches
+VIDEO_REPRESENTATIONS = (
+    ('hd1', 396, 704, '396w'),
+    ('hd2', 540, 960, '540w'),
+)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _OriginHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):       # pylint: disable=invalid-name
+        status, headers, body = self.server.origin.handle(self.path, self.headers)
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):      # pylint: disable=redefined-builtin
+        pass
+
+
+class FakeOrigin(object):
+    """Simulates the DASH origin of an IG live stream and its replay."""
+
+    STREAM_ID = '17875351285037717'
+    TIMESCALE = 1000
+
+    def __init__(self, host='127.0.0.1', port=0, **kwargs):
+        """
+
+        :param host: address to listen on
+        :param port: port to listen on, 0 to pick a free port
+        :param segment_duration: seconds of media per segment
+        :param segments: number of segments in the stream, after which the stream ends
+        :param backlog: number of segments already published when the origin starts
+        :param window: number of segments listed in the mpd
+        :param video_size: bytes per video segment
+        :param audio_size: bytes per audio segment
+        :param replay_size: bytes of the replay video file, the audio file is a tenth of that
+        :param latency: seconds to wait before responding to each request
+        :param error_rate: fraction of segment requests that fail with a 500
+        :param switch_every: switch the video resolution every n segments, 0 to never switch
+        :param ladder: list all the video resolutions in the mpd, with the bandwidth in proportion
+            to their size, instead of a single one
+        :param seed: random seed for the errors
+        """
+        self.segment_duration = kwargs.pop('segment_duration', 1.0)
+        self.segments = kwargs.pop('segments', 30)
+        self.window = kwargs.pop('window', 10)
+        self.backlog = kwargs.pop('backlog', self.window)
+        self.video_size = kwargs.pop('video_size', 100 * 1024)
+        self.audio_size = kwargs.pop('audio_size', 8 * 1024)
+        self.replay_size = kwargs.pop('replay_size', 10 * 1024 * 1024)
+        self.latency = kwargs.pop('latency', 0.0)
+        self.error_rate = kwargs.pop('error_rate', 0.0)
+        self.switch_every = kwargs.pop('switch_every', 0)
+        self.ladder = kwargs.pop('ladder', False)
+        self._random = random.Random(kwargs.pop('seed', None))
+        if kwargs:
+            raise TypeError('Unexpected options: {0!s}'.format(', '.join(kwargs.keys())))
+
+        self._payloads = {}
+        self._lock = threading.Lock()
+        self.requests = {'mpd': 0, 'mpd_not_modified': 0, 'segment': 0, 'error': 0, 'not_found': 0}
+        self.bytes_sent = 0
+        self.started_at = None
+        self._server = _ThreadingHTTPServer((host, port), _OriginHandler)
+        self._server.origin = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{0!s}:{1:d}'.format(host, port)
+
+    @property
+    def live_mpd_url(self):
+        return '{0!s}/live/mpd/{1!s}.mpd'.format(self.url, self.STREAM_ID)
+
+    @property
+    def replay_mpd_url(self):
+        return '{0!s}/replay/{1!s}.mpd'.format(self.url, self.STREAM_ID)
+
+    def start(self):
+        """Start serving on a background thread. The live stream starts now."""
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='origin')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.started_at = time.time()
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def published_count(self, now=None):
+        """Number of live segments published so far."""
+        elapsed = (now or time.time()) - self.started_at
+        return max(0, min(self.segments, self.backlog + int(elapsed / self.segment_duration)))
+
+    def publish_time(self, index):
+        """Time when the live segment at index is published."""
+        return self.started_at + max(0, index + 1 - self.backlog) * self.segment_duration
+
+    def segment_t(self, index):
+        return int(index * self.segment_duration * self.TIMESCALE)
+
+    def stats(self):
+        """Request counts and the publish time of each live segment, keyed by segment file name."""
+        published = {}
+        for index in range(self.published_count()):
+            for ext in ('m4v', 'm4a'):
+                published['{0!s}-{1:d}.{2!s}'.format(self.STREAM_ID, self.segment_t(index), ext)] = \
+                    self.publish_time(index)
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'requests': dict(self.requests),
+                'bytes_sent': self.bytes_sent,
+                'published': published,
+            }
+
+    def live_mpd(self, now=None):
+        """The live mpd at time ``now`` and whether the stream has ended."""
+        published = self.published_count(now)
+        first = max(0, published - self.window)
+        representations = VIDEO_REPRESENTATIONS[:1]
+        if self.ladder:
+            representations = VIDEO_REPRESENTATIONS
+        elif self.switch_every and published:
+            representations = [VIDEO_REPRESENTATIONS[
+                ((published - 1) // self.switch_every) % len(VIDEO_REPRESENTATIONS)]]
+        duration = int(self.segment_duration * self.TIMESCALE)
+        timeline = ''.join([
+            '<S t="{0:d}" d="{1:d}"/>'.format(self.segment_t(i), duration) for i in range(first, published)])
+        base_width, base_height = VIDEO_REPRESENTATIONS[0][1:3]
+        video_representations = ''.join([
+            VIDEO_REPRESENTATION_TEMPLATE.format(
+                stream_id=self.STREAM_ID, track=track, width=width, height=height, label=label,
+                timescale=self.TIMESCALE, video_timeline=timeline,
+                video_bandwidth=int(
+                    self.video_size * 8 / self.segment_duration * width * height / (base_width * base_height)))
+            for track, width, height, label in representations])
+        mpd = LIVE_MPD_TEMPLATE.format(
+            update_period=max(1, int(self.segment_duration)), stream_id=self.STREAM_ID,
+            video_representations=video_representations, timescale=self.TIMESCALE,
+            audio_bandwidth=int(self.audio_size * 8 / self.segment_duration), audio_timeline=timeline)
+        return mpd, published >= self.segments
+
+    def replay_mpd(self):
+        seconds = self.segments * self.segment_duration
+        return REPLAY_MPD_TEMPLATE.format(
+            minutes=int(seconds // 60), seconds=seconds % 60, stream_id=self.STREAM_ID, base_url=self.url)
+
+    def _payload(self, size):
+        payload = self._payloads.get(size)
+        if payload is None:
+            payload = self._payloads[size] = (b'\x00\x01\x02\x03' * (size // 4 + 1))[:size]
+        return payload
+
+    def handle(self, path, headers):
+        """
+        Handle a GET request.
+
+        :return: tuple of status, response headers dict, body
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if path == '/stats':
+            return 200, {'Content-Type': 'application/json'}, json.dumps(self.stats()).encode('utf-8')
+
+        if path == '/live/mpd/{0!s}.mpd'.format(self.STREAM_ID):
+            mpd, ended = self.live_mpd()
+            body = mpd.encode('utf-8')
+            etag = '"{0!s}"'.format(hashlib.md5(body).hexdigest())
+            response_headers = {'Content-Type': 'application/dash+xml', 'ETag': etag}
+            if ended:
+                response_headers['Cache-Control'] = 'max-age=3600'
+            with self._lock:
+                self.requests['mpd'] += 1
+                if headers.get('If-None-Match') == etag:
+                    self.requests['mpd_not_modified'] += 1
+                    return 304, response_headers, b''
+            return self._respond(200, response_headers, body)
+
+        if path == '/replay/{0!s}.mpd'.format(self.STREAM_ID):
+            return self._respond(200, {'Content-Type': 'application/dash+xml'}, self.replay_mpd().encode('utf-8'))
+
+        mobj = re.match(r'^/replay/[0-9_]+_(?P<track>audio|video)\.mp4$', path)
+        if mobj:
+            size = self.replay_size if mobj.group('track') == 'video' else self.replay_size // 10
+            return self._respond(200, {'Content-Type': 'video/mp4'}, self._payload(size))
+
+        mobj = re.match(r'^/live/dash-[a-z0-9]+/[0-9_]+-(?P<t>init|[0-9]+)\.(?P<ext>m4v|m4a)$', path)
+        if not mobj:
+            return self._not_found()
+        size = self.video_size if mobj.group('ext') == 'm4v' else self.audio_size
+        if mobj.group('t') == 'init':
+            return self._respond(200, {'Content-Type': 'video/mp4'}, self._payload(1024))
+
+        t = int(mobj.group('t'))
+        index = int(round(float(t) / self.TIMESCALE / self.segment_duration))
+        if self.segment_t(index) != t or index >= self.published_count():
+            return self._not_found()
+        with self._lock:
+            self.requests['segment'] += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.requests['error'] += 1
+                return 500, {}, b''
+        return self._respond(200, {'Content-Type': 'video/mp4'}, self._payload(size))
+
+    def _respond(self, status, headers, body):
+        with self._lock:
+            self.bytes_sent += len(body)
+        return status, headers, body
+
+    def _not_found(self):
+        with self._lock:
+            self.requests['not_found'] += 1
+        return 404, {}, b''
+
+
+if __name__ == '__main__':      # pragma: no cover
+
+    parser = argparse.ArgumentParser(description='Fake IG DASH origin')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--segment-duration', type=float, default=1.0)
+    parser.add_argument('--segments', type=int, default=30)
+    parser.add_argument('--window', type=int, default=10)
+    parser.add_argument('--backlog', type=int, default=None)
+    parser.add_argument('--video-size', type=int, default=100 * 1024)
+    parser.add_argument('--audio-size', type=int, default=8 * 1024)
+    parser.add_argument('--replay-size', type=int, default=10 * 1024 * 1024)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--switch-every', type=int, default=0)
+    parser.add_argument('--ladder', action='store_true')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    origin = FakeOrigin(
+        args.host, args.port, segment_duration=args.segment_duration, segments=args.segments,
+        window=args.window, backlog=args.window if args.backlog is None else args.backlog,
+        video_size=args.video_size, audio_size=args.audio_size, replay_size=args.replay_size,
+        latency=args.latency, error_rate=args.error_rate, switch_every=args.switch_every, ladder=args.ladder,
+        seed=args.seed)
+    print(origin.live_mpd_url)
+    print(origin.replay_mpd_url)
+    sys.stdout.flush()
+    try:
+        origin.serve_forever()
+    except KeyboardInterrupt:
+        pass
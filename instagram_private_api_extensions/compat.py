@@ -34,3 +34,18 @@ try:
     from urllib.request import urlretrieve as compat_urlretrieve
 except ImportError:  # Python 2
     from urllib import urlretrieve as compat_urlretrieve
+
+try:
+    import queue as compat_queue
+except ImportError:  # Python 2
+    import Queue as compat_queue
+
+try:
+    from os import replace as compat_os_replace
+except ImportError:  # Python 2
+    from os import rename as compat_os_replace
+
+try:
+    from collections.abc import MutableMapping as compat_mutable_mapping
+except ImportError:  # Python 2
+    from collections import MutableMapping as compat_mutable_mapping
@@ -4,6 +4,8 @@
 # https://opensource.org/licenses/MIT
 
 import argparse
+import bisect
+import json
 import logging
 import os
 import time
@@ -11,16 +13,41 @@ import re
 import hashlib
 import xml.etree.ElementTree
 import threading
+from array import array
 import shutil
 import subprocess
+import tempfile
+from collections import deque, OrderedDict
+from contextlib import closing, contextmanager
+
+try:
+    import fcntl
+except ImportError:     # pragma: no cover
+    # not available on Windows, and only used with named pipes
+    fcntl = None
 
 import requests
 try:
-    from .compat import compat_urlparse
+    from .compat import compat_urlparse, compat_queue, compat_mutable_mapping
+    from . import mp4
+    from .selection import RepresentationPolicy
+    # SegmentStorage, SpoolSegmentStorage and WorkerPoolChannel are re-exported for compatibility
+    from .metrics import DownloaderMetrics
+    from .retry import RetryScheduler
+    from .storage import (      # noqa: F401
+        SegmentStorage, LocalSegmentStorage, MemorySegmentStorage, SpoolSegmentStorage)
+    from .workers import WorkerPool, WorkerPoolChannel, _Job     # noqa: F401
 except ValueError:
     # pragma: no cover
     # To allow running in terminal
-    from compat import compat_urlparse
+    from compat import compat_urlparse, compat_queue, compat_mutable_mapping
+    import mp4
+    from selection import RepresentationPolicy
+    from metrics import DownloaderMetrics
+    from retry import RetryScheduler
+    from storage import (       # noqa: F401
+        SegmentStorage, LocalSegmentStorage, MemorySegmentStorage, SpoolSegmentStorage)
+    from workers import WorkerPool, WorkerPoolChannel, _Job      # noqa: F401
 
 
 logger = logging.getLogger(__file__)
@@ -29,6 +56,835 @@ logger = logging.getLogger(__file__)
 MPD_NAMESPACE = {'mpd': 'urn:mpeg:dash:schema:mpd:2011'}
 
 
+class _PollScheduler(object):
+    """
+    Predicts when the next segment will be published at the live edge so that
+    the mpd can be polled just after it appears.
+
+    The publish time is estimated from the segment timeline: the offset between
+    the wall clock time a timeline edge is first seen and its media end time
+    is tracked, and the earliest recent offset is taken as the publish delay.
+    """
+
+    # how long after the predicted publish time to poll
+    MARGIN = 0.1
+    MIN_WAIT = 0.1
+    # number of recent observations used to estimate the publish delay
+    WINDOW = 10
+
+    def __init__(self):
+        self.edge = None
+        self.segment_duration = None
+        self._offsets = deque(maxlen=self.WINDOW)
+
+    def observe(self, edge, segment_duration, observed_at):
+        """
+        Record the timeline edge of a newly processed mpd.
+
+        :param edge: media end time in seconds of the latest segment in the timeline
+        :param segment_duration: duration in seconds of the latest segment
+        :param observed_at: wall clock time when the mpd was received
+        """
+        if not edge or (self.edge is not None and edge <= self.edge):
+            return
+        self.edge = edge
+        self.segment_duration = segment_duration
+        self._offsets.append(observed_at - edge)
+
+    def next_wait(self, update_period, duplicate_count, now):
+        """
+        Seconds to wait before the next poll.
+
+        :param update_period: the mpd minimumUpdatePeriod
+        :param duplicate_count: number of consecutive polls without a new mpd
+        :param now: current wall clock time
+        """
+        if self.edge is None or not self.segment_duration:
+            return update_period
+        max_wait = max(update_period, self.segment_duration)
+        expected = self.edge + self.segment_duration + min(self._offsets) + self.MARGIN
+        wait = expected - now
+        if duplicate_count:
+            # next segment is overdue, back off
+            wait = max(wait, self.MARGIN * (2 ** duplicate_count))
+        return min(max(wait, self.MIN_WAIT), max_wait)
+
+
+class _StatusCheck(threading.Thread):
+    """A ``callback_check`` call on a background thread."""
+
+    def __init__(self, callback, on_result, timeout):
+        """
+
+        :param callback: the status callback
+        :param on_result: function called with the callback's result, unless the check has timed out
+        :param timeout: seconds after which the callback's result is ignored
+        """
+        threading.Thread.__init__(self, name='status-check')
+        self.daemon = True
+        self.callback = callback
+        self.on_result = on_result
+        self.timeout = timeout
+        self.started_at = time.time()
+        # set once the check has timed out
+        self.abandoned = False
+
+    def run(self):
+        try:
+            result = self.callback()
+        except Exception as e:      # pylint: disable=broad-except
+            logger.warning('Error from callback: {0!s}'.format(str(e)))
+            return
+        if self.abandoned or time.time() > self.started_at + self.timeout:
+            logger.debug('Ignoring the result of a timed out status check')
+            return
+        self.on_result(result)
+
+
+class _StatusChecker(threading.Thread):
+    """
+    Runs a :class:`_StatusCheck` every ``callback_interval`` seconds while the mpd is unchanged,
+    independently of the mpd polls.
+    """
+
+    def __init__(self, downloader):
+        """
+
+        :param downloader: the :class:`Downloader` whose stream is checked
+        """
+        threading.Thread.__init__(self, name='status-checker')
+        self.daemon = True
+        self.downloader = downloader
+        self._stopped = threading.Event()
+
+    def run(self):
+        dl = self.downloader
+        while not self._stopped.wait(dl.callback_interval) and not dl.is_aborted:
+            if not dl.duplicate_etag_count:
+                continue
+            dl.metrics.inc('status_checks')
+            check = _StatusCheck(dl.callback, dl._on_status_checked, dl.callback_timeout)
+            check.start()
+            check.join(dl.callback_timeout)
+            if check.is_alive():
+                # left to finish in the background, the next check starts on schedule
+                check.abandoned = True
+                logger.warning('Status check timed out after {0:.1f}s'.format(dl.callback_timeout))
+                dl.metrics.inc('status_check_timeouts')
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _TimelineIndex(object):
+    """
+    Tracks the timeline position of the segments of each adaptation set to detect
+    gaps in the timeline and whether a segment is still in the server's buffer window.
+    """
+
+    def __init__(self):
+        # identifier => (adaptation set key, representation id, t, d, timescale)
+        self._segments = {}
+        # adaptation set key => media end time of the last segment added
+        self._edges = {}
+        # adaptation set key => t of the first segment in the latest mpd
+        self._windows = {}
+        self.gaps = []
+        self._lock = threading.Lock()
+
+    def reset(self, key):
+        """Forget the timeline of an adaptation set, e.g. when the representation has changed."""
+        with self._lock:
+            self._edges.pop(key, None)
+
+    def set_window(self, key, first_t):
+        """
+        Record the start of the buffer window for an adaptation set.
+
+        :param key: adaptation set key
+        :param first_t: t of the first segment in the mpd timeline
+        """
+        with self._lock:
+            self._windows[key] = first_t
+
+    def add(self, key, representation_id, identifier, t, d, timescale):
+        """
+        Add a new timeline segment. Segments must be added in timeline order.
+
+        :return: the gap found before the segment, if any
+        """
+        with self._lock:
+            self._segments[identifier] = (key, representation_id, t, d, timescale)
+            edge = self._edges.get(key)
+            self._edges[key] = max(t + d, edge or 0)
+            if edge is not None and t > edge:
+                return self._add_gap(representation_id, edge, t, timescale, 'timeline')
+        return None
+
+    def in_window(self, identifier):
+        """True if the segment is still listed in the latest mpd."""
+        with self._lock:
+            if identifier not in self._segments:
+                return False
+            key, _, t, _, _ = self._segments[identifier]
+            return t >= self._windows.get(key, t)
+
+    def discard(self, identifier):
+        """
+        Stop tracking a segment that has been dealt with.
+
+        :return: tuple of the media start and end time in seconds of the segment, if known
+        """
+        with self._lock:
+            segment = self._segments.pop(identifier, None)
+        if segment:
+            _, _, t, d, timescale = segment
+            return float(t) / timescale, float(t + d) / timescale
+        return None
+
+    def add_missing(self, identifier):
+        """Report a segment that could not be downloaded."""
+        with self._lock:
+            if identifier not in self._segments:
+                return None
+            _, representation_id, t, d, timescale = self._segments.pop(identifier)
+            return self._add_gap(representation_id, t, t + d, timescale, 'download', segment=identifier)
+
+    def _add_gap(self, representation_id, start, end, timescale, reason, segment=None):
+        gap = {
+            'representation': representation_id,
+            'start': float(start) / timescale,
+            'end': float(end) / timescale,
+            'reason': reason,
+            'segment': segment,
+        }
+        self.gaps.append(gap)
+        logger.warning('Gap in {0!s} timeline from {1:.3f}s to {2:.3f}s ({3!s})'.format(
+            representation_id, gap['start'], gap['end'], reason))
+        return gap
+
+
+try:
+    array('q')
+    _TIME_TYPECODE = 'q'
+except ValueError:  # Python 2
+    _TIME_TYPECODE = 'l'
+
+
+class _SegmentIndex(compat_mutable_mapping):
+    """
+    Compact mapping of segment file names to a label, e.g. the resolution, or to None when
+    used as a set of segments.
+
+    Names like ``<prefix>-<t>.<ext>`` are keyed by their timeline position: the ``t`` values
+    are kept in a sorted array per ``<prefix>``/``<ext>`` pair, and the labels as indexes into
+    the few distinct labels, instead of a string key and value per segment.
+    """
+
+    _NAME_RE = re.compile(r'^(?P<prefix>.+\-)(?P<t>0|[1-9][0-9]*)(?P<ext>\.[a-z0-9]+)$')
+
+    def __init__(self, *args, **kwargs):
+        # (prefix, ext) => (sorted array of t, array of label indexes)
+        self._timelines = OrderedDict()
+        self._labels = []
+        self._label_indexes = {}
+        # names that are not timeline positions
+        self._others = OrderedDict()
+        self._lock = threading.Lock()
+        self.update(*args, **kwargs)
+
+    def _locate(self, name, create=False):
+        """
+        :return: tuple of the timeline arrays, the position of the name in them and
+            whether it is there, or None if the name is not a timeline position
+        """
+        mobj = self._NAME_RE.match(name)
+        if not mobj:
+            return None
+        key = (mobj.group('prefix'), mobj.group('ext'))
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            if not create:
+                return (array(_TIME_TYPECODE), array('H')), 0, False
+            timeline = self._timelines[key] = (array(_TIME_TYPECODE), array('H'))
+        t = int(mobj.group('t'))
+        pos = bisect.bisect_left(timeline[0], t)
+        return timeline, pos, pos < len(timeline[0]) and timeline[0][pos] == t
+
+    def _label_index(self, label):
+        index = self._label_indexes.get(label)
+        if index is None:
+            index = self._label_indexes[label] = len(self._labels)
+            self._labels.append(label)
+        return index
+
+    def add(self, name):
+        """Add a segment without a label."""
+        self[name] = None
+
+    def __setitem__(self, name, label):
+        with self._lock:
+            located = self._locate(name, create=True)
+            if not located:
+                self._others[name] = label
+                return
+            (times, labels), pos, found = located
+            if found:
+                labels[pos] = self._label_index(label)
+            else:
+                times.insert(pos, int(self._NAME_RE.match(name).group('t')))
+                labels.insert(pos, self._label_index(label))
+
+    def __getitem__(self, name):
+        with self._lock:
+            located = self._locate(name)
+            if not located:
+                return self._others[name]
+            (_, labels), pos, found = located
+            if not found:
+                raise KeyError(name)
+            return self._labels[labels[pos]]
+
+    def __delitem__(self, name):
+        with self._lock:
+            located = self._locate(name)
+            if not located:
+                del self._others[name]
+                return
+            (times, labels), pos, found = located
+            if not found:
+                raise KeyError(name)
+            del times[pos]
+            del labels[pos]
+
+    def __contains__(self, name):
+        with self._lock:
+            located = self._locate(name)
+            return located[2] if located else name in self._others
+
+    def __iter__(self):
+        with self._lock:
+            names = [
+                '{0!s}{1:d}{2!s}'.format(prefix, t, ext)
+                for (prefix, ext), (times, _) in self._timelines.items() for t in times]
+            names.extend(self._others.keys())
+        return iter(names)
+
+    def __len__(self):
+        with self._lock:
+            return sum([len(times) for times, _ in self._timelines.values()]) + len(self._others)
+
+    def __repr__(self):
+        return '{0!s}({1!r})'.format(self.__class__.__name__, dict(self.items()))
+
+
+class _DvrBuffer(object):
+    """
+    Keeps the most recent ``window`` seconds of segments in a :class:`SegmentStorage`
+    and removes the older ones as new segments are added, so that the storage and
+    memory used stay constant however long the stream runs.
+    """
+
+    def __init__(self, storage, window):
+        """
+
+        :param storage: the :class:`SegmentStorage` the segments are stored in
+        :param window: seconds of media to keep
+        """
+        self.storage = storage
+        self.window = window
+        # (start, name) of the buffered segments in timeline order
+        self._order = []
+        # name => media (start, end) time in seconds
+        self._spans = {}
+        self.edge = 0.0
+        # segments evicted while the buffer is held, removed once released
+        self._held = 0
+        self._deferred = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end):
+        """
+        Add a stored segment and evict the segments that have fallen out of the window.
+
+        :param name: segment file name
+        :param start: media start time in seconds
+        :param end: media end time in seconds
+        :return: list of the evicted segment names
+        """
+        with self._lock:
+            if name not in self._spans:
+                bisect.insort(self._order, (start, name))
+                self._spans[name] = (start, end)
+            self.edge = max(self.edge, end)
+            evicted = []
+            while self._order and self._spans[self._order[0][1]][1] <= self.edge - self.window:
+                _, old = self._order.pop(0)
+                del self._spans[old]
+                evicted.append(old)
+            if self._held:
+                self._deferred.extend(evicted)
+                return evicted
+        for old in evicted:
+            self.storage.remove(old)
+        return evicted
+
+    @property
+    def range(self):
+        """Media (start, end) time in seconds of the buffered segments, None if empty."""
+        with self._lock:
+            if not self._order:
+                return None
+            return self._order[0][0], self.edge
+
+    def segments(self, start=None, end=None):
+        """
+        The buffered segments that overlap a time range, in timeline order.
+
+        :param start: media time in seconds, defaults to the start of the buffer
+        :param end: media time in seconds, defaults to the end of the buffer
+        :return: list of (name, start, end)
+        """
+        with self._lock:
+            return [
+                (name, self._spans[name][0], self._spans[name][1]) for _, name in self._order
+                if (start is None or self._spans[name][1] > start) and (end is None or self._spans[name][0] < end)]
+
+    @contextmanager
+    def hold(self):
+        """Context manager that keeps evicted segments in the storage until it exits, e.g. while exporting."""
+        with self._lock:
+            self._held += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._held -= 1
+                deferred = [] if self._held else self._deferred
+                if not self._held:
+                    self._deferred = []
+            for old in deferred:
+                self.storage.remove(old)
+
+
+class _TimelineBuffer(object):
+    """
+    Reorder buffer that releases downloaded segments in timeline order,
+    i.e. only once the segment and all earlier segments have completed.
+    """
+
+    def __init__(self, downloader):
+        """
+
+        :param downloader: :class:`Downloader` instance
+        """
+        self.downloader = downloader
+        self._order = []
+        self._status = {}
+        self._lock = threading.RLock()
+
+    def add(self, segment):
+        """
+        Register a video segment so that it is released in timeline order.
+
+        :param segment: video segment filename, i.e. a key in ``segment_meta``
+        """
+        with self._lock:
+            index = Downloader._get_file_index(segment)
+            pos = len(self._order)
+            while pos and Downloader._get_file_index(self._order[pos - 1]) > index:
+                pos -= 1
+            self._order.insert(pos, segment)
+
+    def complete(self, segment_file, ok=True):
+        """
+        Mark a downloaded audio/video segment file as done and release
+        any segments that are now ready.
+
+        :param segment_file: segment filename
+        :param ok: False if the segment could not be downloaded
+        """
+        with self._lock:
+            segment = segment_file.replace('.m4a', '.m4v')
+            self._status.setdefault(segment, {})[segment_file[-4:]] = ok
+            self._flush()
+
+    def finish(self):
+        """Release all remaining segments."""
+        with self._lock:
+            self._flush(force=True)
+
+    def _flush(self, force=False):
+        while self._order:
+            segment = self._order[0]
+            status = self._status.get(segment, {})
+            if not force and (status.get('.m4v') is None or status.get('.m4a') is None):
+                # wait for the earliest segment to complete
+                return
+            self._order.pop(0)
+            self._status.pop(segment, None)
+            self._release(segment)
+
+    def _release(self, segment):
+        raise NotImplementedError()
+
+
+class _SourceAssembler(_TimelineBuffer):
+    """
+    Appends the downloaded segments to the pair of audio/video source files in timeline order,
+    starting a new pair each time a resolution change is detected.
+    """
+
+    AUDIO_STREAM_FORMAT = 'source_{0}_{1}_m4a.tmp'
+    VIDEO_STREAM_FORMAT = 'source_{0}_{1}_m4v.tmp'
+
+    def __init__(self, downloader, defer=False):
+        """
+
+        :param downloader: :class:`Downloader` instance
+        :param defer: flag to only list the segments of each source pair in ``source['segments']``,
+            for the source files to be written later with :meth:`assemble`
+        """
+        super(_SourceAssembler, self).__init__(downloader)
+        self.defer = defer
+        self.sources = []
+        self._prev_res = ''
+        self._source = None
+        # the open video/audio source files of the current pair
+        self._files = {}
+
+    def finish(self):
+        """
+        Assemble all remaining segments.
+
+        :return: list of ``{'video': path, 'audio': path}`` source pairs
+        """
+        with self._lock:
+            super(_SourceAssembler, self).finish()
+            if self._source:
+                # push last pair into source
+                self._push_source()
+            return self.sources
+
+    def _push_source(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self.sources.append(self._source)
+        self._source = None
+
+    def _release(self, segment):
+        dl = self.downloader
+        video_seg_file = segment
+        audio_seg_file = segment.replace('.m4v', '.m4a')
+
+        if not dl.storage.exists(video_seg_file):
+            logger.warning('Segment not found: {0!s}'.format(video_seg_file))
+            return
+
+        if not dl.storage.exists(audio_seg_file):
+            logger.warning('Segment not found: {0!s}'.format(audio_seg_file))
+            return
+
+        if self._source and self._prev_res != dl.segment_meta[segment]:
+            # resolution change detected
+            # push current generated file pair into sources
+            self._push_source()
+
+        if not self._source:
+            self._source = {
+                'video': os.path.join(
+                    dl.output_dir, self.VIDEO_STREAM_FORMAT.format(dl.stream_id, len(self.sources))),
+                'audio': os.path.join(
+                    dl.output_dir, self.AUDIO_STREAM_FORMAT.format(dl.stream_id, len(self.sources))),
+            }
+            if self.defer:
+                self._source['segments'] = []
+            else:
+                # kept open until the next resolution change
+                self._files = {
+                    'video': open(self._source['video'], 'wb'),
+                    'audio': open(self._source['audio'], 'wb'),
+                }
+        self._prev_res = dl.segment_meta[segment]
+
+        if self.defer:
+            self._source['segments'].append(segment)
+            return
+
+        for track, seg_file in (('video', video_seg_file), ('audio', audio_seg_file)):
+            dl.storage.copy_to(seg_file, self._files[track])
+            # so that the source files are complete up to this segment
+            self._files[track].flush()
+            logger.debug(
+                'Assembling {0!s} stream {1!s} => {2!s}'.format(track, seg_file, self._source[track]))
+
+    def assemble(self, source, track):
+        """
+        Write a source file from its deferred segments.
+
+        :param source: a source pair returned by :meth:`finish`
+        :param track: ``video`` or ``audio``
+        """
+        dl = self.downloader
+        with open(source[track], 'wb') as outfile:
+            for segment in source['segments']:
+                dl.storage.copy_to(segment if track == 'video' else segment.replace('.m4v', '.m4a'), outfile)
+        logger.debug('Assembled {0:d} {1!s} segments => {2!s}'.format(
+            len(source['segments']), track, source[track]))
+
+
+class _SinkFeeder(_TimelineBuffer):
+    """Writes the downloaded segments to a sink in timeline order"""
+
+    def __init__(self, downloader, sink):
+        super(_SinkFeeder, self).__init__(downloader)
+        self.sink = sink
+        self._prev_res = ''
+
+    def _release(self, segment):
+        dl = self.downloader
+        resolution = dl.segment_meta.get(segment)
+        if self._prev_res and resolution != self._prev_res:
+            logger.warning('Resolution changed from {0!s} to {1!s} while restreaming'.format(
+                self._prev_res, resolution))
+        self._prev_res = resolution
+
+        for track, seg_file in (('video', segment), ('audio', segment.replace('.m4v', '.m4a'))):
+            if not dl.storage.exists(seg_file):
+                logger.warning('Segment not found: {0!s}'.format(seg_file))
+                continue
+            with closing(dl.storage.open_read(seg_file)) as f:
+                self.sink.write(track, f.read())
+
+
+class PipeSink(object):
+    """
+    Receives the assembled live audio/video fMP4 streams as the segments are downloaded.
+    The first segment written to each track contains the init segment.
+
+    Each track is written out from its own thread so that a slow reader does not
+    hold up the downloads.
+
+    .. code-block:: python
+
+        # write the video track to stdout
+        dl = live.Downloader(mpd, output_dir, sink=live.PipeSink(video=sys.stdout.buffer))
+    """
+
+    def __init__(self, video=None, audio=None, max_queued=None):
+        """
+
+        :param video: writable file-like object for the video track
+        :param audio: writable file-like object for the audio track
+        :param max_queued: maximum number of segments waiting to be written per track.
+            Once reached, the downloads are held up until the reader catches up. Unlimited by default.
+        """
+        self._writers = {}
+        self._queues = {}
+        # tracks that can no longer be written to
+        self._failed = set()
+        self._is_closed = False
+        for track, writable in (('video', video), ('audio', audio)):
+            if writable is None:
+                continue
+            self._queues[track] = compat_queue.Queue(maxsize=max_queued or 0)
+            writer = threading.Thread(
+                target=self._work, name='sink-{0!s}'.format(track), args=(track, writable))
+            writer.daemon = True
+            writer.start()
+            self._writers[track] = writer
+
+    def write(self, track, data):
+        """
+        Queue data for writing.
+
+        :param track: 'video' or 'audio'
+        :param data: bytes
+        """
+        if track in self._queues and track not in self._failed:
+            self._queues[track].put(data)
+
+    def _open(self, track, writable):
+        return writable
+
+    def _work(self, track, writable):
+        queue = self._queues[track]
+        f = None
+        while True:
+            data = queue.get()
+            if data is None:
+                break
+            if track in self._failed:
+                # discard what was queued before the failure
+                continue
+            try:
+                if f is None:
+                    f = self._open(track, writable)
+                f.write(data)
+                f.flush()
+            except (IOError, OSError) as ioe:
+                logger.error('Error writing {0!s} to sink, the rest of the track is dropped: {1!s}'.format(
+                    track, str(ioe)))
+                self._failed.add(track)
+        self._close_writable(track, f)
+
+    def _close_writable(self, track, f):
+        pass
+
+    def close(self):
+        """Flush all queued data and stop the writer threads."""
+        if self._is_closed:
+            return
+        self._is_closed = True
+        for queue in self._queues.values():
+            queue.put(None)
+        for writer in self._writers.values():
+            writer.join()
+
+
+class FFmpegSink(PipeSink):
+    """
+    Feeds the assembled live audio/video streams into an ffmpeg process
+    for restreaming or transcoding with low delay.
+
+    .. code-block:: python
+
+        # restream to an rtmp server
+        sink = live.FFmpegSink('rtmp://localhost/live/stream', output_args=['-c', 'copy', '-f', 'flv'])
+        # or pipe an mpeg-ts stream to stdout
+        sink = live.FFmpegSink('-', output_args=['-c', 'copy', '-f', 'mpegts'])
+        dl = live.Downloader(mpd, output_dir, sink=sink)
+
+    Requires a POSIX platform for the named pipes.
+    """
+
+    def __init__(self, output, output_args=('-c', 'copy', '-f', 'mpegts'), ffmpeg_binary=None, max_queued=None):
+        """
+
+        :param output: ffmpeg output, e.g. a url, file path or '-' for stdout
+        :param output_args: ffmpeg output options
+        :param ffmpeg_binary: custom ffmpeg binary path,
+            falls back to FFMPEG_BINARY path in env if available
+        :param max_queued: maximum number of segments waiting to be written per track, see :class:`PipeSink`
+        """
+        ffmpeg_binary = ffmpeg_binary or os.getenv('FFMPEG_BINARY', 'ffmpeg')
+        self.pipe_dir = tempfile.mkdtemp(prefix='igsink')
+        self.pipes = {}
+        for track in ('video', 'audio'):
+            self.pipes[track] = os.path.join(self.pipe_dir, track)
+            os.mkfifo(self.pipes[track])
+
+        ffmpeg_loglevel = 'error'
+        if logger.level == logging.DEBUG:
+            ffmpeg_loglevel = 'warning'
+        self.cmd = [
+            ffmpeg_binary, '-y',
+            '-loglevel', ffmpeg_loglevel,
+            '-i', self.pipes['audio'],
+            '-i', self.pipes['video']] + list(output_args) + [output]
+        self.process = subprocess.Popen(self.cmd)
+        super(FFmpegSink, self).__init__(
+            video=self.pipes['video'], audio=self.pipes['audio'], max_queued=max_queued)
+
+    def _open(self, track, writable):
+        # blocks until ffmpeg opens the pipe for reading
+        return open(writable, 'wb')
+
+    def _close_writable(self, track, f):
+        if f is None:
+            # Nothing was written, open the pipe anyway so that ffmpeg is not left waiting on it
+            while self.process.poll() is None:
+                try:
+                    f = os.fdopen(os.open(self.pipes[track], os.O_WRONLY | os.O_NONBLOCK), 'wb')
+                    break
+                except OSError:
+                    # ffmpeg has not opened the pipe for reading yet
+                    time.sleep(0.1)
+        if f is not None:
+            try:
+                f.close()
+            except (IOError, OSError) as ioe:
+                logger.warning('Error closing pipe: {0!s}'.format(str(ioe)))
+
+    def close(self):
+        """Flush all queued data and wait for ffmpeg to exit."""
+        if self._is_closed:
+            return
+        if self.process.poll() is not None:
+            # ffmpeg has already exited, unblock writers waiting on pipes
+            for pipe in self.pipes.values():
+                try:
+                    os.close(os.open(pipe, os.O_RDONLY | os.O_NONBLOCK))
+                except OSError:
+                    pass
+        super(FFmpegSink, self).close()
+        exit_code = self.process.wait()
+        if exit_code:
+            logger.error('ffmpeg exited with the code: {0!s}'.format(exit_code))
+            logger.error('Command: {0!s}'.format(' '.join(self.cmd)))
+        shutil.rmtree(self.pipe_dir, ignore_errors=True)
+
+
+class _Journal(object):
+    """
+    Append-only log of a live download's progress, one json record per line,
+    so that an interrupted download can be resumed.
+    """
+
+    def __init__(self, path):
+        """
+
+        :param path: journal file path
+        """
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Read all the records in the journal.
+
+        :return: list of dict
+        """
+        records = []
+        if not os.path.isfile(self.path):
+            return records
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # incomplete record from an interrupted write
+                    logger.warning('Skipping invalid journal record: {0!s}'.format(line.strip()))
+        return records
+
+    def write(self, record):
+        """
+        Append a record to the journal.
+
+        :param record: dict
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(json.dumps(record, sort_keys=True) + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except (IOError, OSError) as ioe:
+            logger.warning('Error removing {0!s}: {1!s}'.format(self.path, str(ioe)))
+
+
 class Downloader(object):
     """Downloads and assembles a given IG live stream"""
 
@@ -39,6 +895,20 @@ class Downloader(object):
     DUPLICATE_ETAG_RETRY = 30
     MAX_CONNECTION_ERROR_RETRY = 10
     SLEEP_INTERVAL_BEFORE_RETRY = 5
+    CALLBACK_TIMEOUT = 10
+    CALLBACK_INTERVAL = 5
+    MAX_WORKERS = 24
+    MAX_BACKFILL_RETRY = 3
+    BACKFILL_PRIORITY = 1
+    BACKLOG_PRIORITY = -1
+    BACKLOG_MODE = 'edge_first'
+    BACKLOG_MODES = ('edge_first', 'edge_only')
+    # number of segments per timeline at the live edge of the mpd when joining the stream
+    EDGE_SEGMENTS = 1
+    DOWNLOAD_CHUNK_SIZE = 1024 * 100
+    JOURNAL_FILENAME = 'journal.jsonl'
+    MUXER = 'auto'
+    STITCH_MAX_WORKERS = 4
 
     def __init__(self, mpd, output_dir, callback_check=None, singlethreaded=False, user_agent=None, **kwargs):
         """
@@ -47,9 +917,54 @@ class Downloader(object):
         :param output_dir: folder to store the downloaded files
         :param callback_check: callback function that can be used to check
             on stream status if the downloader cannot be sure that the stream
-            is over
+            is over. It runs in the background every ``callback_interval`` seconds while
+            the mpd is unchanged, so that the mpd polls carry on while it is in progress,
+            and the stream is stopped if it returns True.
         :param singlethreaded: flag to force single threaded downloads.
             Not advisable since this increases the probability of lost segments.
+        :param callback_timeout: seconds after which a ``callback_check`` call is given up on.
+            Its result is then ignored and the next check may start.
+        :param callback_interval: seconds between ``callback_check`` calls
+        :param max_workers: maximum number of concurrent segment downloads.
+            The connection pool is sized to match.
+        :param incremental_stitch: flag to append each segment to the stitch source files
+            as soon as it is downloaded so that :meth:`stitch` only needs to run ffmpeg.
+        :param sink: a :class:`PipeSink` or :class:`FFmpegSink` to write the live stream to
+            as the segments are downloaded. The sink is closed by :meth:`stop`.
+        :param adaptive_polling: flag to time mpd polls to when the next segment is expected
+            to be published, based on the segment timeline, instead of waiting the mpd
+            minimumUpdatePeriod after each poll. Polls back off when the mpd is unchanged.
+        :param session: a ``requests.Session`` to use instead of creating one
+        :param pool: a :class:`WorkerPool` or :class:`WorkerPoolChannel` to queue segment downloads on
+            instead of creating one. A :class:`WorkerPool` is used through a channel of its own
+            and is left running when the download stops, for its owner to shut down.
+        :param journal: True, or a file path, to keep a journal of the completed segments.
+            If the journal already exists, the download is resumed from it, skipping segments
+            that have already been downloaded. Defaults to ``journal.jsonl`` in ``output_dir``.
+        :param max_backfill_retry: number of times a failed segment download is re-queued, ahead of
+            new segments, while the segment is still in the mpd. Segments that cannot be recovered
+            are reported in :attr:`gaps`.
+        :param storage: a :class:`SegmentStorage` to store the downloaded segments in,
+            e.g. :class:`MemorySegmentStorage` or :class:`SpoolSegmentStorage`.
+            Defaults to a :class:`LocalSegmentStorage` of ``output_dir``.
+        :param muxer: ``auto`` to merge the audio and video in-process when stitching to an mp4 file,
+            falling back to ffmpeg if that fails, or ``ffmpeg`` to always use ffmpeg
+        :param stitch_max_workers: maximum number of resolution sections processed at the same time
+            by a parallel :meth:`stitch`
+        :param retry_scheduler: a :class:`RetryScheduler` to pace the retries of failed mpd and
+            segment requests, e.g. to share a retry budget and circuit breakers between downloaders
+        :param representation_policy: a :class:`selection.RepresentationPolicy` to choose the
+            representations with, e.g. to cap their bandwidth. Defaults to the best quality.
+        :param rendition: which of the video representations allowed by the policy to record,
+            0 for the best one, 1 for the next one down, etc.
+        :param backlog_mode: how the segments already buffered when joining the stream are fetched.
+            ``edge_first`` (default) fetches the live edge first and fills in the backlog behind
+            the new segments, ``edge_only`` skips the backlog for the lowest latency.
+        :param dvr_window: seconds of the stream to keep, for a DVR that only holds the most recent
+            segments so that the storage and memory used stay constant. Clips can be exported with
+            :meth:`export_clip` while the download runs. Every segment starts with its init segment
+            so that any clip can be played on its own. The storage defaults to a
+            :class:`MemorySegmentStorage`, and :meth:`stitch` only covers the window.
         :return:
         """
         self.mpd = mpd
@@ -58,11 +973,28 @@ class Downloader(object):
             os.makedirs(self.output_dir)
 
         self.threads = []
+        # in-flight segment download jobs keyed by segment identifier, released once done
         self.downloaders = {}
+        self._downloaders_lock = threading.Lock()
+        # file names of the segments that are done with, downloaded or not
+        self._completed = _SegmentIndex()
+        # file names of the segments evicted from the DVR that the mpd may still list
+        self._evicted = set()
         self.last_etag = ''
         self.duplicate_etag_count = 0
+        # validators for conditional mpd requests
+        self.last_mpd_etag = ''
+        self.last_mpd_modified = ''
+        # mpd minimumUpdatePeriod in seconds
+        self.update_period = 1
+        # media end time and duration in seconds of the latest segment in the last processed mpd
+        self.timeline_edge = 0.0
+        self.timeline_segment_duration = 0.0
         self.callback = callback_check
+        self._status_checker = None
         self.is_aborted = False
+        # set by stop(), unlike is_aborted the last mpd of an ended stream is still processed
+        self._is_stopped = False
         self.singlethreaded = singlethreaded
         self.stream_id = ''
         self.segment_meta = {}
@@ -74,41 +1006,198 @@ class Downloader(object):
                                            or self.MAX_CONNECTION_ERROR_RETRY)
         self.sleep_interval_before_retry = (kwargs.pop('sleep_interval_before_retry', None)
                                             or self.SLEEP_INTERVAL_BEFORE_RETRY)
-
-        session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=2, pool_maxsize=25)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        self.session = session
+        self.callback_timeout = kwargs.pop('callback_timeout', None) or self.CALLBACK_TIMEOUT
+        self.callback_interval = kwargs.pop('callback_interval', None) or self.CALLBACK_INTERVAL
+        self.max_backfill_retry = kwargs.pop('max_backfill_retry', self.MAX_BACKFILL_RETRY)
+        self.pool = kwargs.pop('pool', None)
+        self.max_workers = (kwargs.pop('max_workers', None)
+                            or (self.pool.max_workers if self.pool else self.MAX_WORKERS))
+        if not self.pool:
+            self.pool = self._new_pool()
+        elif isinstance(self.pool, WorkerPool):
+            # stop() shuts down self.pool, which must not stop a shared pool for its other users
+            self.pool = self.pool.channel(id(self))
+        self.incremental_stitch = kwargs.pop('incremental_stitch', False)
+        self._assembler = _SourceAssembler(self) if self.incremental_stitch else None
+        self.sink = kwargs.pop('sink', None)
+        self._sink_feeder = _SinkFeeder(self, self.sink) if self.sink else None
+        self.adaptive_polling = kwargs.pop('adaptive_polling', False)
+        self._poll_scheduler = _PollScheduler() if self.adaptive_polling else None
+
+        self.session = kwargs.pop('session', None) or self._new_session()
 
         # to store the duration of the initial buffered sgements available
         self.initial_buffered_duration = 0.0
 
+        # init segments keyed by url
+        self._init_chunks = {}
+        # selected representation and timeline position keyed by (period id, adaptation set id)
+        self._adaptation_sets = {}
+        self._timeline = _TimelineIndex()
+        # media end time in seconds of the latest segment downloaded
+        self._downloaded_edge = 0.0
+
+        self.metrics = DownloaderMetrics()
+        if self.pool:
+            self.metrics.set_gauge('segments_queued', lambda: self.pool.pending_count)
+            self.metrics.set_gauge('workers_alive', lambda: self.pool.alive_count)
+        self.metrics.set_gauge('live_edge_lag', self._live_edge_lag)
+
         # custom ffmpeg binary path, fallback to ffmpeg_binary path in env if available
         self.ffmpeg_binary = kwargs.pop('ffmpeg_binary', None) or os.getenv('FFMPEG_BINARY', 'ffmpeg')
 
+        self.dvr_window = kwargs.pop('dvr_window', None)
+        self.storage = kwargs.pop('storage', None) or (
+            MemorySegmentStorage() if self.dvr_window else LocalSegmentStorage(self.output_dir))
+        self._dvr = _DvrBuffer(self.storage, self.dvr_window) if self.dvr_window else None
+        self.muxer = kwargs.pop('muxer', None) or self.MUXER
+        self.stitch_max_workers = kwargs.pop('stitch_max_workers', None) or self.STITCH_MAX_WORKERS
+        self.retry_scheduler = kwargs.pop('retry_scheduler', None) or RetryScheduler()
+        self.representation_policy = kwargs.pop('representation_policy', None) or RepresentationPolicy()
+        self.rendition = kwargs.pop('rendition', 0)
+        self.backlog_mode = kwargs.pop('backlog_mode', None) or self.BACKLOG_MODE
+        if self.backlog_mode not in self.BACKLOG_MODES:
+            raise ValueError('Unknown backlog mode: {0!s}'.format(self.backlog_mode))
+
+        journal = kwargs.pop('journal', None)
+        self._journal = None
+        self._journaled_stream = None
+        if journal:
+            self._journal = _Journal(
+                os.path.join(self.output_dir, self.JOURNAL_FILENAME) if journal is True else journal)
+            self._resume()
+
+    def _live_edge_lag(self):
+        """Media seconds between the live edge and the latest segment downloaded."""
+        if not self.timeline_edge:
+            return 0.0
+        if not self._downloaded_edge:
+            return self.initial_buffered_duration
+        return max(0.0, self.timeline_edge - self._downloaded_edge)
+
+    @property
+    def gaps(self):
+        """
+        The gaps in the downloaded timeline, as a list of dicts with the keys
+
+        - ``representation``: representation id
+        - ``start``, ``end``: media time range in seconds
+        - ``reason``: ``timeline`` if the segments were never listed in the mpd,
+          or ``download`` if the segment could not be downloaded
+        - ``segment``: the segment that could not be downloaded, if any
+        """
+        return list(self._timeline.gaps)
+
+    @classmethod
+    def from_journal(cls, output_dir, journal=True, **kwargs):
+        """
+        Create a downloader from the journal of an earlier download,
+        e.g. to resume the download or to :meth:`stitch` the segments already downloaded.
+
+        :param output_dir: folder of the earlier download
+        :param journal: journal file path, defaults to ``journal.jsonl`` in ``output_dir``
+        :param kwargs: other :class:`Downloader` options
+        :return: :class:`Downloader`
+        """
+        journal_path = os.path.join(output_dir, cls.JOURNAL_FILENAME) if journal is True else journal
+        mpd = None
+        for record in _Journal(journal_path).load():
+            if record.get('type') == 'stream':
+                mpd = record.get('mpd')
+        if not mpd:
+            raise ValueError('No stream found in journal {0!s}.'.format(journal_path))
+        return cls(mpd, output_dir, journal=journal_path, **kwargs)
+
+    def _resume(self):
+        """Restore the stream metadata and completed segments from the journal."""
+        segment_meta = {}
+        completed = {}
+        for record in self._journal.load():
+            record_type = record.get('type')
+            if record_type == 'stream':
+                self.stream_id = record.get('stream_id') or self.stream_id
+                self.initial_buffered_duration = (
+                    record.get('initial_buffered_duration') or self.initial_buffered_duration)
+                self._journaled_stream = (self.stream_id, self.initial_buffered_duration)
+            elif record_type == 'segment':
+                segment_meta[record['segment']] = record['label']
+            elif record_type == 'done':
+                completed[record['id']] = record['file']
+
+        completed_files = []
+        for segment_file in completed.values():
+            if self.storage.exists(segment_file):
+                # skip segments that have already been downloaded
+                self._completed.add(segment_file)
+                completed_files.append(segment_file)
+        # segments that were not completed are treated as new if they are still in the mpd
+        for segment, label in segment_meta.items():
+            if segment in completed_files:
+                self.segment_meta[segment] = label
+        if completed_files:
+            logger.info('Resuming with {0:d} segment file(s) from {1!s}'.format(
+                len(completed_files), self._journal.path))
+
+        if self._assembler:
+            for segment in self.segment_meta:
+                self._assembler.add(segment)
+            for segment_file in completed_files:
+                self._assembler.complete(segment_file)
+
+    def _journal_stream(self):
+        stream = (self.stream_id, self.initial_buffered_duration)
+        if self._journal and stream != self._journaled_stream:
+            self._journal.write({
+                'type': 'stream', 'mpd': self.mpd, 'stream_id': self.stream_id,
+                'initial_buffered_duration': self.initial_buffered_duration})
+            self._journaled_stream = stream
+
     def _store_segment_meta(self, segment, representation):
         if segment not in self.segment_meta:
             self.segment_meta[segment] = representation
+            if self._journal:
+                self._journal.write({'type': 'segment', 'segment': segment, 'label': representation})
+            for timeline_buffer in (self._assembler, self._sink_feeder):
+                if timeline_buffer:
+                    timeline_buffer.add(segment)
 
     def run(self):
         """Begin downloading"""
+        if self.callback:
+            self._status_checker = _StatusChecker(self)
+            self._status_checker.start()
+        try:
+            self._poll()
+        finally:
+            self.stop()
+
+    def _poll(self):
+        """Poll the mpd until the stream ends or the download is aborted."""
         connection_retries_count = 0
         while not self.is_aborted:
             try:
+                origin_wait = self._mpd_origin_wait()
+                if origin_wait:
+                    time.sleep(origin_wait)
+                    continue
+                poll_started = time.time()
                 mpd, wait = self._download_mpd()
+                received_at = time.time()
                 connection_retries_count = 0    # reset count
 
                 if not self.duplicate_etag_count:
                     self._process_mpd(mpd)
+                    self._observe_timeline(received_at)
                 else:
                     logger.debug('Skip mpd processing: {0:d} - {1!s}'.format(
                         self.duplicate_etag_count, self.last_etag))
-                if wait:
-                    logger.debug('Sleeping for {0:d}s'.format(wait))
+                wait = self._next_poll_wait(poll_started, wait)
+                if wait > 0:
+                    logger.debug('Sleeping for {0:.2f}s'.format(wait))
                     time.sleep(wait)
 
             except requests.HTTPError as e:
+                self.metrics.inc('mpd_errors')
                 err_msg = 'HTTPError downloading {0!s}: {1!s}.'.format(self.mpd, e)
                 if e.response is not None and \
                         (e.response.status_code >= 500 or e.response.status_code == 404):
@@ -118,23 +1207,120 @@ class Downloader(object):
                     connection_retries_count += 1
                     if connection_retries_count <= self.max_connection_error_retry:
                         logger.warning(err_msg)
-                        time.sleep(self.sleep_interval_before_retry)
+                        time.sleep(self._mpd_retry_delay(connection_retries_count))
                     else:
                         logger.error(err_msg)
                         self.is_aborted = True
                 else:
                     logger.error(err_msg)
                     self.is_aborted = True
-            except requests.ConnectionError as e:
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.inc('mpd_errors')
                 # transient error maybe?
+                err_type = 'Timeout' if isinstance(e, requests.Timeout) else 'ConnectionError'
                 connection_retries_count += 1
                 if connection_retries_count <= self.max_connection_error_retry:
-                    logger.warning('ConnectionError downloading {0!s}: {1!s}. Retrying...'.format(self.mpd, e))
+                    logger.warning('{0!s} downloading {1!s}: {2!s}. Retrying...'.format(err_type, self.mpd, e))
+                    time.sleep(self._mpd_retry_delay(connection_retries_count))
                 else:
-                    logger.error('ConnectionError downloading {0!s}: {1!s}.'.format(self.mpd, e))
+                    logger.error('{0!s} downloading {1!s}: {2!s}.'.format(err_type, self.mpd, e))
                     self.is_aborted = True
 
-        self.stop()
+    def _mpd_origin_wait(self):
+        """Seconds to wait before polling because the mpd origin's circuit is open."""
+        origin_wait = self.retry_scheduler.origin_wait(self.mpd)
+        if origin_wait:
+            self.metrics.inc('requests_short_circuited')
+            logger.debug('mpd origin unavailable, waiting {0:.2f}s'.format(origin_wait))
+        return origin_wait
+
+    def _segment_origin_wait(self, target, identifier=None):
+        """
+        Seconds to wait before requesting a segment because its origin's circuit is open.
+
+        A segment waits for the circuit while it is still in the mpd so that a short outage
+        does not lose it. Segments from the mpd's origin leave the trial request to the mpd poll,
+        which must get through to tell whether the stream is still live. Init segments are
+        requested on the mpd poll path, and singlethreaded downloads fetch one segment at a time
+        inline, so neither waits.
+
+        :param target: segment url
+        :param identifier: segment identifier, None for an init segment
+        :return: 0 if the request can be made now, None to not make it
+        """
+        if self.singlethreaded:
+            return 0.0
+        origin_wait = self.retry_scheduler.origin_wait(
+            target, trial=self.retry_scheduler.origin(target) != self.retry_scheduler.origin(self.mpd))
+        if not origin_wait:
+            return 0.0
+        self.metrics.inc('requests_short_circuited')
+        if not identifier or self.is_aborted or not self._timeline.in_window(identifier):
+            logger.warning('Origin unavailable, not requesting {0!s}'.format(target))
+            return None
+        # check the window again at least every max_delay
+        origin_wait = min(origin_wait, self.retry_scheduler.max_delay)
+        logger.debug('Origin unavailable, waiting {0:.2f}s for {1!s}'.format(origin_wait, target))
+        return origin_wait
+
+    def _mpd_retry_delay(self, attempt):
+        # mpd polls are not amplified by retries so they are not limited by the retry budget
+        return self.retry_scheduler.backoff(attempt, max_delay=self.sleep_interval_before_retry)
+
+    @staticmethod
+    def _is_origin_failure(status_code):
+        """True if an HTTP status means the origin is failing, rather than the request."""
+        return status_code is None or status_code >= 500 or status_code == 429
+
+    def _retry_delay(self, attempt, max_attempts, err_msg):
+        """
+        Seconds to wait before retrying a failed segment request.
+
+        :param attempt: number of attempts made so far
+        :param max_attempts: maximum number of attempts
+        :param err_msg: description of the failure
+        :return: None to give up
+        """
+        if attempt >= max_attempts:
+            logger.error(err_msg)
+            return None
+        # singlethreaded downloads make one request at a time so their retries cannot amplify an outage
+        if not self.singlethreaded and not self.retry_scheduler.acquire_retry():
+            self.metrics.inc('retries_denied')
+            logger.error('{0!s}. Retry budget exhausted.'.format(err_msg))
+            return None
+        logger.warning('{0!s}. Retrying... '.format(err_msg))
+        return self.retry_scheduler.backoff(attempt)
+
+    def _observe_timeline(self, received_at):
+        if self._poll_scheduler:
+            self._poll_scheduler.observe(self.timeline_edge, self.timeline_segment_duration, received_at)
+
+    def _next_poll_wait(self, poll_started, update_period):
+        """
+        Seconds to wait before the next mpd poll.
+
+        :param poll_started: time the last poll was started
+        :param update_period: the mpd minimumUpdatePeriod
+        """
+        now = time.time()
+        if self._poll_scheduler:
+            return self._poll_scheduler.next_wait(update_period, self.duplicate_etag_count, now)
+        # don't count the time spent polling and processing
+        return update_period - (now - poll_started)
+
+    def _new_pool(self):
+        """The worker pool for the segment downloads when none is given."""
+        return WorkerPool(self.max_workers, name='segment')
+
+    def _new_session(self):
+        """The requests session for the mpd and segment downloads when none is given."""
+        session = requests.Session()
+        # one connection per worker, plus one for the mpd
+        adapter = requests.adapters.HTTPAdapter(max_retries=2, pool_maxsize=self.max_workers + 1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def stop(self):
         """
@@ -145,37 +1331,96 @@ class Downloader(object):
         :return:
         """
         self.is_aborted = True
+        self._is_stopped = True
+        if self._status_checker:
+            self._status_checker.stop()
         if not self.singlethreaded:
             logger.debug('Stopping download threads...')
-            threads = self.downloaders.values()
-            logger.debug('{0:d} of {1:d} threads are alive'.format(
-                len([t for t in threads if t and t.is_alive()]),
-                len(threads)))
-            [t.join() for t in threads if t and t.is_alive()]
+            with self._downloaders_lock:
+                jobs = list(self.downloaders.values())
+            logger.debug('{0:d} download(s) are pending'.format(len(jobs)))
+            # Queued downloads are still completed before the workers exit
+            self.pool.shutdown(wait=True)
+        self.storage.flush()
+        self._close_sink()
+        self._release_representations()
+        if self._journal:
+            self._journal.close()
+
+    def _release_representations(self, keep=()):
+        """Return the bandwidth of the selected representations to the policy, except for the ``keep`` keys."""
+        for key in self._adaptation_sets:
+            if key not in keep:
+                self.representation_policy.release((id(self), ) + key)
 
     def _download_mpd(self):
-        """Downloads the mpd stream info and returns the xml object."""
+        """
+        Downloads the mpd stream info and returns the xml object.
+        The xml object is None if the mpd is unchanged from the last request.
+        """
         logger.debug('Requesting {0!s}'.format(self.mpd))
-        res = self.session.get(self.mpd, headers={
+        requested_at = time.time()
+        try:
+            res = self.session.get(
+                self.mpd, headers=self._mpd_request_headers(), timeout=self.mpd_download_timeout)
+        except requests.RequestException:
+            self.retry_scheduler.record(self.mpd, False)
+            raise
+        self.retry_scheduler.record(self.mpd, not self._is_origin_failure(res.status_code))
+        res.raise_for_status()
+        latency = time.time() - requested_at
+
+        not_modified = res.status_code == 304
+        self._check_mpd_response(res.headers, None if not_modified else res.content)
+        self.metrics.observe_poll(latency, not_modified=not_modified, duplicate=bool(self.duplicate_etag_count))
+        if self.duplicate_etag_count:
+            # mpd will not be processed so don't bother parsing it
+            return None, self.update_period
+        mpd, self.update_period = self._parse_mpd(res.text)
+        return mpd, self.update_period
+
+    def _mpd_request_headers(self):
+        """Request headers for the mpd, made conditional on the last response received."""
+        headers = {
             'User-Agent': self.user_agent,
             'Accept': '*/*',
-        }, timeout=self.mpd_download_timeout)
-        res.raise_for_status()
+        }
+        if self.last_mpd_etag:
+            headers['If-None-Match'] = self.last_mpd_etag
+        if self.last_mpd_modified:
+            headers['If-Modified-Since'] = self.last_mpd_modified
+        return headers
+
+    def _check_mpd_response(self, headers, content):
+        """
+        Inspects the mpd response headers to detect if the stream has ended.
 
+        :param headers: response headers
+        :param content: response body, None if the server responded with a 304 Not Modified
+        """
         # IG used to send this header when the broadcast ended.
         # Leaving it in in case it returns.
-        broadcast_ended = res.headers.get('X-FB-Video-Broadcast-Ended', '')
+        broadcast_ended = headers.get('X-FB-Video-Broadcast-Ended', '')
         # Use the cache-control header as indicator that stream has ended
-        cache_control = res.headers.get('Cache-Control', '')
+        cache_control = headers.get('Cache-Control', '')
         mobj = re.match(r'max\-age=(?P<age>[0-9]+)', cache_control)
         if mobj:
             max_age = int(mobj.group('age'))
         else:
             max_age = 0
 
+        if content is not None:
+            # remember validators for the next conditional request
+            self.last_mpd_etag = headers.get('ETag', '')
+            self.last_mpd_modified = headers.get('Last-Modified', '')
+
         # Use ETag to detect if the same mpd is received repeatedly
         # if missing, use contents hash as psuedo etag
-        etag = res.headers.get('ETag') or hashlib.md5(res.content).hexdigest()
+        if content is None:
+            # 304 Not Modified
+            etag = self.last_etag
+        else:
+            etag = headers.get('ETag') or hashlib.md5(content).hexdigest()
         if etag != self.last_etag:
             self.last_etag = etag
             self.duplicate_etag_count = 0
@@ -190,26 +1435,30 @@ class Downloader(object):
             logger.info('Stream ended (cache-control: {0!s}).'.format(cache_control))
             self.is_aborted = True
         else:
-            # Periodically check callback if duplicate etag is detected
+            # Periodically warn if duplicate etag is detected
             if self.duplicate_etag_count and (self.duplicate_etag_count % 5 == 0):
                 logger.warning('Duplicate etag {0!s} detected {1:d} time(s)'.format(
                     etag, self.duplicate_etag_count))
-                if self.callback:
-                    callback = self.callback
-                    try:
-                        abort = callback()
-                        if abort:
-                            logger.debug('Callback returned True')
-                            self.is_aborted = True
-                    except Exception as e:      # pylint: disable=broad-except
-                        logger.warning('Error from callback: {0!s}'.format(str(e)))
             # Final hard abort
             elif self.duplicate_etag_count >= self.duplicate_etag_retry:
                 logger.info('Stream likely ended (duplicate etag/hash detected).')
                 self.is_aborted = True
 
+    def _on_status_checked(self, abort):
+        if abort:
+            logger.debug('Callback returned True')
+            self.is_aborted = True
+
+    @staticmethod
+    def _parse_mpd(mpd_text):
+        """
+        Parses the mpd xml.
+
+        :param mpd_text: mpd contents
+        :return: tuple of the xml object and the number of seconds to wait before the next poll
+        """
         xml.etree.ElementTree.register_namespace('', MPD_NAMESPACE['mpd'])
-        mpd = xml.etree.ElementTree.fromstring(res.text)
+        mpd = xml.etree.ElementTree.fromstring(mpd_text)
         minimum_update_period = mpd.attrib.get('minimumUpdatePeriod', '')
         mobj = re.match('PT(?P<secs>[0-9]+)S', minimum_update_period)
         if mobj:
@@ -219,47 +1468,126 @@ class Downloader(object):
         return mpd, after
 
     def _process_mpd(self, mpd):
+        segments = list(self._iter_mpd_segments(mpd))
+        # the stream is journaled before any of its segments can be done
+        self._journal_stream()
+        backlog = []
+        for segment in segments:
+            if segment[4]:
+                # queued after the live edge segments
+                backlog.append(segment)
+                continue
+            self._process_segment(*segment)
+        for segment in backlog:
+            self._process_segment(*segment)
+        self._prune_init_chunks()
+
+    def _process_segment(self, identifier, segment_url, output, init_segment_url, is_backlog):
+        if self._is_stopped or not self._is_new_segment(identifier, os.path.basename(output)):
+            return
+        # Append init chunk to first segment in the timeline for now
+        # Not sure if it's needed for every segment yet
+        init_chunk = None
+        if init_segment_url:
+            init_chunk = self._get_init_chunk(init_segment_url)
+        self._extract(
+            identifier, segment_url, output, init_chunk=init_chunk,
+            priority=self.BACKLOG_PRIORITY if is_backlog else 0)
+
+    def _is_new_segment(self, identifier, segment_file):
+        """
+        False if the segment is being downloaded or is done with, e.g. resumed from the journal.
+
+        :param identifier: segment identifier
+        :param segment_file: segment file name
+        """
+        # a finished download is added to the completed segments before it is released
+        if identifier in self.downloaders:
+            logger.debug('Already downloading {0!s}'.format(identifier))
+            return False
+        if segment_file in self._completed:
+            logger.debug('Already downloaded {0!s}'.format(identifier))
+            self._timeline.discard(identifier)
+            return False
+        return True
+
+    def _get_init_chunk(self, init_segment_url):
+        """
+        Returns the init segment, downloading it only if it is not already cached.
+
+        :param init_segment_url: init segment url
+        """
+        init_chunk = self._init_chunks.get(init_segment_url)
+        if init_chunk is None:
+            # download init segment
+            init_chunk = self._download(
+                init_segment_url, None, timeout=self.mpd_download_timeout)
+            if init_chunk is not None:
+                self._init_chunks[init_segment_url] = init_chunk
+        return init_chunk
+
+    def _prune_init_chunks(self):
+        """
+        Drop cached init segments that are no longer in the mpd,
+        i.e. the representation or init url has changed.
+        """
+        init_segment_urls = set([state['init_segment_url'] for state in self._adaptation_sets.values()])
+        for init_segment_url in list(self._init_chunks.keys()):
+            if init_segment_url not in init_segment_urls:
+                logger.debug('Init segment no longer in use: {0!s}'.format(init_segment_url))
+                del self._init_chunks[init_segment_url]
+
+    def _iter_mpd_segments(self, mpd):
+        """
+        Walks the mpd timelines and records the stream metadata.
+
+        The selected representation and segment template for each adaptation set is cached
+        and only the timeline segments after the last one seen are walked.
+
+        When joining the stream, the segments buffered behind the live edge are flagged as backlog,
+        or skipped in the ``edge_only`` backlog mode. With a DVR, the backlog that is already
+        older than the DVR window is skipped too.
+
+        :param mpd: mpd xml object
+        :return: generator of (identifier, segment url, output path, init segment url, is backlog) tuples.
+            The init segment url is only set for the first segment in each timeline.
+        """
+        joining = not self._adaptation_sets
         periods = mpd.findall('mpd:Period', MPD_NAMESPACE)
         logger.debug('Found {0:d} period(s)'.format(len(periods)))
+        self.timeline_edge = 0.0
+        self.timeline_segment_duration = 0.0
+        adaptation_sets = {}
+        # file names of all the segments in the mpd, to tell when evicted segments are no longer listed
+        listed = set()
         # Aaccording to specs, multiple periods are allow but IG only sends one usually
         for period in periods:
             logger.debug('Processing period {0!s}'.format(period.attrib.get('id')))
-            for adaptation_set in period.findall('mpd:AdaptationSet', MPD_NAMESPACE):
+            for n, adaptation_set in enumerate(period.findall('mpd:AdaptationSet', MPD_NAMESPACE)):
+                key = (period.attrib.get('id'), adaptation_set.attrib.get('id') or n)
                 representations = adaptation_set.findall('mpd:Representation', MPD_NAMESPACE)
-                # sort representations by quality and pick best one
-                representations = sorted(
-                    representations,
-                    key=lambda rep: (
-                        (int(rep.attrib.get('width', '0')) * int(rep.attrib.get('height', '0'))) or
-                        int(rep.attrib.get('bandwidth', '0')) or
-                        rep.attrib.get('FBQualityLabel') or
-                        int(rep.attrib.get('audioSamplingRate', '0'))),
-                    reverse=True)
-                representation = representations[0]
-                representation_id = representation.attrib.get('id', '')
-                logger.debug(
-                    'Selected representation with id {0!s} out of {1!s}'.format(
-                        representation_id,
-                        ' / '.join([r.attrib.get('id', '') for r in representations])
-                    ))
-
-                representation_label = ''
-                # only store segments meta for video
-                if 'video' in representation.attrib.get('mimeType', ''):
-                    if representation.attrib.get('FBQualityLabel'):
-                        representation_label = representation.attrib.get('FBQualityLabel')
-                    elif representation.attrib.get('width') and representation.attrib.get('height'):
-                        representation_label = '{0!s}x{1!s}'.format(
-                            representation.attrib.get('width'),
-                            representation.attrib.get('height'))
-                    elif representation_id:
-                        representation_label = representation_id
+                signature = tuple([tuple(sorted(r.attrib.items())) for r in representations])
 
-                segment_template = representation.find('mpd:SegmentTemplate', MPD_NAMESPACE)
+                state = self._adaptation_sets.get(key)
+                if not state or state['signature'] != signature:
+                    state = self._select_representation(representations, key)
+                    state['signature'] = signature
+                representation = representations[state['index']]
+                representation_id = state['representation_id']
 
-                init_segment = segment_template.attrib.get('initialization')
-                media_name = segment_template.attrib.get('media')
-                timescale = int(segment_template.attrib.get('timescale'))
+                segment_template = representation.find('mpd:SegmentTemplate', MPD_NAMESPACE)
+                template = (
+                    segment_template.attrib.get('initialization'),
+                    segment_template.attrib.get('media'),
+                    int(segment_template.attrib.get('timescale')))
+                if state.get('template') != template:
+                    # new representation or template, walk the whole timeline
+                    state['template'] = template
+                    state['init_segment_url'] = compat_urlparse.urljoin(self.mpd, template[0])
+                    state['last_t'] = None
+                    self._timeline.reset(key)
+                adaptation_sets[key] = state
+                init_segment, media_name, timescale = template
 
                 # store stream ID
                 if not self.stream_id:
@@ -271,85 +1599,357 @@ class Downloader(object):
                 segment_timeline = segment_template.find('mpd:SegmentTimeline', MPD_NAMESPACE)
                 segments = segment_timeline.findall('mpd:S', MPD_NAMESPACE)
 
-                buffered_duration = 0
-                for i, seg in enumerate(segments):
-                    buffered_duration += int(seg.attrib.get('d'))
+                # skip segments that have been seen in previous mpds
+                start = len(segments)
+                while start and (state['last_t'] is None or
+                                 int(segments[start - 1].attrib.get('t')) > state['last_t']):
+                    start -= 1
+                logger.debug('{0:d} new segment(s) for representation {1!s}'.format(
+                    len(segments) - start, representation_id))
+                if segments:
+                    self._timeline.set_window(key, int(segments[0].attrib.get('t')))
+
+                # segments before the live edge when joining the stream
+                backlog_end = max(0, len(segments) - self.EDGE_SEGMENTS) if joining else 0
+                skip_to = start
+                if self.backlog_mode == 'edge_only':
+                    skip_to = max(start, backlog_end)
+                elif self._dvr and segments:
+                    # the DVR would evict the backlog that is already older than its window
+                    window_start = self._segment_end(segments[-1], timescale) - self._dvr.window
+                    while skip_to < backlog_end and self._segment_end(segments[skip_to], timescale) <= window_start:
+                        skip_to += 1
+                first = 0
+                if skip_to > start:
+                    logger.debug('Skipping {0:d} backlog segment(s) for representation {1!s}'.format(
+                        skip_to - start, representation_id))
+                    self.metrics.inc('backlog_skipped', skip_to - start)
+                    first = start = skip_to
+
+                if self._dvr:
+                    listed.update([self._segment_basename(media_name, seg, representation_id) for seg in segments])
+
+                for i in range(start, len(segments)):
+                    seg = segments[i]
                     seg_filename = media_name.replace(
                         '$Time$', seg.attrib.get('t')).replace('$RepresentationID$', representation_id)
                     segment_url = compat_urlparse.urljoin(self.mpd, seg_filename)
-
-                    if representation_label:
-                        self._store_segment_meta(
-                            os.path.basename(compat_urlparse.urlparse(seg_filename).path), representation_label)
-
-                    # Append init chunk to first segment in the timeline for now
-                    # Not sure if it's needed for every segment yet
-                    init_chunk = None
-                    if i == 0:
-                        # download init segment
-                        init_segment_url = compat_urlparse.urljoin(self.mpd, init_segment)
-                        init_chunk = self._download(
-                            init_segment_url, None, timeout=self.mpd_download_timeout)
-
-                    self._extract(
+                    seg_basename = os.path.basename(compat_urlparse.urlparse(seg_filename).path)
+                    if seg_basename in self._evicted:
+                        # walked again after a representation change, but already evicted from the DVR
+                        continue
+
+                    if state['label']:
+                        self._store_segment_meta(seg_basename, state['label'])
+                    self._timeline.add(
+                        key, representation_id, os.path.basename(seg_filename),
+                        int(seg.attrib.get('t')), int(seg.attrib.get('d')), timescale)
+
+                    init_segment_url = None
+                    if i == first or self._dvr:
+                        # Append init chunk to first segment in the timeline,
+                        # or to every segment so that the DVR can drop any of them
+                        init_segment_url = state['init_segment_url']
+
+                    yield (
                         os.path.basename(seg_filename),
                         segment_url,
-                        os.path.join(
-                            self.output_dir,
-                            os.path.basename(
-                                compat_urlparse.urlparse(seg_filename).path)
-                        ),
-                        init_chunk=init_chunk)
+                        os.path.join(self.output_dir, seg_basename),
+                        init_segment_url,
+                        i < backlog_end)
+
+                if segments:
+                    last_segment = segments[-1]
+                    state['last_t'] = int(last_segment.attrib.get('t'))
+                    edge = self._segment_end(last_segment, timescale)
+                    if edge > self.timeline_edge:
+                        self.timeline_edge = edge
+                        self.timeline_segment_duration = float(last_segment.attrib.get('d')) / timescale
 
                 if not self.initial_buffered_duration:
+                    buffered_duration = sum([int(seg.attrib.get('d')) for seg in segments])
                     self.initial_buffered_duration = float(buffered_duration) / timescale
                     logger.debug('Initial buffered duration: {0!s}'.format(self.initial_buffered_duration))
+        self._release_representations(keep=adaptation_sets)
+        self._adaptation_sets = adaptation_sets
+        self._forget_evicted(listed)
 
-    def _extract(self, identifier, target, output, init_chunk=None):
-        if identifier in self.downloaders:
-            logger.debug('Already downloading {0!s}'.format(identifier))
+    @staticmethod
+    def _segment_basename(media_name, seg, representation_id):
+        """File name of a timeline segment."""
+        seg_filename = media_name.replace(
+            '$Time$', seg.attrib.get('t')).replace('$RepresentationID$', representation_id)
+        return os.path.basename(compat_urlparse.urlparse(seg_filename).path)
+
+    @staticmethod
+    def _segment_end(seg, timescale):
+        """Media end time in seconds of a timeline segment."""
+        return float(int(seg.attrib.get('t')) + int(seg.attrib.get('d'))) / timescale
+
+    def _select_representation(self, representations, key):
+        """
+        Pick a representation with the :class:`RepresentationPolicy`.
+
+        :param representations: list of Representation xml objects
+        :param key: adaptation set key
+        :return: dict with the index, id and label of the selected representation
+        """
+        # the rendition only applies to video, the best audio is always used
+        is_video = any(['video' in r.attrib.get('mimeType', '') for r in representations])
+        index = self.representation_policy.select(
+            representations, key=(id(self), ) + key, rendition=self.rendition if is_video else 0)
+        representation = representations[index]
+        representation_id = representation.attrib.get('id', '')
+        logger.debug(
+            'Selected representation with id {0!s} out of {1!s}'.format(
+                representation_id,
+                ' / '.join([r.attrib.get('id', '') for r in representations])
+            ))
+
+        representation_label = ''
+        # only store segments meta for video
+        if 'video' in representation.attrib.get('mimeType', ''):
+            if representation.attrib.get('FBQualityLabel'):
+                representation_label = representation.attrib.get('FBQualityLabel')
+            elif representation.attrib.get('width') and representation.attrib.get('height'):
+                representation_label = '{0!s}x{1!s}'.format(
+                    representation.attrib.get('width'),
+                    representation.attrib.get('height'))
+            elif representation_id:
+                representation_label = representation_id
+
+        return {
+            'index': index,
+            'representation_id': representation_id,
+            'label': representation_label,
+        }
+
+    def _extract(self, identifier, target, output, init_chunk=None, priority=0):
+        if self._is_stopped or not self._is_new_segment(identifier, os.path.basename(output)):
             return
         logger.debug('Requesting {0!s}'.format(target))
+        self.metrics.inc('segments_started')
         if self.singlethreaded:
-            self._download(target, output, init_chunk=init_chunk)
+            self._download_segment(target, output, init_chunk=init_chunk, identifier=identifier)
+            return
+        try:
+            # queue the download for the worker pool, the job is registered
+            # before it can be released by its worker
+            with self._downloaders_lock:
+                self.downloaders[identifier] = self.pool.submit_prioritized(
+                    priority, self._download_segment, target=target, output=output, init_chunk=init_chunk,
+                    identifier=identifier)
+        except RuntimeError:
+            # stop() was called from another thread while the mpd was being processed
+            logger.debug('Download stopped, not requesting {0!s}'.format(target))
+            self.metrics.inc('segments_started', -1)
+            self.is_aborted = True
+
+    def _download_segment(self, target, output, init_chunk=None, identifier=None, attempt=0):
+        # the segment is reported as completed or failed however the download ends,
+        # unless the report is left to a retry
+        retried = False
+        try:
+            requested = self._download(target, output, init_chunk=init_chunk, identifier=identifier)
+            # a segment that was not requested because its origin is down is not backfilled
+            if (requested is not False and not self.storage.exists(os.path.basename(output))
+                    and self._can_backfill(identifier, attempt)):
+                retried = True
+                try:
+                    # retry ahead of the new segments while the segment is still available
+                    with self._downloaders_lock:
+                        self.downloaders[identifier] = self.pool.submit_prioritized(
+                            self.BACKFILL_PRIORITY, self._download_segment, target=target, output=output,
+                            init_chunk=init_chunk, identifier=identifier, attempt=attempt + 1)
+                except RuntimeError:
+                    # the pool is shutting down, retry in this worker instead
+                    self._download_segment(
+                        target, output, init_chunk=init_chunk, identifier=identifier, attempt=attempt + 1)
+        finally:
+            if not retried:
+                self._on_segment_downloaded(output, identifier=identifier)
+
+    def _can_backfill(self, identifier, attempt):
+        """True if a failed segment download should be queued again."""
+        if self.singlethreaded or attempt >= self.max_backfill_retry:
+            return False
+        if not self._timeline.in_window(identifier):
+            logger.debug('{0!s} is no longer in the mpd'.format(identifier))
+            return False
+        if not self.retry_scheduler.acquire_retry():
+            self.metrics.inc('retries_denied')
+            logger.warning('Not backfilling {0!s}, the retry budget is exhausted'.format(identifier))
+            return False
+        logger.warning('Backfilling {0!s}, attempt {1:d}'.format(identifier, attempt + 1))
+        self.metrics.inc('segment_backfills')
+        return True
+
+    def _on_segment_downloaded(self, output, identifier=None):
+        ok = self.storage.exists(os.path.basename(output))
+        identifier = identifier or os.path.basename(output)
+        segment_span = None
+        if ok:
+            self.metrics.inc('segments_downloaded')
+            segment_span = self._timeline.discard(identifier)
+            if segment_span and segment_span[1] > self._downloaded_edge:
+                self._downloaded_edge = segment_span[1]
         else:
-            # push each download into it's own thread
-            t = threading.Thread(
-                target=self._download, name=identifier,
-                kwargs={'target': target, 'output': output, 'init_chunk': init_chunk})
-            t.start()
-            self.downloaders[identifier] = t
-
-    def _download(self, target, output, timeout=None, init_chunk=None):
+            self.metrics.inc('segments_failed')
+            self._timeline.add_missing(identifier)
+        if ok and self._journal:
+            self._journal.write({
+                'type': 'done', 'id': identifier, 'file': os.path.basename(output)})
+        for timeline_buffer in (self._assembler, self._sink_feeder):
+            if timeline_buffer:
+                timeline_buffer.complete(os.path.basename(output), ok=ok)
+        self._release_download(identifier, os.path.basename(output))
+        if self._dvr:
+            if not ok:
+                # nothing to keep
+                self._evict([os.path.basename(output)])
+            elif segment_span:
+                # after the segment is released so that it cannot be evicted before it is completed
+                self._evict(self._dvr.add(os.path.basename(output), *segment_span))
+
+    def _release_download(self, identifier, segment_file):
+        """Move a finished download from the in-flight jobs to the completed segments."""
+        self._completed.add(segment_file)
+        with self._downloaders_lock:
+            self.downloaders.pop(identifier, None)
+
+    def _evict(self, segments):
+        """
+        Forget the segments that have been evicted from the DVR. They stay in the completed
+        segments until the mpd no longer lists them so that they are not downloaded again.
+        """
+        with self._downloaders_lock:
+            for segment in segments:
+                self.segment_meta.pop(segment, None)
+                self._evicted.add(segment)
+
+    def _forget_evicted(self, listed):
+        """
+        Drop the evicted segments that are no longer in the mpd from the completed segments.
+
+        :param listed: file names of the segments in the mpd
+        """
+        with self._downloaders_lock:
+            unlisted = self._evicted - listed
+            self._evicted -= unlisted
+        for segment in unlisted:
+            self._completed.pop(segment, None)
+
+    @property
+    def dvr_range(self):
+        """
+        Media (start, end) time in seconds of the segments held by the DVR,
+        None if the DVR is empty or not enabled with ``dvr_window``.
+        """
+        return self._dvr.range if self._dvr else None
+
+    def export_clip(self, output_filename, start=None, end=None):
+        """
+        Export the segments held by the DVR between two points in the stream as one file,
+        without stopping the download. The clip is cut at segment boundaries and,
+        if the resolution changes within the range, starts after the last change.
+
+        .. code-block:: python
+
+            dl = live.Downloader(mpd, output_dir, dvr_window=300)
+            # ... while dl.run() is running on another thread
+            _, end = dl.dvr_range
+            dl.export_clip('highlight.mp4', start=end - 60)
+
+        :param output_filename: output file path
+        :param start: media time in seconds, see :attr:`dvr_range`. Defaults to the start of the DVR.
+        :param end: media time in seconds. Defaults to the end of the DVR.
+        :return: True if the clip was generated
+        """
+        if not self._dvr:
+            raise ValueError('DVR is not enabled, set dvr_window.')
+        with self._dvr.hold():
+            segments = [name for name, _, _ in self._dvr.segments(start, end) if name in self.segment_meta]
+            # only the segments with both tracks stored
+            segments = [s for s in segments if self.storage.exists(s.replace('.m4v', '.m4a'))]
+            if not segments:
+                logger.warning('No segments to export in {0!s}'.format(output_filename))
+                return False
+            labels = [self.segment_meta.get(s) for s in segments]
+            first = len(labels) - 1
+            while first and labels[first - 1] == labels[-1]:
+                first -= 1
+            if first:
+                logger.warning('Resolution changed, {0:d} segment(s) left out of {1!s}'.format(
+                    first, output_filename))
+            ok = self._mux_segments(segments[first:], output_filename)
+        if ok is None:
+            logger.error('Named pipes are not available to export {0!s}'.format(output_filename))
+        return bool(ok)
+
+    def _close_sink(self):
+        if self._sink_feeder:
+            self._sink_feeder.finish()
+            self.sink.close()
+
+    def _download(self, target, output, timeout=None, init_chunk=None, identifier=None):
+        """
+        Download a segment, or an init segment if ``output`` is not set.
+
+        :return: the init segment content, or False if the segment was not requested
+            because its origin is unavailable
+        """
         retry_attempts = self.max_connection_error_retry + 1
         for i in range(1, retry_attempts + 1):
+            # waiting for the origin does not use up an attempt
+            origin_wait = self._segment_origin_wait(target, identifier)
+            while origin_wait:
+                time.sleep(origin_wait)
+                origin_wait = self._segment_origin_wait(target, identifier)
+            if origin_wait is None:
+                if output:
+                    self.metrics.inc('segment_retries', i - 1)
+                    return False
+                return None
             try:
-                res = self.session.get(target, headers={
-                    'User-Agent': self.user_agent,
-                    'Accept': '*/*',
-                }, timeout=timeout or self.download_timeout)
-                res.raise_for_status()
-
-                if not output:
-                    return res.content
-
-                with open(output, 'wb') as f:
-                    if init_chunk:
-                        # prepend init chunk
-                        logger.debug('Appended chunk len {0:d} to {1!s}'.format(
-                            len(init_chunk), output))
-                        f.write(init_chunk)
-                    f.write(res.content)
+                requested_at = time.time()
+                with closing(self.session.get(target, headers={
+                        'User-Agent': self.user_agent,
+                        'Accept': '*/*',
+                }, timeout=timeout or self.download_timeout, stream=True)) as res:
+                    self.retry_scheduler.record(target, not self._is_origin_failure(res.status_code))
+                    res.raise_for_status()
+
+                    if not output:
+                        return res.content
+
+                    size = 0
+                    with self.storage.open_write(os.path.basename(output)) as f:
+                        if init_chunk:
+                            # prepend init chunk
+                            logger.debug('Appended chunk len {0:d} to {1!s}'.format(
+                                len(init_chunk), output))
+                            f.write(init_chunk)
+                        for chunk in res.iter_content(chunk_size=self.DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                            size += len(chunk)
+                self.metrics.observe_segment(time.time() - requested_at, size, i - 1)
                 return
-            except (requests.HTTPError, requests.ConnectionError) as e:
+            except (requests.HTTPError, requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
                 if isinstance(e, requests.HTTPError):
                     err_msg = 'HTTPError {0:d} {1!s}: {2!s}.'.format(e.response.status_code, target, e)
+                elif isinstance(e, requests.Timeout):
+                    self.retry_scheduler.record(target, False)
+                    err_msg = 'Timeout {0!s}: {1!s}'.format(target, e)
                 else:
+                    self.retry_scheduler.record(target, False)
                     err_msg = 'ConnectionError {0!s}: {1!s}'.format(target, e)
-                if i < retry_attempts:
-                    logger.warning('{0!s}. Retrying... '.format(err_msg))
-                else:
-                    logger.error(err_msg)
+            delay = self._retry_delay(i, retry_attempts, err_msg)
+            if delay is None:
+                break
+            time.sleep(delay)
+        if output:
+            self.metrics.inc('segment_retries', i - 1)
 
     @staticmethod
     def _get_file_index(filename):
@@ -361,146 +1961,235 @@ class Downloader(object):
 
     def stitch(self, output_filename,
                skipffmpeg=False,
-               cleartempfiles=True):
+               cleartempfiles=True,
+               parallel=False,
+               direct=False):
         """
         Combines all the dowloaded stream segments into the final mp4 file.
 
         :param output_filename: Output file path
         :param skipffmpeg: bool flag to not use ffmpeg to join audio and video file into final mp4
         :param cleartempfiles: bool flag to remove downloaded and temp files
+        :param parallel: bool flag to assemble the audio and video source files at the same time,
+            and to process up to ``stitch_max_workers`` resolution sections at the same time
+        :param direct: bool flag to mux the segments without writing the intermediate
+            ``source_*.tmp`` files first. The mp4 muxer reads the stored segments in place or,
+            failing that, ffmpeg reads the segments through named pipes. Ignored with ``skipffmpeg``
+            or ``incremental_stitch``, and where named pipes are not available when ffmpeg is needed.
         """
         if not self.stream_id:
             raise ValueError('No stream ID found.')
 
-        has_ffmpeg_error = False
-        files_generated = []
-
         all_segments = sorted(
             self.segment_meta.keys(),
             key=lambda x: self._get_file_index(x))    # pylint: disable=unnecessary-lambda
-        prev_res = ''
-        sources = []
-        audio_stream_format = 'source_{0}_{1}_m4a.tmp'
-        video_stream_format = 'source_{0}_{1}_m4v.tmp'
-        video_stream = ''
-        audio_stream = ''
 
         # Iterate through all the segments and generate a pair of source files
         # for each time a resolution change is detected
-        for segment in all_segments:
-
-            video_stream = os.path.join(
-                self.output_dir, video_stream_format.format(self.stream_id, len(sources)))
-            audio_stream = os.path.join(
-                self.output_dir, audio_stream_format.format(self.stream_id, len(sources)))
-
-            if not os.path.isfile(os.path.join(self.output_dir, segment)):
-                logger.warning('Segment not found: {0!s}'.format(segment))
-                continue
-
-            if not os.path.isfile(os.path.join(self.output_dir, segment.replace('.m4v', '.m4a'))):
-                logger.warning('Segment not found: {0!s}'.format(segment.replace('.m4v', '.m4a')))
-                continue
-
-            if prev_res and prev_res != self.segment_meta[segment]:
-                # resolution change detected
-                # push current generated file pair into sources
-                sources.append({'video': video_stream, 'audio': audio_stream})
-                video_stream = os.path.join(
-                    self.output_dir, video_stream_format.format(self.stream_id, len(sources)))
-                audio_stream = os.path.join(
-                    self.output_dir, audio_stream_format.format(self.stream_id, len(sources)))
-
-            prev_res = self.segment_meta[segment]
-            file_mode = 'ab' if os.path.exists(video_stream) else 'wb'
-            seg_file = os.path.join(self.output_dir, segment)
-
-            with open(video_stream, file_mode) as outfile,\
-                    open(seg_file, 'rb') as readfile:
-                shutil.copyfileobj(readfile, outfile)
-                logger.debug(
-                    'Assembling video stream {0!s} => {1!s}'.format(segment, video_stream))
-
-            with open(audio_stream, file_mode) as outfile,\
-                    open(seg_file.replace('.m4v', '.m4a'), 'rb') as readfile:
-                shutil.copyfileobj(readfile, outfile)
-                logger.debug(
-                    'Assembling audio stream {0!s} => {1!s}'.format(segment, audio_stream))
-
-        if audio_stream and video_stream:
-            # push last pair into source
-            sources.append({'video': video_stream, 'audio': audio_stream})
+        if self._assembler:
+            # segments have already been assembled during download
+            assembler = self._assembler
+        else:
+            # in parallel or direct mode, only split the segments into sections here
+            # and assemble or mux each section in the stitch workers
+            assembler = _SourceAssembler(self, defer=parallel or (direct and not skipffmpeg))
+            for segment in all_segments:
+                assembler.add(segment)
+        sources = assembler.finish()
 
         if len(sources) > 1:
             logger.warning(
                 'Stream has sections with different resolutions.\n'
                 '{0:d} mp4 files will be generated in total.'.format(len(sources)))
 
-        if not skipffmpeg:
-            for n, source in enumerate(sources):
+        def stitch_source(n):
+            source = sources[n]
+            if 'segments' in source and direct and not skipffmpeg:
+                generated_filename = self._generated_filename(output_filename, n, len(sources))
+                muxed = self._mux_segments(source['segments'], generated_filename)
+                if muxed is not None:
+                    return generated_filename if muxed else False
+            if 'segments' in source:
+                # assemble the video in a helper thread while the audio is assembled here
+                video = _Job(assembler.assemble, (source, 'video'), {})
+                t = threading.Thread(target=video.run, name='stitch-video-{0:d}'.format(n))
+                t.daemon = True
+                t.start()
+                try:
+                    assembler.assemble(source, 'audio')
+                finally:
+                    t.join()
+                if video.error:
+                    raise video.error
+            if skipffmpeg:
+                return None
+            generated_filename = self._generated_filename(output_filename, n, len(sources))
+            if not self._mux_source(source, generated_filename):
+                return False
+            if cleartempfiles:
+                # Don't del source*.tmp files if not using ffmpeg
+                # so that user can still use the source* files with another
+                # tool such as avconv
+                for f in (source['audio'], source['video']):
+                    try:
+                        os.remove(f)
+                    except (IOError, OSError) as ioe:
+                        logger.warning('Error removing {0!s}: {1!s}'.format(f, str(ioe)))
+            return generated_filename
 
-                if len(sources) == 1:
-                    # use supplied output filename as-is if it's the only one
-                    generated_filename = output_filename
-                else:
-                    # Generate a new filename by appending n+1
-                    # to the original specified output filename
-                    # so that it looks like output-1.mp4, output-2.mp4, etc
-                    dir_name = os.path.dirname(output_filename)
-                    file_name = os.path.basename(output_filename)
-                    dot_pos = file_name.rfind('.')
-                    if dot_pos >= 0:
-                        filename_no_ext = file_name[0:dot_pos]
-                        ext = file_name[dot_pos:]
-                    else:
-                        filename_no_ext = file_name
-                        ext = ''
-                    generated_filename = os.path.join(
-                        dir_name, '{0!s}-{1:d}{2!s}'.format(filename_no_ext, n + 1, ext))
-
-                ffmpeg_loglevel = 'error'
-                if logger.level == logging.DEBUG:
-                    ffmpeg_loglevel = 'warning'
-                cmd = [
-                    self.ffmpeg_binary, '-y',
-                    '-loglevel', ffmpeg_loglevel,
-                    '-i', source['audio'],
-                    '-i', source['video'],
-                    '-c:v', 'copy',
-                    '-c:a', 'copy',
-                    generated_filename]
-                exit_code = subprocess.call(cmd)
-
-                if exit_code:
-                    logger.error('ffmpeg exited with the code: {0!s}'.format(exit_code))
-                    logger.error('Command: {0!s}'.format(' '.join(cmd)))
-                    has_ffmpeg_error = True
-                else:
-                    files_generated.append(generated_filename)
-                    if cleartempfiles and not skipffmpeg:
-                        # Don't del source*.tmp files if not using ffmpeg
-                        # so that user can still use the source* files with another
-                        # tool such as avconv
-                        for f in (source['audio'], source['video']):
-                            try:
-                                os.remove(f)
-                            except (IOError, OSError) as ioe:
-                                logger.warning('Error removing {0!s}: {1!s}'.format(f, str(ioe)))
+        if parallel and len(sources) > 1:
+            pool = WorkerPool(min(self.stitch_max_workers, len(sources)), name='stitch')
+            try:
+                jobs = [pool.submit(stitch_source, n) for n in range(len(sources))]
+                for job in jobs:
+                    job.join()
+            finally:
+                pool.shutdown()
+            for job in jobs:
+                if job.error:
+                    raise job.error
+            results = [job.result for job in jobs]
+        else:
+            results = [stitch_source(n) for n in range(len(sources))]
+
+        files_generated = [r for r in results if r]
+        has_ffmpeg_error = False in results
 
         if cleartempfiles and not has_ffmpeg_error:
             # Specifically only remove this stream's segment files
             for seg in all_segments:
                 for f in (seg, seg.replace('.m4v', '.m4a')):
-                    try:
-                        os.remove(os.path.join(self.output_dir, f))
-                    except (IOError, OSError) as ioe:
-                        logger.warning('Error removing {0!s}: {1!s}'.format(f, str(ioe)))
+                    self.storage.remove(f)
+            if self._journal:
+                # segments are gone so the journal can no longer be resumed from
+                self._journal.remove()
 
         return files_generated
 
+    @staticmethod
+    def _generated_filename(output_filename, n, count):
+        """Output filename for the n-th of count resolution sections."""
+        if count == 1:
+            # use supplied output filename as-is if it's the only one
+            return output_filename
+        # Generate a new filename by appending n+1
+        # to the original specified output filename
+        # so that it looks like output-1.mp4, output-2.mp4, etc
+        dir_name = os.path.dirname(output_filename)
+        file_name = os.path.basename(output_filename)
+        dot_pos = file_name.rfind('.')
+        if dot_pos >= 0:
+            filename_no_ext = file_name[0:dot_pos]
+            ext = file_name[dot_pos:]
+        else:
+            filename_no_ext = file_name
+            ext = ''
+        return os.path.join(dir_name, '{0!s}-{1:d}{2!s}'.format(filename_no_ext, n + 1, ext))
+
+    def _ffmpeg_mux_cmd(self, audio, video, generated_filename):
+        ffmpeg_loglevel = 'error'
+        if logger.level == logging.DEBUG:
+            ffmpeg_loglevel = 'warning'
+        return [
+            self.ffmpeg_binary, '-y',
+            '-loglevel', ffmpeg_loglevel,
+            '-i', audio,
+            '-i', video,
+            '-c:v', 'copy',
+            '-c:a', 'copy',
+            generated_filename]
+
+    def _mux_source(self, source, generated_filename):
+        """
+        Merge a pair of audio/video source files.
+
+        :return: True if successful
+        """
+        if self.muxer != 'ffmpeg' and mp4.try_mux(source['video'], source['audio'], generated_filename):
+            return True
+        cmd = self._ffmpeg_mux_cmd(source['audio'], source['video'], generated_filename)
+        exit_code = subprocess.call(cmd)
+        if exit_code:
+            logger.error('ffmpeg exited with the code: {0!s}'.format(exit_code))
+            logger.error('Command: {0!s}'.format(' '.join(cmd)))
+            return False
+        return True
+
+    def _mux_segments(self, segments, generated_filename):
+        """
+        Merge the audio/video segments of a section without assembling the source files.
+        The mp4 muxer reads the segments straight from the storage, or failing that,
+        ffmpeg reads them from a pair of named pipes.
+
+        :param segments: the section's video segment filenames in timeline order
+        :return: True if successful, False if ffmpeg failed,
+            None if named pipes are needed but not available on this platform
+        """
+        tracks = (('video', list(segments)), ('audio', [s.replace('.m4v', '.m4a') for s in segments]))
+        if self.muxer != 'ffmpeg' and mp4.try_mux(
+                tracks[0][1], tracks[1][1], generated_filename, opener=self.storage.open_read):
+            return True
+        if not hasattr(os, 'mkfifo'):
+            return None
+
+        pipe_dir = tempfile.mkdtemp(prefix='igstitch')
+        try:
+            pipes = {}
+            for track, _ in tracks:
+                pipes[track] = os.path.join(pipe_dir, track)
+                os.mkfifo(pipes[track])     # pylint: disable=no-member
+            cmd = self._ffmpeg_mux_cmd(pipes['audio'], pipes['video'], generated_filename)
+            process = subprocess.Popen(cmd)
+            writers = []
+            for track, track_segments in tracks:
+                t = threading.Thread(
+                    target=self._write_pipe, name='stitch-{0!s}'.format(track),
+                    args=(process, pipes[track], track_segments))
+                t.daemon = True
+                t.start()
+                writers.append(t)
+            exit_code = process.wait()
+            for t in writers:
+                t.join()
+        finally:
+            shutil.rmtree(pipe_dir, ignore_errors=True)
+        if exit_code:
+            logger.error('ffmpeg exited with the code: {0!s}'.format(exit_code))
+            logger.error('Command: {0!s}'.format(' '.join(cmd)))
+            return False
+        return True
+
+    def _write_pipe(self, process, pipe, segments):
+        """Write the segments to a named pipe read by an ffmpeg process."""
+        fd = None
+        while fd is None and process.poll() is None:
+            try:
+                # non-blocking so that this does not hang if ffmpeg exits without opening the pipe
+                fd = os.open(pipe, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:
+                # ffmpeg has not opened the pipe for reading yet
+                time.sleep(0.05)
+        if fd is None:
+            return
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for segment in segments:
+                    self.storage.copy_to(segment, f)
+        except (IOError, OSError) as ioe:
+            logger.warning('Error writing to {0!s}: {1!s}'.format(pipe, str(ioe)))
+
+
+# re-exported for compatibility, imported last because the recorder is built on Downloader
+try:
+    from .recorder import Recorder      # noqa: E402,F401
+except ValueError:
+    # pragma: no cover
+    # To allow running in terminal
+    from recorder import Recorder       # noqa: E402,F401
+
 
 if __name__ == '__main__':      # pragma: no cover
-    import json
 
     # Example of how to init and start the Downloader
     parser = argparse.ArgumentParser()
@@ -511,6 +2200,8 @@ if __name__ == '__main__':      # pragma: no cover
     parser.add_argument('-o', metavar='DOWLOAD_DIR',
                         default='output/', help='Download folder')
     parser.add_argument('-c', action='store_true', help='Clear temp files')
+    parser.add_argument('-j', action='store_true', help='Keep a journal to resume from if interrupted')
+    parser.add_argument('-e', action='store_true', help='Skip the segments buffered before joining the stream')
     args = parser.parse_args()
 
     if args.v:
@@ -520,7 +2211,7 @@ if __name__ == '__main__':      # pragma: no cover
 
     logging.basicConfig(level=logger.level)
 
-    dl = Downloader(mpd=args.mpd, output_dir=args.o)
+    dl = Downloader(mpd=args.mpd, output_dir=args.o, journal=args.j, backlog_mode='edge_only' if args.e else None)
     try:
         dl.run()
     except KeyboardInterrupt:
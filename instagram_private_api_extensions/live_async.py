@@ -0,0 +1,359 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+An asyncio counterpart to :class:`instagram_private_api_extensions.live.Downloader`.
+Requires python 3.5+ and aiohttp.
+"""
+
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import time
+
+import aiohttp
+try:
+    from .live import Downloader
+except ImportError:
+    # pragma: no cover
+    # To allow running in terminal
+    from live import Downloader
+
+
+logger = logging.getLogger(__file__)
+
+
+class AsyncDownloader(Downloader):
+    """
+    Downloads and assembles a given IG live stream on an asyncio event loop.
+
+    The mpd polling, segment downloads and ``callback_check`` all run as coroutines
+    so many streams can be recorded on a single event loop, e.g.
+
+    .. code-block:: python
+
+        loop.run_until_complete(asyncio.gather(*[dl.run_async() for dl in downloaders]))
+        for dl in downloaders:
+            dl.stitch(...)
+    """
+
+    def __init__(self, mpd, output_dir, callback_check=None, singlethreaded=False, user_agent=None, **kwargs):
+        """
+        Accepts the same parameters as :class:`instagram_private_api_extensions.live.Downloader`,
+        except ``session`` and ``pool`` which are not used.
+
+        :param client_session: an optional ``aiohttp.ClientSession`` to use for all requests,
+            useful for sharing a connection pool across multiple downloaders.
+            If not provided, one is created and closed by :meth:`run_async`.
+        """
+        self.client_session = kwargs.pop('client_session', None)
+        super().__init__(
+            mpd, output_dir, callback_check=callback_check, singlethreaded=singlethreaded,
+            user_agent=user_agent, **kwargs)
+        self._semaphore = None
+
+    def _new_pool(self):
+        # segments are downloaded by tasks on the event loop
+        return None
+
+    def _new_session(self):
+        # requests are made with the aiohttp client_session
+        return None
+
+    def run(self):
+        """Begin downloading on a new event loop. Blocks until the stream ends."""
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.run_async())
+        finally:
+            loop.close()
+
+    async def run_async(self):
+        """Begin downloading. Coroutine that completes when the stream ends."""
+        owns_session = self.client_session is None
+        if owns_session:
+            self.client_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_workers + 1))
+        # limits the number of concurrent segment downloads
+        self._semaphore = asyncio.Semaphore(self.max_workers)
+        if self.callback:
+            self._status_checker = asyncio.ensure_future(self._check_status_periodically())
+        try:
+            await self._run()
+            await self.stop_async()
+        finally:
+            if owns_session:
+                await self.client_session.close()
+                self.client_session = None
+
+    async def _run(self):
+        connection_retries_count = 0
+        while not self.is_aborted:
+            try:
+                origin_wait = self._mpd_origin_wait()
+                if origin_wait:
+                    await asyncio.sleep(origin_wait)
+                    continue
+                poll_started = time.time()
+                mpd, wait = await self._download_mpd_async()
+                received_at = time.time()
+                connection_retries_count = 0    # reset count
+
+                if not self.duplicate_etag_count:
+                    await self._process_mpd_async(mpd)
+                    self._observe_timeline(received_at)
+                else:
+                    logger.debug('Skip mpd processing: {0:d} - {1!s}'.format(
+                        self.duplicate_etag_count, self.last_etag))
+                wait = self._next_poll_wait(poll_started, wait)
+                if wait > 0:
+                    logger.debug('Sleeping for {0:.2f}s'.format(wait))
+                    await asyncio.sleep(wait)
+
+            except aiohttp.ClientResponseError as e:
+                self.metrics.inc('mpd_errors')
+                err_msg = 'HTTPError downloading {0!s}: {1!s}.'.format(self.mpd, e)
+                if e.status >= 500 or e.status == 404:
+                    # 505 - temporal server problem
+                    # 404 - seems to indicate that stream is starting but not ready
+                    # 403 - stream is too long gone
+                    connection_retries_count += 1
+                    if connection_retries_count <= self.max_connection_error_retry:
+                        logger.warning(err_msg)
+                        await asyncio.sleep(self._mpd_retry_delay(connection_retries_count))
+                    else:
+                        logger.error(err_msg)
+                        self.is_aborted = True
+                else:
+                    logger.error(err_msg)
+                    self.is_aborted = True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.metrics.inc('mpd_errors')
+                # transient error maybe?
+                connection_retries_count += 1
+                if connection_retries_count <= self.max_connection_error_retry:
+                    logger.warning('ConnectionError downloading {0!s}: {1!s}. Retrying...'.format(self.mpd, e))
+                    await asyncio.sleep(self._mpd_retry_delay(connection_retries_count))
+                else:
+                    logger.error('ConnectionError downloading {0!s}: {1!s}.'.format(self.mpd, e))
+                    self.is_aborted = True
+
+    def stop(self):
+        """
+        Flags the downloader to stop polling. Pending segment downloads are
+        completed by :meth:`run_async` before it returns.
+        """
+        self.is_aborted = True
+
+    async def stop_async(self):
+        """Stop polling and wait for all pending segment downloads to complete."""
+        self.is_aborted = True
+        if self._status_checker:
+            self._status_checker.cancel()
+            await asyncio.gather(self._status_checker, return_exceptions=True)
+        tasks = self._pending_tasks()
+        logger.debug('{0:d} download(s) are pending'.format(len(tasks)))
+        while tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # backfills may have been scheduled by the completed downloads
+            tasks = self._pending_tasks()
+        # flushing, closing the sink and the journal block on file and process io
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.storage.flush)
+        await loop.run_in_executor(None, self._close_sink)
+        self._release_representations()
+        if self._journal:
+            await loop.run_in_executor(None, self._journal.close)
+
+    def _pending_tasks(self):
+        # completed downloads are released from an executor thread
+        with self._downloaders_lock:
+            return [t for t in self.downloaders.values() if not t.done()]
+
+    async def _download_mpd_async(self):
+        """
+        Downloads the mpd stream info and returns the xml object.
+        The xml object is None if the mpd is unchanged from the last request.
+        """
+        logger.debug('Requesting {0!s}'.format(self.mpd))
+        requested_at = time.time()
+        try:
+            res = await self.client_session.get(
+                self.mpd, headers=self._mpd_request_headers(),
+                timeout=aiohttp.ClientTimeout(total=self.mpd_download_timeout))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.retry_scheduler.record(self.mpd, False)
+            raise
+        self.retry_scheduler.record(self.mpd, not self._is_origin_failure(res.status))
+        async with res:
+            res.raise_for_status()
+            not_modified = res.status == 304
+            content = None if not_modified else await res.read()
+        latency = time.time() - requested_at
+
+        self._check_mpd_response(res.headers, content)
+        self.metrics.observe_poll(latency, not_modified=not_modified, duplicate=bool(self.duplicate_etag_count))
+        if self.duplicate_etag_count:
+            # mpd will not be processed so don't bother parsing it
+            return None, self.update_period
+        mpd, self.update_period = self._parse_mpd(content.decode('utf-8'))
+        return mpd, self.update_period
+
+    async def _check_status_periodically(self):
+        """Run a status check every ``callback_interval`` seconds while the mpd is unchanged."""
+        while not self.is_aborted:
+            await asyncio.sleep(self.callback_interval)
+            if self.duplicate_etag_count and not self.is_aborted:
+                self.metrics.inc('status_checks')
+                await self._run_status_check()
+
+    async def _run_status_check(self):
+        callback = self.callback
+        try:
+            if asyncio.iscoroutinefunction(callback):
+                coro = callback()
+            else:
+                # don't block the event loop with a synchronous callback
+                coro = asyncio.get_event_loop().run_in_executor(None, callback)
+            self._on_status_checked(await asyncio.wait_for(coro, self.callback_timeout))
+        except asyncio.TimeoutError:
+            logger.warning('Status check timed out after {0:.1f}s'.format(self.callback_timeout))
+            self.metrics.inc('status_check_timeouts')
+        except Exception as e:      # pylint: disable=broad-except
+            logger.warning('Error from callback: {0!s}'.format(str(e)))
+
+    async def _process_mpd_async(self, mpd):
+        segments = list(self._iter_mpd_segments(mpd))
+        # the stream is journaled before any of its segments can be done
+        self._journal_stream()
+        # the backlog is scheduled after the live edge segments so it queues behind them for the semaphore
+        for identifier, segment_url, output, init_segment_url, _ in sorted(segments, key=lambda seg: seg[4]):
+            if not self._is_new_segment(identifier, os.path.basename(output)):
+                continue
+            logger.debug('Requesting {0!s}'.format(segment_url))
+            self.metrics.inc('segments_started')
+            coro = self._extract_async(segment_url, output, init_segment_url, identifier=identifier)
+            if self.singlethreaded:
+                await coro
+            else:
+                with self._downloaders_lock:
+                    self.downloaders[identifier] = asyncio.ensure_future(coro)
+        self._prune_init_chunks()
+
+    async def _extract_async(self, target, output, init_segment_url=None, identifier=None, attempt=0):
+        # the segment is reported as completed or failed however the download ends,
+        # unless the report is left to a retry
+        retried = False
+        try:
+            init_chunk = None
+            if init_segment_url:
+                # Append init chunk to first segment in the timeline
+                init_chunk = await self._get_init_chunk_async(init_segment_url)
+            requested = await self._download_async(target, output, init_chunk=init_chunk, identifier=identifier)
+            # a segment that was not requested because its origin is down is not backfilled
+            if (requested is not False and not self.storage.exists(os.path.basename(output))
+                    and self._can_backfill(identifier, attempt)):
+                retried = True
+                with self._downloaders_lock:
+                    self.downloaders[identifier] = asyncio.ensure_future(self._extract_async(
+                        target, output, init_segment_url, identifier=identifier, attempt=attempt + 1))
+        finally:
+            if not retried:
+                # the journal, sink and incremental stitch writes must not block the event loop
+                await asyncio.get_event_loop().run_in_executor(
+                    None, functools.partial(self._on_segment_downloaded, output, identifier=identifier))
+
+    async def _get_init_chunk_async(self, init_segment_url):
+        init_chunk = self._init_chunks.get(init_segment_url)
+        if init_chunk is None:
+            init_chunk = await self._download_async(
+                init_segment_url, None, timeout=self.mpd_download_timeout)
+            if init_chunk is not None:
+                self._init_chunks[init_segment_url] = init_chunk
+        return init_chunk
+
+    async def _download_async(self, target, output, timeout=None, init_chunk=None, identifier=None):
+        retry_attempts = self.max_connection_error_retry + 1
+        for i in range(1, retry_attempts + 1):
+            # waiting for the origin does not use up an attempt
+            origin_wait = self._segment_origin_wait(target, identifier)
+            while origin_wait:
+                await asyncio.sleep(origin_wait)
+                origin_wait = self._segment_origin_wait(target, identifier)
+            if origin_wait is None:
+                if output:
+                    self.metrics.inc('segment_retries', i - 1)
+                    return False
+                return None
+            try:
+                async with self._semaphore:
+                    requested_at = time.time()
+                    async with self.client_session.get(target, headers={
+                            'User-Agent': self.user_agent,
+                            'Accept': '*/*',
+                    }, timeout=aiohttp.ClientTimeout(total=timeout or self.download_timeout)) as res:
+                        self.retry_scheduler.record(target, not self._is_origin_failure(res.status))
+                        res.raise_for_status()
+
+                        if not output:
+                            return await res.read()
+
+                        size = 0
+                        with self.storage.open_write(os.path.basename(output)) as f:
+                            if init_chunk:
+                                # prepend init chunk
+                                logger.debug('Appended chunk len {0:d} to {1!s}'.format(
+                                    len(init_chunk), output))
+                                f.write(init_chunk)
+                            async for chunk in res.content.iter_chunked(self.DOWNLOAD_CHUNK_SIZE):
+                                f.write(chunk)
+                                size += len(chunk)
+                    self.metrics.observe_segment(time.time() - requested_at, size, i - 1)
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError):
+                    err_msg = 'HTTPError {0:d} {1!s}: {2!s}.'.format(e.status, target, e)
+                else:
+                    self.retry_scheduler.record(target, False)
+                    err_msg = 'ConnectionError {0!s}: {1!s}'.format(target, e)
+            delay = self._retry_delay(i, retry_attempts, err_msg)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        if output:
+            self.metrics.inc('segment_retries', i - 1)
+
+
+if __name__ == '__main__':      # pragma: no cover
+
+    # Example of how to init and start the AsyncDownloader
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mpd')
+    parser.add_argument('-v', action='store_true', help='Verbose')
+    parser.add_argument('-s', metavar='OUTPUT_FILENAME',
+                        help='Output filename')
+    parser.add_argument('-o', metavar='DOWLOAD_DIR',
+                        default='output/', help='Download folder')
+    parser.add_argument('-c', action='store_true', help='Clear temp files')
+    args = parser.parse_args()
+
+    if args.v:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+
+    logging.basicConfig(level=logger.level)
+
+    dl = AsyncDownloader(mpd=args.mpd, output_dir=args.o)
+    try:
+        dl.run()
+    except KeyboardInterrupt:
+        logger.info('Interrupted')
+    finally:
+        if args.s:
+            output_files = dl.stitch(args.s, cleartempfiles=args.c)
+            print('Generated: {0!s}'.format(' '.join(output_files)))
@@ -0,0 +1,201 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+Metrics of the live downloaders, with a Prometheus text exposition.
+"""
+
+import bisect
+import threading
+from collections import OrderedDict
+
+
+class _Histogram(object):
+    """A cumulative histogram with fixed bucket upper bounds."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # the last count is for the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for upper_bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            buckets.append((upper_bound, cumulative))
+        return {'buckets': buckets, 'count': self.count, 'sum': self.sum}
+
+
+class DownloaderMetrics(object):
+    """
+    Counters, histograms and gauges for a :class:`Downloader`.
+    Use :meth:`snapshot` to read the current values or :meth:`prometheus_text`
+    for the Prometheus text exposition format.
+    """
+
+    POLL_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    SEGMENT_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+    RETRY_BUCKETS = (0, 1, 2, 5, 10)
+    PROMETHEUS_PREFIX = 'ig_live_'
+
+    # snapshot key => (prometheus name, type, help)
+    PROMETHEUS_METRICS = OrderedDict([
+        ('mpd_polls', ('mpd_polls_total', 'counter', 'mpd requests completed')),
+        ('mpd_not_modified', ('mpd_not_modified_total', 'counter', 'mpd requests answered with 304 Not Modified')),
+        ('mpd_duplicates', ('mpd_duplicates_total', 'counter', 'mpd responses with an unchanged etag or hash')),
+        ('mpd_errors', ('mpd_errors_total', 'counter', 'mpd requests that failed')),
+        ('mpd_poll_latency', ('mpd_poll_latency_seconds', 'histogram', 'mpd request latency')),
+        ('segments_downloaded', ('segments_downloaded_total', 'counter', 'segments downloaded')),
+        ('segments_failed', ('segments_failed_total', 'counter', 'segments that could not be downloaded')),
+        ('segment_retries', ('segment_retries_total', 'counter', 'segment download retries')),
+        ('segment_backfills', ('segment_backfills_total', 'counter', 'failed segments queued again')),
+        ('backlog_skipped', ('backlog_skipped_total', 'counter', 'buffered segments skipped when joining')),
+        ('status_checks', ('status_checks_total', 'counter', 'callback_check calls started')),
+        ('status_check_timeouts', ('status_check_timeouts_total', 'counter',
+                                   'callback_check calls given up on after the callback timeout')),
+        ('retries_denied', ('retries_denied_total', 'counter', 'retries given up because the retry budget ran out')),
+        ('requests_short_circuited', ('requests_short_circuited_total', 'counter',
+                                      'requests not made because the origin circuit was open')),
+        ('segment_bytes', ('segment_bytes_total', 'counter', 'segment bytes downloaded')),
+        ('segment_latency', ('segment_download_seconds', 'histogram', 'segment download latency')),
+        ('segment_retries_per_segment', ('segment_retries_per_segment', 'histogram',
+                                         'retries needed per segment download')),
+        ('bytes_per_second', ('segment_bytes_per_second', 'gauge', 'average segment download throughput')),
+        ('segments_inflight', ('segments_inflight', 'gauge', 'segments queued or downloading')),
+        ('segments_queued', ('segments_queued', 'gauge', 'segment downloads waiting for a worker')),
+        ('workers_alive', ('workers_alive', 'gauge', 'worker threads that are alive')),
+        ('live_edge_lag', ('live_edge_lag_seconds', 'gauge',
+                           'media seconds between the live edge and the last downloaded segment')),
+    ])
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys([
+            'mpd_polls', 'mpd_not_modified', 'mpd_duplicates', 'mpd_errors',
+            'segments_started', 'segments_downloaded', 'segments_failed',
+            'segment_retries', 'segment_backfills', 'segment_bytes',
+            'retries_denied', 'requests_short_circuited', 'backlog_skipped',
+            'status_checks', 'status_check_timeouts'], 0)
+        self._segment_seconds = 0.0
+        self._histograms = {
+            'mpd_poll_latency': _Histogram(self.POLL_LATENCY_BUCKETS),
+            'segment_latency': _Histogram(self.SEGMENT_LATENCY_BUCKETS),
+            'segment_retries_per_segment': _Histogram(self.RETRY_BUCKETS),
+        }
+        self._gauges = OrderedDict()
+
+    def set_gauge(self, name, fn):
+        """
+        Report the return value of ``fn()`` as a gauge when a snapshot is taken.
+
+        :param name: snapshot key
+        :param fn: callable that returns a number
+        """
+        self._gauges[name] = fn
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe_poll(self, latency, not_modified=False, duplicate=False):
+        """
+        Record a completed mpd request.
+
+        :param latency: request duration in seconds
+        :param not_modified: the server responded with a 304 Not Modified
+        :param duplicate: the mpd was unchanged from the last request
+        """
+        with self._lock:
+            self._counters['mpd_polls'] += 1
+            if not_modified:
+                self._counters['mpd_not_modified'] += 1
+            if duplicate:
+                self._counters['mpd_duplicates'] += 1
+            self._histograms['mpd_poll_latency'].observe(latency)
+
+    def observe_segment(self, latency, size, retries):
+        """
+        Record a segment download.
+
+        :param latency: download duration in seconds
+        :param size: bytes downloaded
+        :param retries: number of failed attempts before the download succeeded
+        """
+        with self._lock:
+            self._counters['segment_bytes'] += size
+            self._counters['segment_retries'] += retries
+            self._segment_seconds += latency
+            self._histograms['segment_latency'].observe(latency)
+            self._histograms['segment_retries_per_segment'].observe(retries)
+
+    def snapshot(self):
+        """
+        The current values of all metrics as a dict.
+        Histograms are dicts of ``buckets``, a list of (upper bound, cumulative count), ``count`` and ``sum``.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            segment_seconds = self._segment_seconds
+            histograms = dict([(k, h.snapshot()) for k, h in self._histograms.items()])
+        snapshot = dict([(k, v) for k, v in counters.items() if k != 'segments_started'])
+        snapshot.update(histograms)
+        snapshot['bytes_per_second'] = counters['segment_bytes'] / segment_seconds if segment_seconds else 0.0
+        snapshot['segments_inflight'] = max(
+            0, counters['segments_started'] - counters['segments_downloaded'] - counters['segments_failed'])
+        for name, fn in self._gauges.items():
+            snapshot[name] = fn()
+        return snapshot
+
+    def prometheus_text(self, labels=None):
+        """
+        The metrics in the Prometheus text exposition format.
+
+        :param labels: optional dict of labels to add to every sample
+        """
+        return self.format_prometheus([(labels or {}, self.snapshot())])
+
+    @classmethod
+    def format_prometheus(cls, snapshots):
+        """
+        Format snapshots from multiple downloaders as one Prometheus text exposition.
+
+        :param snapshots: list of (labels dict, :meth:`snapshot`) tuples
+        """
+        lines = []
+        for key, (name, metric_type, description) in cls.PROMETHEUS_METRICS.items():
+            name = cls.PROMETHEUS_PREFIX + name
+            samples = [(labels, snapshot[key]) for labels, snapshot in snapshots if key in snapshot]
+            if not samples:
+                continue
+            lines.append('# HELP {0!s} {1!s}'.format(name, description))
+            lines.append('# TYPE {0!s} {1!s}'.format(name, metric_type))
+            for labels, value in samples:
+                if metric_type != 'histogram':
+                    lines.append(cls._prometheus_sample(name, labels, value))
+                    continue
+                for upper_bound, count in value['buckets']:
+                    bucket_labels = dict(labels)
+                    bucket_labels['le'] = '+Inf' if upper_bound == float('inf') else repr(float(upper_bound))
+                    lines.append(cls._prometheus_sample(name + '_bucket', bucket_labels, count))
+                lines.append(cls._prometheus_sample(name + '_count', labels, value['count']))
+                lines.append(cls._prometheus_sample(name + '_sum', labels, value['sum']))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _prometheus_sample(name, labels, value):
+        if labels:
+            name += '{' + ','.join([
+                '{0!s}="{1!s}"'.format(
+                    k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                for k, v in sorted(labels.items())]) + '}'
+        return '{0!s} {1!r}'.format(name, value if isinstance(value, float) else int(value))
@@ -0,0 +1,401 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+A minimal box-level muxer for fragmented MP4 (fMP4) streams, as served by IG for live
+and replay broadcasts. It merges one video and one audio fMP4 stream into a single
+fragmented MP4 without decoding or re-encoding anything, so no ffmpeg is needed.
+
+Only the box headers and the small ``moov`` / ``moof`` boxes are parsed,
+the ``mdat`` payloads are copied as-is.
+"""
+
+import heapq
+import logging
+import os
+import struct
+
+
+logger = logging.getLogger(__file__)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+# output file extensions that the muxer can be used for
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+TFHD_BASE_DATA_OFFSET_PRESENT = 0x000001
+
+
+class MuxError(Exception):
+    """Raised when the inputs cannot be muxed, e.g. because they are not fragmented."""
+    pass
+
+
+class _Box(object):
+    __slots__ = ('type', 'offset', 'header_size', 'size')
+
+    def __init__(self, box_type, offset, header_size, size):
+        self.type = box_type
+        self.offset = offset
+        self.header_size = header_size
+        self.size = size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+
+class _Fragment(object):
+    __slots__ = ('moof', 'file_index', 'offset', 'end')
+
+    def __init__(self, moof, file_index, offset, end):
+        self.moof = moof
+        # index of the file in the track's paths
+        self.file_index = file_index
+        # offset of the moof in the file
+        self.offset = offset
+        # end offset of the fragment's last mdat
+        self.end = end
+
+
+def _read_box_header(data, offset, end):
+    """Parse the box header at ``offset`` of ``data``, a bytes-like object or a file."""
+    if hasattr(data, 'read'):
+        data.seek(offset)
+        header = data.read(16)
+    else:
+        header = bytes(data[offset:offset + 16])
+    if len(header) < 8:
+        raise MuxError('Truncated box header at {0:d}'.format(offset))
+    size, box_type = struct.unpack('>I4s', header[:8])
+    header_size = 8
+    if size == 1:
+        if len(header) < 16:
+            raise MuxError('Truncated box header at {0:d}'.format(offset))
+        size = struct.unpack('>Q', header[8:16])[0]
+        header_size = 16
+    elif size == 0:
+        # box extends to the end
+        size = end - offset
+    if size < header_size or offset + size > end:
+        raise MuxError('Invalid {0!s} box size {1:d} at {2:d}'.format(box_type, size, offset))
+    return _Box(box_type, offset, header_size, size)
+
+
+def _iter_boxes(data, start, end):
+    offset = start
+    while offset < end:
+        box = _read_box_header(data, offset, end)
+        yield box
+        offset = box.end
+
+
+def _root(data):
+    """The box that spans all of ``data``"""
+    return _read_box_header(data, 0, len(data))
+
+
+def _find(data, box, path):
+    """Find the first descendant of ``box`` along ``path``, a list of box types."""
+    for child in _iter_boxes(data, box.offset + box.header_size, box.end):
+        if child.type == path[0]:
+            if len(path) == 1:
+                return child
+            return _find(data, child, path[1:])
+    return None
+
+
+def _build_box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + bytes(payload)
+
+
+def _full_box_version(data, box):
+    return data[box.offset + box.header_size]
+
+
+def _open_source(source, opener=None):
+    """
+    :return: tuple of a readable binary file object for a source and
+        whether it was opened here and should be closed after use
+    """
+    if hasattr(source, 'read'):
+        return source, False
+    return (opener or _open_file)(source), True
+
+
+def _open_file(path):
+    return open(path, 'rb')
+
+
+class _Track(object):
+    """A fragmented MP4 input stream, in one file or split across consecutive segment files"""
+
+    def __init__(self, paths, opener=None):
+        self.paths = list(paths) if isinstance(paths, (list, tuple)) else [paths]
+        self.path = self.paths[0] if self.paths else None
+        self.opener = opener
+        self.ftyp = None
+        self.moov = None
+        # list of :class:`_Fragment`
+        self.fragments = []
+        self.timescales = {}
+        self.track_ids = {}
+        # track ID => decode time subtracted from the fragments of the track
+        self.decode_time_offsets = {}
+        self._scan()
+
+    def _scan(self):
+        for index, path in enumerate(self.paths):
+            self._scan_file(index, path)
+        if self.moov is None:
+            raise MuxError('No moov box in {0!s}'.format(self.path))
+        moov = _root(self.moov)
+        if not _find(self.moov, moov, [b'mvex']) or not self.fragments:
+            raise MuxError('{0!s} is not a fragmented mp4'.format(self.path))
+        for trak in _iter_boxes(self.moov, moov.header_size, moov.size):
+            if trak.type != b'trak':
+                continue
+            tkhd = _find(self.moov, trak, [b'tkhd'])
+            mdhd = _find(self.moov, trak, [b'mdia', b'mdhd'])
+            if not tkhd or not mdhd:
+                raise MuxError('Invalid trak in {0!s}'.format(self.path))
+            track_id = struct.unpack_from(
+                '>I', self.moov, tkhd.offset + tkhd.header_size + (20 if _full_box_version(self.moov, tkhd) else 12))[0]
+            self.timescales[track_id] = struct.unpack_from(
+                '>I', self.moov, mdhd.offset + mdhd.header_size + (20 if _full_box_version(self.moov, mdhd) else 12))[0]
+
+    def _scan_file(self, index, path):
+        f, opened = _open_source(path, self.opener)
+        try:
+            f.seek(0, 2)
+            size = f.tell()
+            fragment = _Fragment(None, index, 0, 0)
+            for box in _iter_boxes(f, 0, size):
+                if box.type in (b'ftyp', b'moov'):
+                    f.seek(box.offset)
+                    data = bytearray(f.read(box.size))
+                    if box.type == b'ftyp':
+                        self.ftyp = self.ftyp or data
+                    elif self.moov is None:
+                        self.moov = data
+                    elif data != self.moov:
+                        # a repeated init segment is fine, a different one is not
+                        raise MuxError('Multiple moov boxes in {0!s}'.format(path))
+                elif box.type == b'moof':
+                    f.seek(box.offset)
+                    fragment = _Fragment(bytearray(f.read(box.size)), index, box.offset, box.end)
+                    self.fragments.append(fragment)
+                elif box.type == b'mdat' and fragment.moof is not None:
+                    # anything after the last mdat of a fragment, e.g. the sidx of the next segment, is dropped
+                    fragment.end = box.end
+        finally:
+            if opened:
+                f.close()
+
+    def fragment_time(self, moof):
+        """Decode time in seconds of a fragment, from its first tfdt."""
+        traf = _find(moof, _root(moof), [b'traf'])
+        tfhd = traf and _find(moof, traf, [b'tfhd'])
+        tfdt = traf and _find(moof, traf, [b'tfdt'])
+        if not tfhd or not tfdt:
+            return None
+        track_id = struct.unpack_from('>I', moof, tfhd.offset + tfhd.header_size + 4)[0]
+        return float(_read_decode_time(moof, tfdt)) / (self.timescales.get(track_id) or 1)
+
+    def start_time(self):
+        """Decode time in seconds of the earliest fragment, None if the fragments have no tfdt."""
+        times = [t for t in [self.fragment_time(fragment.moof) for fragment in self.fragments] if t is not None]
+        return min(times) if times else None
+
+
+def _read_decode_time(moof, tfdt):
+    payload = tfdt.offset + tfdt.header_size
+    if _full_box_version(moof, tfdt):
+        return struct.unpack_from('>Q', moof, payload + 4)[0]
+    return struct.unpack_from('>I', moof, payload + 4)[0]
+
+
+def _write_decode_time(moof, tfdt, decode_time):
+    payload = tfdt.offset + tfdt.header_size
+    if _full_box_version(moof, tfdt):
+        struct.pack_into('>Q', moof, payload + 4, decode_time)
+    else:
+        struct.pack_into('>I', moof, payload + 4, decode_time)
+
+
+def _rebase(tracks):
+    """Make the output start at 0 from the earliest fragment across the tracks, as ffmpeg does."""
+    start_times = [t for t in [track.start_time() for track in tracks] if t is not None]
+    if not start_times:
+        return
+    start_time = min(start_times)
+    for track in tracks:
+        for track_id, timescale in track.timescales.items():
+            track.decode_time_offsets[track_id] = int(round(start_time * timescale))
+
+
+def _merge_moov(tracks):
+    """
+    Build a moov with the traks of all the tracks, renumbering the track IDs.
+
+    :param tracks: list of :class:`_Track`, the mvhd of the first is used
+    """
+    mvhd = None
+    others = []
+    traks = []
+    trexs = []
+    mehd = None
+    next_track_id = 1
+    for track in tracks:
+        moov = track.moov
+        moov_box = _root(moov)
+        for child in _iter_boxes(moov, moov_box.header_size, moov_box.size):
+            if child.type == b'trak':
+                trak = bytearray(moov[child.offset:child.end])
+                tkhd = _find(trak, _root(trak), [b'tkhd'])
+                id_offset = tkhd.offset + tkhd.header_size + (20 if _full_box_version(trak, tkhd) else 12)
+                old_id = struct.unpack_from('>I', trak, id_offset)[0]
+                track.track_ids[old_id] = next_track_id
+                struct.pack_into('>I', trak, id_offset, next_track_id)
+                next_track_id += 1
+                traks.append(trak)
+            elif track is tracks[0] and child.type == b'mvhd':
+                mvhd = bytearray(moov[child.offset:child.end])
+            elif track is tracks[0] and child.type not in (b'mvex', b'mvhd'):
+                others.append(moov[child.offset:child.end])
+        mvex = _find(moov, moov_box, [b'mvex'])
+        for child in _iter_boxes(moov, mvex.offset + mvex.header_size, mvex.end):
+            if child.type == b'trex':
+                trex = bytearray(moov[child.offset:child.end])
+                id_offset = child.header_size + 4
+                old_id = struct.unpack_from('>I', trex, id_offset)[0]
+                if old_id in track.track_ids:
+                    struct.pack_into('>I', trex, id_offset, track.track_ids[old_id])
+                    trexs.append(trex)
+            elif child.type == b'mehd' and track is tracks[0]:
+                mehd = moov[child.offset:child.end]
+    if mvhd is None:
+        raise MuxError('No mvhd box in {0!s}'.format(tracks[0].path))
+    # next_track_ID is the last field of mvhd
+    struct.pack_into('>I', mvhd, len(mvhd) - 4, next_track_id)
+    mvex = _build_box(b'mvex', b''.join([bytes(b) for b in ([mehd] if mehd else []) + trexs]))
+    return _build_box(b'moov', b''.join([bytes(b) for b in [mvhd] + traks + [mvex] + others]))
+
+
+def _patch_moof(moof, track, sequence_number, offset_delta):
+    """
+    Renumber the track IDs and sequence number of a moof, rebase the decode times
+    and move any explicit base data offsets.
+    """
+    for child in _iter_boxes(moof, _root(moof).header_size, len(moof)):
+        if child.type == b'mfhd':
+            struct.pack_into('>I', moof, child.offset + child.header_size + 4, sequence_number)
+        elif child.type == b'traf':
+            tfhd = _find(moof, child, [b'tfhd'])
+            if not tfhd:
+                raise MuxError('No tfhd box in traf')
+            payload = tfhd.offset + tfhd.header_size
+            flags = struct.unpack_from('>I', moof, payload)[0] & 0xffffff
+            old_id = struct.unpack_from('>I', moof, payload + 4)[0]
+            if old_id not in track.track_ids:
+                raise MuxError('Unknown track ID {0:d} in {1!s}'.format(old_id, track.path))
+            struct.pack_into('>I', moof, payload + 4, track.track_ids[old_id])
+            tfdt = _find(moof, child, [b'tfdt'])
+            if tfdt and track.decode_time_offsets.get(old_id):
+                _write_decode_time(moof, tfdt, max(
+                    0, _read_decode_time(moof, tfdt) - track.decode_time_offsets[old_id]))
+            if flags & TFHD_BASE_DATA_OFFSET_PRESENT:
+                base_data_offset = struct.unpack_from('>Q', moof, payload + 8)[0]
+                struct.pack_into('>Q', moof, payload + 8, base_data_offset + offset_delta)
+    return moof
+
+
+def _copy_range(src, dst, offset, size):
+    src.seek(offset)
+    remaining = size
+    while remaining:
+        chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise MuxError('Unexpected end of {0!s}'.format(getattr(src, 'name', 'input')))
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def mux(video_file, audio_file, output_file, opener=None):
+    """
+    Merge a video and an audio fragmented MP4 stream into one fragmented MP4 file.
+    Fragments are interleaved by decode time, and the decode times are shifted
+    so that the output starts at 0 like a remux by ffmpeg.
+
+    :param video_file: the video stream, starting with its init segment,
+        or a list of consecutive video segments. Each is a path, or a readable and
+        seekable binary file object that is left open.
+    :param audio_file: the audio stream, starting with its init segment,
+        or a list of consecutive audio segments, as for ``video_file``
+    :param output_file: output file path
+    :param opener: callable that returns a readable and seekable binary file object for a path,
+        e.g. :meth:`SegmentStorage.open_read` to read segments that are not local files
+    :raises MuxError: if the inputs are not fragmented MP4 streams
+    """
+    tracks = [_Track(video_file, opener=opener), _Track(audio_file, opener=opener)]
+    moov = _merge_moov(tracks)
+    _rebase(tracks)
+
+    def fragments(index):
+        track = tracks[index]
+        for n, fragment in enumerate(track.fragments):
+            fragment_time = track.fragment_time(fragment.moof)
+            # fall back to the fragment order if there is no tfdt
+            yield (fragment_time if fragment_time is not None else n), index, n
+
+    # the currently open (file index, file, opened here) of each track, fragments are read in order
+    files = [(None, None, False), (None, None, False)]
+
+    def source(index, file_index):
+        if files[index][0] != file_index:
+            if files[index][2]:
+                files[index][1].close()
+            files[index] = (file_index, ) + _open_source(tracks[index].paths[file_index], opener)
+        return files[index][1]
+
+    try:
+        with open(output_file, 'wb') as out:
+            out.write(bytes(tracks[0].ftyp or _build_box(b'ftyp', b'iso6\x00\x00\x00\x00iso6mp41')))
+            out.write(moov)
+            sequence_number = 0
+            for _, index, n in heapq.merge(fragments(0), fragments(1)):
+                track = tracks[index]
+                fragment = track.fragments[n]
+                sequence_number += 1
+                # the boxes following the moof keep their position relative to it
+                offset_delta = out.tell() - fragment.offset
+                out.write(_patch_moof(bytearray(fragment.moof), track, sequence_number, offset_delta))
+                moof_end = fragment.offset + len(fragment.moof)
+                _copy_range(source(index, fragment.file_index), out, moof_end, fragment.end - moof_end)
+    finally:
+        for _, f, opened in files:
+            if opened:
+                f.close()
+    logger.debug('Muxed {0!s} and {1!s} into {2!s}'.format(tracks[0].path, tracks[1].path, output_file))
+
+
+def try_mux(video_file, audio_file, output_file, opener=None):
+    """
+    :func:`mux` the streams if the output is an mp4 file,
+    so that the caller can fall back to ffmpeg otherwise.
+
+    :return: True if the output file was generated
+    """
+    if os.path.splitext(output_file)[1].lower() not in MP4_EXTENSIONS:
+        return False
+    try:
+        mux(video_file, audio_file, output_file, opener=opener)
+        return True
+    except (MuxError, IOError, OSError, struct.error) as e:
+        logger.info('Unable to mux {0!s}, falling back to ffmpeg: {1!s}'.format(output_file, str(e)))
+        if os.path.exists(output_file):
+            try:
+                os.remove(output_file)
+            except (IOError, OSError) as ioe:
+                logger.warning('Error removing {0!s}: {1!s}'.format(output_file, str(ioe)))
+        return False
@@ -0,0 +1,226 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+Recording of multiple live streams in one process.
+"""
+
+import logging
+import os
+import threading
+import xml.etree.ElementTree
+
+import requests
+try:
+    from .metrics import DownloaderMetrics
+    from .retry import RetryScheduler
+    from .selection import RepresentationPolicy
+    from .workers import WorkerPool
+except ValueError:
+    # pragma: no cover
+    # To allow running in terminal
+    from metrics import DownloaderMetrics
+    from retry import RetryScheduler
+    from selection import RepresentationPolicy
+    from workers import WorkerPool
+
+
+logger = logging.getLogger(__file__)
+
+
+MPD_NAMESPACE = {'mpd': 'urn:mpeg:dash:schema:mpd:2011'}
+
+
+class Recorder(object):
+    """
+    Records multiple live streams in one process. All the streams share one
+    connection pool and one limit on concurrent segment downloads, with downloads
+    scheduled round-robin between the streams. Retries are paced by one :class:`RetryScheduler`
+    so that an origin outage does not get a burst of retries from every stream.
+
+    .. code-block:: python
+
+        recorder = live.Recorder(max_workers=50)
+        for broadcast in broadcasts:
+            recorder.add(broadcast['id'], broadcast['dash_playback_url'], 'output_{}/'.format(broadcast['id']))
+        # add or remove streams while recording
+        dl = recorder.remove(broadcast_id)
+        dl.stitch('{}.mp4'.format(broadcast_id))
+        # wait for all the streams to end
+        recorder.wait()
+        for key, dl in recorder.downloaders.items():
+            dl.stitch('{}.mp4'.format(key))
+    """
+
+    MAX_WORKERS = 50
+    # connections for polling mpds, on top of one per worker
+    MAX_POLL_CONNECTIONS = 10
+
+    def __init__(self, max_workers=None, user_agent=None, **kwargs):
+        """
+
+        :param max_workers: maximum number of concurrent segment downloads across all streams
+        :param user_agent: default user agent for the streams
+        :param kwargs: default :class:`Downloader` options for the streams
+        """
+        self.max_workers = max_workers or self.MAX_WORKERS
+        self.user_agent = user_agent
+        self.retry_scheduler = kwargs.pop('retry_scheduler', None) or RetryScheduler()
+        self.downloader_options = kwargs
+        self.pool = WorkerPool(self.max_workers, name='segment')
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            max_retries=2, pool_maxsize=self.max_workers + self.MAX_POLL_CONNECTIONS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.session = session
+
+        self.downloaders = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, mpd, output_dir, **kwargs):
+        """
+        Start recording a stream.
+
+        :param key: unique key for the stream, e.g. the broadcast id
+        :param mpd: URL to mpd
+        :param output_dir: folder to store the downloaded files
+        :param kwargs: :class:`Downloader` options for this stream
+        :return: :class:`Downloader`
+        """
+        options = dict(self.downloader_options)
+        options.update(kwargs)
+        options.setdefault('user_agent', self.user_agent)
+        options.setdefault('retry_scheduler', self.retry_scheduler)
+        with self._lock:
+            if key in self._threads and self._threads[key].is_alive():
+                raise ValueError('Stream {0!s} is already being recorded.'.format(key))
+            dl = Downloader(
+                mpd, output_dir, session=self.session, pool=self.pool.channel(key), **options)
+            t = threading.Thread(target=self._run, name='recorder-{0!s}'.format(key), args=(key, dl))
+            t.daemon = True
+            self.downloaders[key] = dl
+            self._threads[key] = t
+            t.start()
+        return dl
+
+    def add_renditions(self, key, mpd, output_dir, renditions, **kwargs):
+        """
+        Record several video renditions of a stream at once, e.g. the top 2 of the ABR ladder
+        allowed by the ``representation_policy``. Each rendition is recorded with the audio
+        by its own :class:`Downloader` so that it can be stitched on its own.
+
+        :param key: unique key for the stream, the renditions are recorded under the keys
+            ``(key, 0)``, ``(key, 1)``, etc
+        :param mpd: URL to mpd
+        :param output_dir: folder to store the downloaded files, in a subfolder per rendition
+        :param renditions: number of renditions to record, from the best one down.
+            Clamped to the number of video representations allowed by the policy.
+        :param kwargs: :class:`Downloader` options for the renditions
+        :return: list of :class:`Downloader`
+        """
+        options = dict(self.downloader_options)
+        options.update(kwargs)
+        ladder_size = self._ladder_size(
+            mpd, options.get('representation_policy') or RepresentationPolicy(),
+            options.get('user_agent') or self.user_agent or Downloader.USER_AGENT)
+        if ladder_size and renditions > ladder_size:
+            logger.warning('Only {0:d} of {1:d} renditions available for {2!s}'.format(
+                ladder_size, renditions, key))
+            renditions = ladder_size
+        return [
+            self.add((key, n), mpd, os.path.join(output_dir, str(n)), rendition=n, **kwargs)
+            for n in range(renditions)]
+
+    def _ladder_size(self, mpd, policy, user_agent):
+        """
+        Number of video representations in the mpd that the policy allows.
+
+        :param mpd: URL to mpd
+        :param policy: :class:`RepresentationPolicy`
+        :param user_agent: user agent for the mpd request
+        :return: int, or None if the mpd could not be read
+        """
+        try:
+            res = self.session.get(
+                mpd, headers={'User-Agent': user_agent}, timeout=Downloader.MPD_DOWNLOAD_TIMEOUT)
+            res.raise_for_status()
+            xml_mpd = xml.etree.ElementTree.fromstring(res.content)
+        except (requests.exceptions.RequestException, xml.etree.ElementTree.ParseError) as e:
+            logger.warning('Unable to read the renditions of {0!s}: {1!s}'.format(mpd, str(e)))
+            return None
+        ladder_size = 0
+        for adaptation_set in xml_mpd.findall('mpd:Period/mpd:AdaptationSet', MPD_NAMESPACE):
+            representations = [
+                r for r in adaptation_set.findall('mpd:Representation', MPD_NAMESPACE)
+                if 'video' in r.attrib.get('mimeType', '')]
+            if representations:
+                ladder_size = max(ladder_size, len(policy.rank(representations)))
+        return ladder_size or None
+
+    @staticmethod
+    def _run(key, dl):
+        try:
+            dl.run()
+        except Exception as e:      # pylint: disable=broad-except
+            logger.error('Error recording {0!s}: {1!s}'.format(key, str(e)))
+            dl.stop()
+
+    def remove(self, key, wait=True):
+        """
+        Stop recording a stream.
+
+        :param key: stream key
+        :param wait: block until the stream's pending downloads have completed
+        :return: the stream's :class:`Downloader`, ready to :meth:`Downloader.stitch`
+        """
+        with self._lock:
+            dl = self.downloaders.pop(key)
+            t = self._threads.pop(key)
+        dl.is_aborted = True
+        if wait:
+            t.join()
+        return dl
+
+    def is_recording(self, key):
+        """True if the stream is still being recorded."""
+        t = self._threads.get(key)
+        return bool(t and t.is_alive())
+
+    def wait(self, timeout=None):
+        """
+        Block until all streams have ended.
+
+        :param timeout: maximum number of seconds to wait for each stream
+        """
+        for t in list(self._threads.values()):
+            t.join(timeout)
+
+    def metrics_snapshot(self):
+        """The :meth:`DownloaderMetrics.snapshot` of each stream, keyed by stream key."""
+        return dict([(key, dl.metrics.snapshot()) for key, dl in list(self.downloaders.items())])
+
+    def prometheus_text(self):
+        """The metrics of all streams in the Prometheus text exposition format, labelled by ``stream``."""
+        return DownloaderMetrics.format_prometheus([
+            ({'stream': key}, snapshot) for key, snapshot in sorted(self.metrics_snapshot().items())])
+
+    def stop(self):
+        """Stop recording all streams and shut down the shared worker pool."""
+        for dl in list(self.downloaders.values()):
+            dl.is_aborted = True
+        self.wait()
+        self.pool.shutdown(wait=True)
+
+
+# imported last because live re-exports Recorder, either module can then be imported first
+try:
+    from .live import Downloader    # noqa: E402
+except ValueError:
+    # pragma: no cover
+    # To allow running in terminal
+    from live import Downloader     # noqa: E402
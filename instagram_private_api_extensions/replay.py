@@ -14,10 +14,14 @@ from contextlib import closing
 import requests
 try:
     from .compat import compat_urllib_parse_urlparse
+    from . import mp4
+    from .selection import RepresentationPolicy
 except ValueError:
     # pragma: no cover
     # To allow running in terminal
     from compat import compat_urllib_parse_urlparse
+    import mp4
+    from selection import RepresentationPolicy
 
 
 logger = logging.getLogger(__file__)
@@ -32,12 +36,19 @@ class Downloader(object):
     USER_AGENT = 'Instagram 10.26.0 (iPhone8,1; iOS 10_2; en_US; en-US; ' \
                  'scale=2.00; gamut=normal; 750x1334) AppleWebKit/420+'
     DOWNLOAD_TIMEOUT = 15
+    MUXER = 'auto'
 
     def __init__(self, mpd, output_dir, user_agent=None, **kwargs):
         """
 
         :param mpd: URL to mpd
         :param output_dir: folder to store the downloaded files
+        :param muxer: ``auto`` to merge the audio and video in-process when the streams are fragmented
+            and the output is an mp4 file, falling back to ffmpeg otherwise, or ``ffmpeg`` to always use ffmpeg
+        :param representation_policy: a :class:`selection.RepresentationPolicy` to choose the
+            representations with, e.g. to cap their bandwidth. Defaults to the best quality.
+        :param rendition: which of the video representations allowed by the policy to download,
+            0 for the best one, 1 for the next one down, etc.
         :return:
         """
         self.mpd = mpd
@@ -47,6 +58,9 @@ class Downloader(object):
 
         self.user_agent = user_agent or self.USER_AGENT
         self.download_timeout = kwargs.pop('download_timeout', None) or self.DOWNLOAD_TIMEOUT
+        self.muxer = kwargs.pop('muxer', None) or self.MUXER
+        self.representation_policy = kwargs.pop('representation_policy', None) or RepresentationPolicy()
+        self.rendition = kwargs.pop('rendition', 0)
 
         session = requests.Session()
         adapter = requests.adapters.HTTPAdapter(max_retries=2)
@@ -97,18 +111,12 @@ class Downloader(object):
             video_stream = None
             if not len(adaptation_sets) == 2:
                 logger.warning('Unexpected number of adaptation sets: {}'.format(len(adaptation_sets)))
-            for adaptation_set in adaptation_sets:
+            for n, adaptation_set in enumerate(adaptation_sets):
                 representations = adaptation_set.findall('mpd:Representation', MPD_NAMESPACE)
-                # sort representations by quality and pick best one
-                representations = sorted(
-                    representations,
-                    key=lambda rep: (
-                        (int(rep.attrib.get('width', '0')) * int(rep.attrib.get('height', '0'))) or
-                        int(rep.attrib.get('bandwidth', '0')) or
-                        rep.attrib.get('FBQualityLabel') or
-                        int(rep.attrib.get('audioSamplingRate', '0'))),
-                    reverse=True)
-                representation = representations[0]
+                # the rendition only applies to video, the best audio is always used
+                is_video = any(['video' in r.attrib.get('mimeType', '') for r in representations])
+                representation = representations[self.representation_policy.select(
+                    representations, key=(id(self), period_idx, n), rendition=self.rendition if is_video else 0)]
                 representation_id = representation.attrib.get('id', '')
                 mime_type = representation.attrib.get('mimeType', '')
                 logger.debug(
@@ -135,17 +143,22 @@ class Downloader(object):
                 self.output_dir,
                 os.path.basename(compat_urllib_parse_urlparse(video_stream).path)
             )
-            for target in ((audio_stream, audio_file), (video_stream, video_file)):
-                logger.debug('Downloading {} as {}'.format(*target))
-                with closing(self.session.get(
-                        target[0],
-                        headers={'User-Agent': self.user_agent, 'Accept': '*/*'},
-                        timeout=self.download_timeout, stream=True)) as res:
-                    res.raise_for_status()
-
-                    with open(target[1], 'wb') as f:
-                        for chunk in res.iter_content(chunk_size=1024*100):
-                            f.write(chunk)
+            try:
+                for target in ((audio_stream, audio_file), (video_stream, video_file)):
+                    logger.debug('Downloading {} as {}'.format(*target))
+                    with closing(self.session.get(
+                            target[0],
+                            headers={'User-Agent': self.user_agent, 'Accept': '*/*'},
+                            timeout=self.download_timeout, stream=True)) as res:
+                        res.raise_for_status()
+
+                        with open(target[1], 'wb') as f:
+                            for chunk in res.iter_content(chunk_size=1024*100):
+                                f.write(chunk)
+            finally:
+                # return the bandwidth to the policy's budget
+                for n in range(len(adaptation_sets)):
+                    self.representation_policy.release((id(self), period_idx, n))
 
             if skipffmpeg:
                 continue
@@ -168,29 +181,30 @@ class Downloader(object):
             else:
                 generated_filename = output_filename
 
-            ffmpeg_loglevel = 'error'
-            if logger.level == logging.DEBUG:
-                ffmpeg_loglevel = 'warning'
-
-            cmd = [
-                self.ffmpeg_binary, '-y',
-                '-loglevel', ffmpeg_loglevel,
-                '-i', audio_file,
-                '-i', video_file,
-                '-c:v', 'copy',
-                '-c:a', 'copy',
-                generated_filename]
-
-            try:
-                exit_code = subprocess.call(cmd)
-                if exit_code:
-                    logger.error('ffmpeg exited with the code: {0!s}'.format(exit_code))
+            if self.muxer == 'ffmpeg' or not mp4.try_mux(video_file, audio_file, generated_filename):
+                ffmpeg_loglevel = 'error'
+                if logger.level == logging.DEBUG:
+                    ffmpeg_loglevel = 'warning'
+
+                cmd = [
+                    self.ffmpeg_binary, '-y',
+                    '-loglevel', ffmpeg_loglevel,
+                    '-i', audio_file,
+                    '-i', video_file,
+                    '-c:v', 'copy',
+                    '-c:a', 'copy',
+                    generated_filename]
+
+                try:
+                    exit_code = subprocess.call(cmd)
+                    if exit_code:
+                        logger.error('ffmpeg exited with the code: {0!s}'.format(exit_code))
+                        logger.error('Command: {0!s}'.format(' '.join(cmd)))
+                        continue
+                except Exception as call_err:
+                    logger.error('ffmpeg exited with the error: {0!s}'.format(call_err))
                     logger.error('Command: {0!s}'.format(' '.join(cmd)))
                     continue
-            except Exception as call_err:
-                logger.error('ffmpeg exited with the error: {0!s}'.format(call_err))
-                logger.error('Command: {0!s}'.format(' '.join(cmd)))
-                continue
 
             generated_files.append(generated_filename)
             logger.debug('Generated {}'.format(generated_filename))
@@ -0,0 +1,172 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+Retry pacing for the mpd and segment requests of the live downloaders.
+"""
+
+import logging
+import random
+import threading
+import time
+
+try:
+    from .compat import compat_urlparse
+except ValueError:
+    # pragma: no cover
+    # To allow running in terminal
+    from compat import compat_urlparse
+
+
+logger = logging.getLogger(__file__)
+
+
+class RetryScheduler(object):
+    """
+    Decides when failed requests are retried. A scheduler is shared by the segment and mpd
+    requests of a :class:`Downloader`, and by all the streams of a :class:`Recorder`.
+
+    - Retries are delayed with exponential backoff and full jitter so that
+      the requests that failed together are not retried together.
+    - A circuit breaker per origin (scheme and host) stops requests to an origin after
+      ``failure_threshold`` consecutive failures. One trial request is let through every
+      ``reset_timeout`` seconds and the circuit closes again once a request succeeds.
+    - A retry budget caps retries to ``budget_ratio`` of the requests made,
+      plus ``min_retries_per_second``, so that retries cannot multiply the load during an outage.
+    """
+
+    BASE_DELAY = 0.25
+    MAX_DELAY = 4.0
+    FAILURE_THRESHOLD = 10
+    RESET_TIMEOUT = 5.0
+    BUDGET_RATIO = 0.2
+    MIN_RETRIES_PER_SECOND = 1.0
+    # maximum number of retries that can be saved up
+    BUDGET_BURST = 10.0
+
+    def __init__(self, base_delay=None, max_delay=None, failure_threshold=None, reset_timeout=None,
+                 budget_ratio=None, min_retries_per_second=None, retry_budget=True, seed=None):
+        """
+
+        :param base_delay: maximum delay in seconds before the first retry
+        :param max_delay: maximum delay in seconds before any retry
+        :param failure_threshold: consecutive failures that open an origin's circuit, 0 to disable
+        :param reset_timeout: seconds an open circuit waits before letting a trial request through
+        :param budget_ratio: retries earned per request made
+        :param min_retries_per_second: retries earned per second regardless of the requests made
+        :param retry_budget: False to not limit retries
+        :param seed: random seed for the jitter
+        """
+        self.base_delay = base_delay or self.BASE_DELAY
+        self.max_delay = max_delay or self.MAX_DELAY
+        self.failure_threshold = self.FAILURE_THRESHOLD if failure_threshold is None else failure_threshold
+        self.reset_timeout = reset_timeout or self.RESET_TIMEOUT
+        self.budget_ratio = self.BUDGET_RATIO if budget_ratio is None else budget_ratio
+        self.min_retries_per_second = (self.MIN_RETRIES_PER_SECOND if min_retries_per_second is None
+                                       else min_retries_per_second)
+        self.retry_budget = retry_budget
+        self._random = random.Random(seed)
+        # origin => {'failures': consecutive failures, 'opened_at': time the circuit opened,
+        # 'trial_at': time the trial request was let through}
+        self._origins = {}
+        self._tokens = self.BUDGET_BURST
+        self._refilled_at = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def origin(url):
+        parsed = compat_urlparse.urlparse(url)
+        return '{0!s}://{1!s}'.format(parsed.scheme, parsed.netloc)
+
+    def circuit_state(self, url):
+        """``closed``, ``open`` or ``half-open`` for the url's origin."""
+        with self._lock:
+            state = self._origins.get(self.origin(url))
+            if not state or state['opened_at'] is None:
+                return 'closed'
+            if time.time() - state['opened_at'] < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def origin_wait(self, url, trial=True):
+        """
+        Call before making a request.
+
+        :param url: request url
+        :param trial: False to wait for another request to close the circuit
+            instead of being let through as the trial request
+        :return: 0 if the request can be made now, otherwise the seconds to wait
+            before asking again because the origin's circuit is open
+        """
+        with self._lock:
+            state = self._origins.get(self.origin(url))
+            if not state or state['opened_at'] is None:
+                return 0.0
+            now = time.time()
+            wait = state['opened_at'] + self.reset_timeout - now
+            if wait > 0:
+                return wait
+            if not trial or (state['trial_at'] is not None and now - state['trial_at'] < self.reset_timeout):
+                # another request is trying the origin
+                return self.base_delay
+            state['trial_at'] = now
+            return 0.0
+
+    def record(self, url, ok):
+        """
+        Record the outcome of a request.
+
+        :param url: request url
+        :param ok: False if the origin failed, e.g. a connection error or a 5xx response
+        """
+        origin = self.origin(url)
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.BUDGET_BURST, self._tokens + self.budget_ratio)
+            state = self._origins.setdefault(origin, {'failures': 0, 'opened_at': None, 'trial_at': None})
+            if ok:
+                if state['opened_at'] is not None:
+                    logger.info('Origin {0!s} has recovered'.format(origin))
+                state.update({'failures': 0, 'opened_at': None, 'trial_at': None})
+                return
+            state['failures'] += 1
+            state['trial_at'] = None
+            if self.failure_threshold and (
+                    state['opened_at'] is not None or state['failures'] >= self.failure_threshold):
+                if state['opened_at'] is None:
+                    logger.warning('{0:d} consecutive failures from {1!s}, pausing requests for {2:.1f}s'.format(
+                        state['failures'], origin, self.reset_timeout))
+                state['opened_at'] = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.BUDGET_BURST, self._tokens + (now - self._refilled_at) * self.min_retries_per_second)
+        self._refilled_at = now
+
+    def acquire_retry(self):
+        """
+        Take a retry from the budget.
+
+        :return: False if the budget is exhausted and the request should not be retried
+        """
+        if not self.retry_budget:
+            return True
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def backoff(self, attempt, max_delay=None):
+        """
+        Jittered delay in seconds before a retry.
+
+        :param attempt: number of failed attempts so far, starting from 1
+        :param max_delay: cap on the delay instead of ``max_delay``
+        """
+        cap = min(max_delay or self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        with self._lock:
+            return self._random.uniform(0, cap)
@@ -0,0 +1,138 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+Selection of the DASH representations to download, shared by the live and replay downloaders.
+"""
+
+import logging
+import threading
+
+
+logger = logging.getLogger(__file__)
+
+
+def quality_key(representation):
+    """Sort key that ranks a Representation xml object by quality."""
+    return (
+        (int(representation.attrib.get('width', '0')) * int(representation.attrib.get('height', '0'))) or
+        int(representation.attrib.get('bandwidth', '0')) or
+        representation.attrib.get('FBQualityLabel') or
+        int(representation.attrib.get('audioSamplingRate', '0')))
+
+
+def representation_labels(representation):
+    """The names a representation can be picked by: its FBQualityLabel, ``WxH`` and id."""
+    labels = []
+    if representation.attrib.get('FBQualityLabel'):
+        labels.append(representation.attrib.get('FBQualityLabel'))
+    if representation.attrib.get('width') and representation.attrib.get('height'):
+        labels.append('{0!s}x{1!s}'.format(representation.attrib.get('width'), representation.attrib.get('height')))
+    if representation.attrib.get('id'):
+        labels.append(representation.attrib.get('id'))
+    return labels
+
+
+def _bandwidth(representation):
+    return int(representation.attrib.get('bandwidth', '0'))
+
+
+class RepresentationPolicy(object):
+    """
+    Chooses which representation of an adaptation set is downloaded.
+    The default policy picks the best quality representation.
+
+    .. code-block:: python
+
+        # at most 1Mbps per stream, and 20Mbps across all the streams of a recorder
+        policy = RepresentationPolicy(max_bandwidth=1000000, total_bandwidth=20000000)
+        recorder = live.Recorder(representation_policy=policy)
+
+        # prefer 540w, then 396w
+        dl = live.Downloader(mpd, output_dir, representation_policy=RepresentationPolicy(labels=['540w', '396w']))
+    """
+
+    def __init__(self, max_bandwidth=None, total_bandwidth=None, labels=None):
+        """
+
+        :param max_bandwidth: maximum bandwidth in bits/s of a representation.
+            If no representation fits, the lowest bandwidth one is used.
+        :param total_bandwidth: bandwidth budget in bits/s shared by all the adaptation sets
+            selected with this policy, e.g. all the streams of a :class:`live.Recorder`.
+            A selection is released with :meth:`release` when its download ends.
+        :param labels: list of representation labels in order of preference, matched
+            against the ``FBQualityLabel``, ``WxH`` and id of the representations.
+            Representations that do not match are only used if none match.
+            Only applies to video representations.
+        """
+        self.max_bandwidth = max_bandwidth
+        self.total_bandwidth = total_bandwidth
+        self.labels = list(labels or [])
+        # key => bandwidth of the representations selected against the total bandwidth
+        self._reserved = {}
+        self._lock = threading.Lock()
+
+    def rank(self, representations):
+        """
+        The representations that may be downloaded, in order of preference.
+
+        :param representations: list of Representation xml objects
+        :return: list of Representation xml objects, never empty if ``representations`` is not
+        """
+        ranked = sorted(representations, key=quality_key, reverse=True)
+        # the labels name video qualities, audio sets are ranked as if none were given
+        is_video = any(['video' in r.attrib.get('mimeType', '') for r in representations])
+        if self.labels and is_video:
+            preferred = []
+            for label in self.labels:
+                preferred.extend([r for r in ranked if label in representation_labels(r) and r not in preferred])
+            if preferred:
+                ranked = preferred
+            else:
+                logger.warning('No representation matches {0!s}'.format(', '.join(self.labels)))
+        if self.max_bandwidth:
+            allowed = [r for r in ranked if _bandwidth(r) <= self.max_bandwidth]
+            ranked = allowed or sorted(ranked, key=_bandwidth)[:1]
+        return ranked
+
+    def select(self, representations, key=None, rendition=0):
+        """
+        Select a representation.
+
+        :param representations: list of Representation xml objects
+        :param key: hashable that identifies the selection in the total bandwidth budget,
+            e.g. the downloader and adaptation set. A new selection with the same key
+            replaces the previous one.
+        :param rendition: index into the ranked representations, e.g. 1 for the second best.
+            Clamped to the lowest ranked one.
+        :return: index of the selected representation in ``representations``
+        """
+        ranked = self.rank(representations)
+        ranked = ranked[min(rendition, len(ranked) - 1):]
+        selected = ranked[0]
+        if self.total_bandwidth:
+            with self._lock:
+                reserved = sum([v for k, v in self._reserved.items() if k != key])
+                available = self.total_bandwidth - reserved
+                fitting = [r for r in ranked if _bandwidth(r) <= available]
+                if fitting:
+                    selected = fitting[0]
+                else:
+                    selected = sorted(ranked, key=_bandwidth)[0]
+                    logger.warning('Bandwidth budget of {0:d} exceeded, {1:d} already in use'.format(
+                        self.total_bandwidth, reserved))
+                self._reserved[key] = _bandwidth(selected)
+        return representations.index(selected)
+
+    def release(self, key):
+        """Return a selection's bandwidth to the total bandwidth budget."""
+        with self._lock:
+            self._reserved.pop(key, None)
+
+    @property
+    def reserved_bandwidth(self):
+        """Bandwidth in bits/s of the selections made against the total bandwidth budget."""
+        with self._lock:
+            return sum(self._reserved.values())
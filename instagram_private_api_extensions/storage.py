@@ -0,0 +1,400 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+Where the segments downloaded by the live downloaders are stored until they are stitched.
+"""
+
+import errno
+import io
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+
+try:
+    from .compat import compat_os_replace
+except ValueError:
+    # pragma: no cover
+    # To allow running in terminal
+    from compat import compat_os_replace
+
+
+logger = logging.getLogger(__file__)
+
+
+# kernel copy functions found to be unsupported, e.g. os.copy_file_range on older kernels
+_UNSUPPORTED_KERNEL_COPY = set()
+_KERNEL_COPY_FALLBACK_ERRNOS = tuple(
+    getattr(errno, name) for name in ('EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'EBADF')
+    if hasattr(errno, name))
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _kernel_copy(src_fd, dst_fd, offset, length):
+    """
+    Copy ``length`` bytes from ``offset`` of ``src_fd`` to the current position of ``dst_fd``
+    with ``os.copy_file_range`` (python 3.8+) or ``os.sendfile``, without passing the data through userspace.
+
+    :return: number of bytes copied, less than ``length`` if the copy is not supported
+        or the source ends early
+    """
+    copied = 0
+    for name in ('copy_file_range', 'sendfile'):
+        if name in _UNSUPPORTED_KERNEL_COPY or not hasattr(os, name):
+            continue
+        try:
+            while copied < length:
+                if name == 'copy_file_range':
+                    n = os.copy_file_range(     # pylint: disable=no-member
+                        src_fd, dst_fd, length - copied, offset + copied)
+                else:
+                    n = os.sendfile(dst_fd, src_fd, offset + copied, length - copied)
+                if not n:
+                    break
+                copied += n
+            return copied
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_FALLBACK_ERRNOS:
+                raise
+            if e.errno == errno.ENOSYS:
+                _UNSUPPORTED_KERNEL_COPY.add(name)
+            logger.debug('{0!s} not supported, falling back: {1!s}'.format(name, str(e)))
+    return copied
+
+
+def _copy_file(src, dst, offset=None, length=None):
+    """
+    Append a range of the ``src`` file object to the ``dst`` file object.
+    Real files are copied by the kernel where possible, anything else is copied in chunks.
+
+    :param src: readable binary file object
+    :param dst: writable binary file object
+    :param offset: start of the range in ``src``, defaults to the current position
+    :param length: length of the range, defaults to the rest of ``src``
+    :return: number of bytes copied
+    """
+    if offset is None:
+        offset = src.tell()
+    copied = 0
+    try:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        # e.g. io.BytesIO
+        src_fd = dst_fd = None
+    if src_fd is not None:
+        if length is None:
+            length = max(0, os.fstat(src_fd).st_size - offset)
+        # anything buffered has to be written before the kernel appends to the file
+        dst.flush()
+        copied = _kernel_copy(src_fd, dst_fd, offset, length)
+        if copied == length:
+            return copied
+    src.seek(offset + copied)
+    while length is None or copied < length:
+        chunk = src.read(COPY_CHUNK_SIZE if length is None else min(COPY_CHUNK_SIZE, length - copied))
+        if not chunk:
+            break
+        dst.write(chunk)
+        copied += len(chunk)
+    return copied
+
+
+class SegmentStorage(object):
+    """
+    Base class for where the downloaded segments are stored.
+    Segments are identified by their file name.
+    """
+
+    @contextmanager
+    def open_write(self, name):
+        """
+        Context manager that yields a writable binary file object for a segment.
+        The segment is only stored if the block exits without errors so that
+        an incomplete segment is never read back.
+
+        :param name: segment file name
+        """
+        raise NotImplementedError()
+        yield   # pylint: disable=unreachable
+
+    def exists(self, name):
+        """True if the segment has been stored."""
+        raise NotImplementedError()
+
+    def open_read(self, name):
+        """Returns a readable binary file object for a stored segment."""
+        raise NotImplementedError()
+
+    def copy_to(self, name, outfile):
+        """
+        Append a stored segment to a file.
+
+        :param name: segment file name
+        :param outfile: writable binary file object
+        :return: number of bytes copied
+        """
+        with closing(self.open_read(name)) as readfile:
+            return _copy_file(readfile, outfile)
+
+    def remove(self, name):
+        """Remove a stored segment. Removing a segment that does not exist is a no-op."""
+        raise NotImplementedError()
+
+    def flush(self):
+        """Write out any buffered segments."""
+        pass
+
+    def close(self):
+        """Release any resources held by the storage."""
+        self.flush()
+
+
+class LocalSegmentStorage(SegmentStorage):
+    """Stores each segment as a file in a folder. This is the default storage."""
+
+    def __init__(self, directory):
+        """
+
+        :param directory: folder to store the segment files in
+        """
+        self.directory = directory
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def open_write(self, name):
+        # write to a temp file that is only renamed if written without errors
+        output = self.path(name)
+        partial_output = output + '.part'
+        try:
+            with open(partial_output, 'wb') as f:
+                yield f
+            compat_os_replace(partial_output, output)
+        finally:
+            if os.path.exists(partial_output):
+                try:
+                    os.remove(partial_output)
+                except (IOError, OSError) as ioe:
+                    logger.warning('Error removing {0!s}: {1!s}'.format(partial_output, str(ioe)))
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def open_read(self, name):
+        return open(self.path(name), 'rb')
+
+    def remove(self, name):
+        try:
+            os.remove(self.path(name))
+        except (IOError, OSError) as ioe:
+            if os.path.exists(self.path(name)):
+                logger.warning('Error removing {0!s}: {1!s}'.format(name, str(ioe)))
+
+
+class MemorySegmentStorage(SegmentStorage):
+    """
+    Keeps the segments in memory, e.g. for short broadcasts or restreaming with a sink
+    where the segments never need to touch the disk.
+    """
+
+    def __init__(self, memfd=False):
+        """
+
+        :param memfd: flag to keep each segment in an anonymous memory-backed file
+            (``os.memfd_create``, python 3.8+ on Linux) instead of the python heap.
+            Ignored where memfd is not available.
+        """
+        self.memfd = memfd and hasattr(os, 'memfd_create')
+        if memfd and not self.memfd:
+            logger.debug('memfd is not available, keeping segments on the heap')
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open_write(self, name):
+        if self.memfd:
+            f = os.fdopen(os.memfd_create(name), 'w+b')     # pylint: disable=no-member
+        else:
+            f = io.BytesIO()
+        try:
+            yield f
+        except Exception:
+            f.close()
+            raise
+        if self.memfd:
+            f.flush()
+            segment = f
+        else:
+            segment = f.getvalue()
+        with self._lock:
+            previous = self._segments.get(name)
+            self._segments[name] = segment
+        if self.memfd and previous is not None:
+            previous.close()
+
+    def exists(self, name):
+        return name in self._segments
+
+    def open_read(self, name):
+        segment = self._segments[name]
+        if self.memfd:
+            # a new file description so that concurrent reads do not share an offset
+            return open('/proc/self/fd/{0:d}'.format(segment.fileno()), 'rb')
+        return io.BytesIO(segment)
+
+    def remove(self, name):
+        with self._lock:
+            segment = self._segments.pop(name, None)
+        if self.memfd and segment is not None:
+            segment.close()
+
+    def close(self):
+        with self._lock:
+            segments = list(self._segments.values())
+            self._segments = {}
+        if self.memfd:
+            for segment in segments:
+                segment.close()
+
+
+class SpoolSegmentStorage(SegmentStorage):
+    """
+    Buffers the segments in memory and flushes them to a single append-only container file,
+    instead of creating and removing a file per segment.
+
+    Each record in the container is the length of the segment name (4 bytes, big-endian),
+    the utf-8 encoded name, the length of the segment (8 bytes, big-endian) and the segment.
+    A removed segment is recorded with a length of ``2**64 - 1`` and no segment.
+    An existing container is loaded so that a journaled download can be resumed.
+    """
+
+    SPOOL_SIZE = 1024 * 1024 * 4
+    NAME_HEADER = struct.Struct('>I')
+    DATA_HEADER = struct.Struct('>Q')
+    REMOVED = 2 ** 64 - 1
+
+    def __init__(self, path, spool_size=None):
+        """
+
+        :param path: container file path
+        :param spool_size: number of bytes to buffer before flushing to the container
+        """
+        self.path = path
+        self.spool_size = spool_size or self.SPOOL_SIZE
+        # name => (offset, length) of the segments in the container
+        self._index = {}
+        # name => segment of the buffered segments
+        self._pending = OrderedDict()
+        self._pending_size = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset < size:
+                name_header = f.read(self.NAME_HEADER.size)
+                if len(name_header) < self.NAME_HEADER.size:
+                    break
+                name = f.read(self.NAME_HEADER.unpack(name_header)[0])
+                data_header = f.read(self.DATA_HEADER.size)
+                if len(data_header) < self.DATA_HEADER.size:
+                    break
+                length = self.DATA_HEADER.unpack(data_header)[0]
+                data_offset = f.tell()
+                if length == self.REMOVED:
+                    self._index.pop(name.decode('utf-8'), None)
+                    offset = data_offset
+                    continue
+                if data_offset + length > size:
+                    break
+                self._index[name.decode('utf-8')] = (data_offset, length)
+                f.seek(length, os.SEEK_CUR)
+                offset = data_offset + length
+            if offset < size:
+                logger.warning('Discarding incomplete record at {0:d} in {1!s}'.format(offset, self.path))
+                f.truncate(offset)
+
+    @contextmanager
+    def open_write(self, name):
+        f = io.BytesIO()
+        yield f
+        data = f.getvalue()
+        with self._lock:
+            if name in self._pending:
+                self._pending_size -= len(self._pending.pop(name))
+            self._pending[name] = data
+            self._pending_size += len(data)
+            if self._pending_size >= self.spool_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with open(self.path, 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            for name, data in self._pending.items():
+                encoded_name = name.encode('utf-8')
+                f.write(self.NAME_HEADER.pack(len(encoded_name)))
+                f.write(encoded_name)
+                f.write(self.DATA_HEADER.pack(len(data)))
+                self._index[name] = (f.tell(), len(data))
+                f.write(data)
+        self._pending.clear()
+        self._pending_size = 0
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def exists(self, name):
+        with self._lock:
+            return name in self._pending or name in self._index
+
+    def open_read(self, name):
+        with self._lock:
+            if name in self._pending:
+                return io.BytesIO(self._pending[name])
+            offset, length = self._index[name]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return io.BytesIO(f.read(length))
+
+    def copy_to(self, name, outfile):
+        with self._lock:
+            data = self._pending.get(name)
+            if data is None:
+                offset, length = self._index[name]
+        if data is None:
+            # straight from the container
+            with open(self.path, 'rb') as f:
+                return _copy_file(f, outfile, offset, length)
+        outfile.write(data)
+        return len(data)
+
+    def remove(self, name):
+        with self._lock:
+            if name in self._pending:
+                self._pending_size -= len(self._pending.pop(name))
+            if not self._index.pop(name, None):
+                return
+            if not self._index and not self._pending:
+                # all the segments have been removed
+                os.remove(self.path)
+                return
+            with open(self.path, 'ab') as f:
+                encoded_name = name.encode('utf-8')
+                f.write(self.NAME_HEADER.pack(len(encoded_name)))
+                f.write(encoded_name)
+                f.write(self.DATA_HEADER.pack(self.REMOVED))
@@ -0,0 +1,266 @@
+# Copyright (c) 2017 https://github.com/ping
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+"""
+A thread pool that serves its jobs round-robin between keys, used for the segment downloads
+of the live downloaders.
+"""
+
+import logging
+import threading
+from collections import deque, OrderedDict
+
+
+logger = logging.getLogger(__file__)
+
+
+class _Job(object):
+    """A unit of work queued in a :class:`WorkerPool`"""
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:      # pylint: disable=broad-except
+            self.error = e
+            logger.error('Error from worker job: {0!s}'.format(str(e)))
+        finally:
+            self._done.set()
+
+    def is_alive(self):
+        """Mirrors ``threading.Thread.is_alive()``: True until the job has completed."""
+        return not self._done.is_set()
+
+    def join(self, timeout=None):
+        """Mirrors ``threading.Thread.join()``: blocks until the job has completed."""
+        self._done.wait(timeout)
+
+
+class _FairQueue(object):
+    """
+    A job queue with a lane per key. Lanes are served round-robin so that
+    a key with a large backlog cannot starve the other keys.
+    Items with a higher priority are always served first.
+    """
+
+    def __init__(self):
+        # lanes keyed by priority then key
+        self._lanes = {}
+        self._cond = threading.Condition()
+        self._is_closed = False
+
+    def put(self, item, key=None, priority=0):
+        with self._cond:
+            self._lanes.setdefault(priority, OrderedDict()).setdefault(key, deque()).append(item)
+            self._cond.notify()
+
+    def get(self):
+        """Blocks until an item is available. Returns None once the queue is closed and empty."""
+        with self._cond:
+            while True:
+                if self._lanes:
+                    priority = max(self._lanes.keys())
+                    lanes = self._lanes[priority]
+                    key, lane = next(iter(lanes.items()))
+                    item = lane.popleft()
+                    # move the lane to the back of the line
+                    del lanes[key]
+                    if lane:
+                        lanes[key] = lane
+                    if not lanes:
+                        del self._lanes[priority]
+                    return item
+                if self._is_closed:
+                    return None
+                self._cond.wait()
+
+    def qsize(self):
+        with self._cond:
+            return sum([len(lane) for lanes in self._lanes.values() for lane in lanes.values()])
+
+    def close(self):
+        with self._cond:
+            self._is_closed = True
+            self._cond.notify_all()
+
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads consuming jobs from a queue.
+
+    Worker threads are only started as jobs are submitted, up to ``max_workers``.
+    Use :meth:`channel` to share the pool between multiple downloaders.
+    """
+
+    def __init__(self, max_workers, name='worker'):
+        """
+
+        :param max_workers: maximum number of worker threads
+        :param name: prefix for the worker thread names
+        """
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1.')
+        self.max_workers = max_workers
+        self.name = name
+        self._queue = _FairQueue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._is_shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue ``fn(*args, **kwargs)`` for execution by a worker thread.
+
+        :return: the queued job. Like a thread, it supports ``is_alive()`` and ``join()``.
+        """
+        return self._submit(None, _Job(fn, args, kwargs))
+
+    def submit_prioritized(self, priority, fn, *args, **kwargs):
+        """
+        Like :meth:`submit` but queued ahead of all jobs with a lower priority.
+
+        :param priority: int, jobs submitted with :meth:`submit` have a priority of 0
+        """
+        return self._submit(None, _Job(fn, args, kwargs), priority=priority)
+
+    def _submit(self, key, job, priority=0):
+        with self._lock:
+            if self._is_shutdown:
+                raise RuntimeError('Cannot submit to a pool that has been shut down.')
+            self._queue.put(job, key=key, priority=priority)
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self._work, name='{0!s}-{1:d}'.format(self.name, len(self._workers)))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+            return job
+
+    def channel(self, key):
+        """
+        A view of the pool for a single user of a shared pool.
+        Jobs from different channels are scheduled round-robin.
+
+        :param key: unique channel key
+        :return: :class:`WorkerPoolChannel`
+        """
+        return WorkerPoolChannel(self, key)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                # closed by shutdown()
+                return
+            job.run()
+
+    @property
+    def alive_count(self):
+        """Number of worker threads that are alive"""
+        return len([w for w in self._workers if w.is_alive()])
+
+    @property
+    def pending_count(self):
+        """Approximate number of jobs that are waiting for a worker"""
+        return self._queue.qsize()
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting new jobs. Jobs already queued are still completed.
+
+        :param wait: block until all queued jobs are done and the workers have exited
+        """
+        with self._lock:
+            if not self._is_shutdown:
+                self._is_shutdown = True
+                self._queue.close()
+        if wait:
+            for worker in self._workers:
+                if worker is not threading.current_thread():
+                    worker.join()
+
+
+class WorkerPoolChannel(object):
+    """
+    Submits jobs to a shared :class:`WorkerPool` under a key.
+    Shutting down a channel only waits for its own jobs and leaves the pool running.
+    """
+
+    def __init__(self, pool, key):
+        """
+
+        :param pool: :class:`WorkerPool`
+        :param key: unique channel key
+        """
+        self.pool = pool
+        self.key = key
+        self.max_workers = pool.max_workers
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._is_shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue ``fn(*args, **kwargs)`` for execution by a worker thread of the shared pool.
+
+        :return: the queued job
+        """
+        return self.submit_prioritized(0, fn, *args, **kwargs)
+
+    def submit_prioritized(self, priority, fn, *args, **kwargs):
+        """
+        Like :meth:`submit` but queued ahead of all jobs with a lower priority.
+
+        :param priority: int, jobs submitted with :meth:`submit` have a priority of 0
+        """
+        with self._cond:
+            if self._is_shutdown:
+                raise RuntimeError('Cannot submit to a channel that has been shut down.')
+            self._pending += 1
+        try:
+            return self.pool._submit(self.key, _Job(self._run, (fn, args, kwargs), {}), priority=priority)
+        except RuntimeError:
+            self._job_done()
+            raise
+
+    def _run(self, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        finally:
+            self._job_done()
+
+    def _job_done(self):
+        with self._cond:
+            self._pending -= 1
+            self._cond.notify_all()
+
+    @property
+    def alive_count(self):
+        """Number of worker threads that are alive in the shared pool"""
+        return self.pool.alive_count
+
+    @property
+    def pending_count(self):
+        """Number of jobs from this channel that have not completed"""
+        return self._pending
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting new jobs for this channel.
+
+        :param wait: block until all jobs submitted to this channel are done
+        """
+        with self._cond:
+            self._is_shutdown = True
+            if wait:
+                while self._pending:
+                    self._cond.wait()
@@ -30,6 +30,10 @@ setup(
     long_description_content_type='text/markdown',
     packages=packages,
     install_requires=['moviepy==1.0.1', 'Pillow>=4.0.0', 'requests>=2.9.1'],
+    extras_require={
+        # for live_async
+        'async': ['aiohttp>=3.3'],
+    },
     test_requires=test_reqs,
     platforms=['any'],
     classifiers=[
@@ -0,0 +1,114 @@
+import unittest
+import sys
+import os
+import shutil
+
+try:
+    from instagram_private_api_extensions import live, replay, selection
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from instagram_private_api_extensions import live, replay, selection
+from benchmarks import bench
+from benchmarks.origin import FakeOrigin
+
+
+class TestBenchmarks(unittest.TestCase):
+    """Tests for the benchmark origin and harness."""
+
+    @classmethod
+    def setUpClass(cls):
+        for fd in ('output_origin', 'output_origin_switch', 'output_origin_replay', 'output_origin_ladder'):
+            if os.path.exists(fd):
+                shutil.rmtree(fd, ignore_errors=True)
+
+    def test_origin_live(self):
+        origin = FakeOrigin(segment_duration=0.25, segments=12, window=4, video_size=1000, audio_size=100).start()
+        try:
+            dl = live.Downloader(mpd=origin.live_mpd_url, output_dir='output_origin')
+            dl.run()
+            stats = origin.stats()
+        finally:
+            origin.stop()
+        self.assertEqual(len(stats['published']), 24)
+        for segment in stats['published']:
+            self.assertTrue(
+                os.path.isfile(os.path.join('output_origin', segment)), '{0!s} not downloaded'.format(segment))
+        self.assertEqual(dl.gaps, [])
+        self.assertEqual(dl.metrics.snapshot()['mpd_polls'], stats['requests']['mpd'])
+
+    def test_origin_switch(self):
+        origin = FakeOrigin(segment_duration=0.25, segments=12, window=4, switch_every=4, error_rate=0.2,
+                            seed=1, video_size=1000, audio_size=100).start()
+        try:
+            dl = live.Downloader(
+                mpd=origin.live_mpd_url, output_dir='output_origin_switch', max_connection_error_retry=3)
+            dl.run()
+            stats = origin.stats()
+        finally:
+            origin.stop()
+        self.assertEqual(sorted(set(dl.segment_meta.values())), ['396w', '540w'])
+        self.assertGreater(stats['requests']['error'], 0)
+
+        def read_sources():
+            sources = {}
+            for f in os.listdir('output_origin_switch'):
+                if f.startswith('source_'):
+                    with open(os.path.join('output_origin_switch', f), 'rb') as source_file:
+                        sources[f] = source_file.read()
+                    os.remove(os.path.join('output_origin_switch', f))
+            return sources
+
+        dl.stitch('output_origin_switch.mp4', skipffmpeg=True, cleartempfiles=False)
+        serial_sources = read_sources()
+        self.assertGreater(len(serial_sources), 2)
+        dl.stitch('output_origin_switch.mp4', skipffmpeg=True, cleartempfiles=False, parallel=True)
+        self.assertEqual(read_sources(), serial_sources)
+
+    def test_origin_ladder(self):
+        origin = FakeOrigin(segment_duration=0.25, segments=8, window=4, ladder=True,
+                            video_size=1000, audio_size=100).start()
+        try:
+            recorder = live.Recorder()
+            downloaders = recorder.add_renditions('ladder', origin.live_mpd_url, 'output_origin_ladder', 3)
+            recorder.wait()
+            # only 2 renditions in the ladder
+            self.assertEqual(sorted(recorder.downloaders.keys()), [('ladder', 0), ('ladder', 1)])
+            capped = live.Downloader(
+                mpd=origin.live_mpd_url, output_dir=os.path.join('output_origin_ladder', 'capped'),
+                representation_policy=selection.RepresentationPolicy(max_bandwidth=40000))
+            capped.run()
+            recorder.stop()
+        finally:
+            origin.stop()
+        self.assertEqual([dl.output_dir for dl in downloaders],
+                         [os.path.join('output_origin_ladder', str(n)) for n in range(2)])
+        self.assertEqual(sorted(set(downloaders[0].segment_meta.values())), ['540w'])
+        self.assertEqual(sorted(set(downloaders[1].segment_meta.values())), ['396w'])
+        self.assertEqual(sorted(set(capped.segment_meta.values())), ['396w'])
+        for dl in downloaders:
+            self.assertEqual(dl.gaps, [])
+            self.assertEqual(len([f for f in os.listdir(dl.output_dir) if f.endswith('.m4a')]), 8)
+
+    def test_origin_replay(self):
+        origin = FakeOrigin(segments=10, replay_size=10000).start()
+        try:
+            mpd = bench.requests.get(origin.replay_mpd_url).text
+            dl = replay.Downloader(mpd=mpd, output_dir='output_origin_replay')
+            dl.download('output_origin_replay.mp4', skipffmpeg=True, cleartempfiles=False)
+        finally:
+            origin.stop()
+        self.assertEqual(dl.duration, 10)
+        self.assertEqual(
+            sorted([os.path.getsize(os.path.join('output_origin_replay', f))
+                    for f in os.listdir('output_origin_replay')]),
+            [1000, 10000])
+
+    def test_compare(self):
+        baseline = {'live': {'throughput_bps': 100.0, 'lost_segments': 0, 'cpu_seconds': 1.0}}
+        self.assertEqual(
+            bench.compare({'live': {'throughput_bps': 95.0, 'lost_segments': 0, 'cpu_seconds': 1.05}}, baseline, 0.1),
+            [])
+        self.assertEqual(
+            len(bench.compare({'live': {'throughput_bps': 80.0, 'lost_segments': 1, 'cpu_seconds': 2.0}},
+                              baseline, 0.1)),
+            3)
@@ -2,15 +2,22 @@ import unittest
 import sys
 import os
 import shutil
+import threading
+import time
+import io
+import re
+import json
 
 import responses
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, ReadTimeout
 
 try:
-    from instagram_private_api_extensions import live
+    from instagram_private_api_extensions import live, metrics, mp4, workers
+    from instagram_private_api_extensions import storage as segment_storage
 except ImportError:
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-    from instagram_private_api_extensions import live
+    from instagram_private_api_extensions import live, metrics, mp4, workers
+    from instagram_private_api_extensions import storage as segment_storage
 
 
 class TestLive(unittest.TestCase):
@@ -22,11 +29,25 @@ class TestLive(unittest.TestCase):
     def setUpClass(cls):
         for f in ('output.mp4', 'output_singlethreaded.mp4',
                   'output_httperrors.mp4', 'output_404.mp4', 'output_connerror.mp4',
-                  'output_respheaders.mp4', 'output_fragment_connerror.mp4'):
+                  'output_respheaders.mp4', 'output_fragment_connerror.mp4',
+                  'output_maxworkers.mp4', 'output_incremental.mp4', 'output_ffmpegsink.mp4',
+                  'output_adaptive.mp4', 'output_recorder_a.mp4', 'output_recorder_b.mp4',
+                  'output_journal.mp4', 'output_backfill.mp4', 'output_spool.mp4', 'output_memory.mp4',
+                  'output_direct.mp4', 'output_direct_ffmpeg.mp4', 'output_parallel.mp4'):
             if os.path.isfile(f):
                 os.remove(f)
         for fd in ('output', 'output_singlethreaded', 'output_httperrors', 'output_404',
-                   'output_connerror', 'output_respheaders', 'output_fragment_connerror'):
+                   'output_connerror', 'output_respheaders', 'output_fragment_connerror',
+                   'output_maxworkers', 'output_opensegment', 'output_incremental',
+                   'output_pipesink', 'output_ffmpegsink', 'output_initcache', 'output_conditional',
+                   'output_adaptive', 'output_recorder_a', 'output_recorder_b', 'output_recorder_c',
+                   'output_timelinediff', 'output_backlog', 'output_statuscheck',
+                   'output_journal', 'output_backfill', 'output_gaps',
+                   'output_metrics', 'output_spool', 'output_memory', 'output_storage', 'output_direct',
+                   'output_circuit', 'output_outage', 'output_query', 'output_dvr', 'output_dvr_local',
+                   'output_parallel', 'output_timeout', 'output_diskfull',
+                   'output_sinkfail', 'output_sharedpool_a', 'output_sharedpool_b',
+                   'output_stopped', 'output_journalorder'):
             if os.path.exists(fd):
                 shutil.rmtree(fd, ignore_errors=True)
 
@@ -40,10 +61,717 @@ class TestLive(unittest.TestCase):
             duplicate_etag_retry=10,
             callback_check=check_status)
         dl.run()
+        self.assertEqual(dl.downloaders, {})
+        # aborted by the status check
+        self.assertLess(dl.duplicate_etag_count, 10)
         output_file = 'output.mp4'
         dl.stitch(output_file, cleartempfiles=False)
         self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
 
+    def test_downloader_max_workers(self):
+        dl = live.Downloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_maxworkers',
+            duplicate_etag_retry=10,
+            max_workers=2,
+            muxer='ffmpeg')
+        dl.run()
+        self.assertLessEqual(len(dl.pool._workers), 2)
+        self.assertEqual(dl.pool.alive_count, 0)
+        output_file = 'output_maxworkers.mp4'
+        dl.stitch(output_file, cleartempfiles=True)
+        self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+
+    def test_downloader_incremental_stitch(self):
+        dl = live.Downloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_incremental',
+            duplicate_etag_retry=10,
+            incremental_stitch=True)
+        dl.run()
+        # source files are assembled before stitch() is called
+        self.assertTrue(os.path.isfile(
+            os.path.join('output_incremental', 'source_{0!s}_0_m4v.tmp'.format(dl.stream_id))))
+        self.assertTrue(os.path.isfile(
+            os.path.join('output_incremental', 'source_{0!s}_0_m4a.tmp'.format(dl.stream_id))))
+        output_file = 'output_incremental.mp4'
+        dl.stitch(output_file, cleartempfiles=True)
+        self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+
+    def test_downloader_direct_stitch(self):
+        dl = live.Downloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_direct',
+            duplicate_etag_retry=10)
+        dl.run()
+        for muxer, output_file in (('auto', 'output_direct.mp4'), ('ffmpeg', 'output_direct_ffmpeg.mp4')):
+            dl.muxer = muxer
+            self.assertEqual(dl.stitch(output_file, cleartempfiles=(muxer == 'ffmpeg'), direct=True), [output_file])
+            self.assertGreater(os.path.getsize(output_file), 0, '{0!s} is empty'.format(output_file))
+            self.assertFalse(
+                [f for f in os.listdir('output_direct') if f.endswith('.tmp')], 'Source files assembled')
+        self.assertFalse([f for f in os.listdir('output_direct') if f.endswith('.m4v')], 'Segments not removed')
+
+    def test_segment_storage(self):
+        if not os.path.exists('output_storage'):
+            os.makedirs('output_storage')
+        container = os.path.join('output_storage', 'segments.spool')
+        for storage in (live.MemorySegmentStorage(), live.MemorySegmentStorage(memfd=True),
+                        live.SpoolSegmentStorage(container, spool_size=10)):
+            with self.assertRaises(IOError):
+                with storage.open_write('a.m4v') as f:
+                    f.write(b'incomplete')
+                    raise IOError('Interrupted')
+            self.assertFalse(storage.exists('a.m4v'), 'Incomplete segment saved')
+            for name in ('a.m4v', 'b.m4v', 'c.m4v', 'a.m4v'):
+                with storage.open_write(name) as f:
+                    f.write(name.encode('utf-8') * 3)
+            storage.flush()
+            for name in ('a.m4v', 'b.m4v', 'c.m4v'):
+                self.assertTrue(storage.exists(name))
+                with storage.open_read(name) as f:
+                    self.assertEqual(f.read(), name.encode('utf-8') * 3)
+            with open(os.path.join('output_storage', 'copy.tmp'), 'wb') as f:
+                self.assertEqual(storage.copy_to('a.m4v', f), 15)
+                self.assertEqual(storage.copy_to('b.m4v', f), 15)
+            with open(os.path.join('output_storage', 'copy.tmp'), 'rb') as f:
+                self.assertEqual(f.read(), b'a.m4v' * 3 + b'b.m4v' * 3)
+            storage.remove('c.m4v')
+            self.assertFalse(storage.exists('c.m4v'))
+            storage.close()
+
+        # the spool container is reloaded, discarding an incomplete record
+        with open(container, 'ab') as f:
+            f.write(b'\x00\x00')
+        storage = live.SpoolSegmentStorage(container)
+        self.assertTrue(storage.exists('b.m4v'))
+        with storage.open_read('a.m4v') as f:
+            self.assertEqual(f.read(), b'a.m4v' * 3)
+        storage.remove('a.m4v')
+        storage.remove('b.m4v')
+        self.assertFalse(os.path.exists(container), 'Empty container not removed')
+
+    def test_copy_file(self):
+        if not os.path.exists('output_storage'):
+            os.makedirs('output_storage')
+        src_file = os.path.join('output_storage', 'copy_src.tmp')
+        dst_file = os.path.join('output_storage', 'copy_dst.tmp')
+        data = os.urandom(segment_storage.COPY_CHUNK_SIZE + 100)
+        with open(src_file, 'wb') as f:
+            f.write(data)
+
+        unsupported = set(segment_storage._UNSUPPORTED_KERNEL_COPY)
+        try:
+            for kernel_copy in (True, False):
+                if not kernel_copy:
+                    segment_storage._UNSUPPORTED_KERNEL_COPY.update(['copy_file_range', 'sendfile'])
+                with open(src_file, 'rb') as src, open(dst_file, 'wb') as dst:
+                    dst.write(b'head')
+                    self.assertEqual(segment_storage._copy_file(src, dst), len(data))
+                    self.assertEqual(segment_storage._copy_file(src, dst, 10, 20), 20)
+                    dst.write(b'tail')
+                    self.assertEqual(segment_storage._copy_file(io.BytesIO(data), dst, 5, 5), 5)
+                with open(dst_file, 'rb') as f:
+                    self.assertEqual(f.read(), b'head' + data + data[10:30] + b'tail' + data[5:10])
+        finally:
+            segment_storage._UNSUPPORTED_KERNEL_COPY.clear()
+            segment_storage._UNSUPPORTED_KERNEL_COPY.update(unsupported)
+
+    def test_downloader_spool_storage(self):
+        for output_dir, storage in (
+                ('output_spool', live.SpoolSegmentStorage('output_spool.spool')),
+                ('output_memory', live.MemorySegmentStorage())):
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir=output_dir,
+                duplicate_etag_retry=10,
+                storage=storage)
+            dl.run()
+            self.assertFalse([f for f in os.listdir(output_dir) if f.endswith('.m4v')], 'Segment files created')
+            output_file = output_dir + '.mp4'
+            # segments in memory are piped to ffmpeg
+            dl.stitch(output_file, cleartempfiles=True, direct=isinstance(storage, live.MemorySegmentStorage))
+            self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+        self.assertFalse(os.path.exists('output_spool.spool'), 'Container not removed')
+
+    def test_downloader_pipe_sink(self):
+        class Writable(io.BytesIO):
+            def close(self):
+                pass
+
+        video = Writable()
+        audio = Writable()
+        dl = live.Downloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_pipesink',
+            duplicate_etag_retry=10,
+            sink=live.PipeSink(video=video, audio=audio))
+        dl.run()
+
+        segments = sorted(dl.segment_meta.keys(), key=lambda x: dl._get_file_index(x))
+        for track, writable in (('.m4v', video), ('.m4a', audio)):
+            expected = b''
+            for segment in segments:
+                with open(os.path.join('output_pipesink', segment.replace('.m4v', track)), 'rb') as f:
+                    expected += f.read()
+            self.assertTrue(expected, 'No segments downloaded')
+            self.assertEqual(writable.getvalue(), expected)
+
+    def test_pipe_sink_write_error(self):
+        class Broken(io.BytesIO):
+            writes = 0
+
+            def write(self, data):
+                Broken.writes += 1
+                raise IOError('Broken pipe')
+
+        sink = live.PipeSink(video=Broken(), max_queued=10)
+        sink.write('video', b'a')
+        sink.write('video', b'b')
+        sink.close()
+        self.assertEqual(Broken.writes, 1)
+        # the failed track no longer queues data
+        sink.write('video', b'c')
+        self.assertEqual(sink._queues['video'].qsize(), 0)
+
+    def test_downloader_sink_failed_segment(self):
+        class FullStorage(live.LocalSegmentStorage):
+            def open_write(self, name):
+                if name == '17875351285037717-285033.m4v':
+                    raise IOError('No space left on device')
+                return super(FullStorage, self).open_write(name)
+
+        class RecordingSink(live.PipeSink):
+            def write(self, track, data):
+                # the stream is still live when the later segments are written
+                written.append(dl.is_aborted)
+                super(RecordingSink, self).write(track, data)
+
+        written = []
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            self._add_segment_responses(rsps)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_sinkfail',
+                duplicate_etag_retry=2,
+                storage=FullStorage('output_sinkfail'),
+                sink=RecordingSink(video=io.BytesIO()))
+            dl.run()
+        # the failed segment does not hold up the segments after it
+        self.assertEqual(len(written), 19)
+        self.assertFalse(any(written))
+
+    def test_downloader_ffmpeg_sink(self):
+        output_file = 'output_ffmpegsink.mp4'
+        dl = live.Downloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_ffmpegsink',
+            duplicate_etag_retry=10,
+            sink=live.FFmpegSink(output_file, output_args=['-c', 'copy']))
+        dl.run()
+        self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+
+    def test_downloader_adaptive_polling(self):
+        dl = live.Downloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_adaptive',
+            duplicate_etag_retry=10,
+            adaptive_polling=True)
+        dl.run()
+        self.assertGreater(dl.timeline_edge, 0)
+        self.assertGreater(dl.timeline_segment_duration, 0)
+        output_file = 'output_adaptive.mp4'
+        dl.stitch(output_file, cleartempfiles=True)
+        self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+
+    def test_downloader_parallel_stitch(self):
+        dl = live.Downloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_parallel',
+            duplicate_etag_retry=10)
+        dl.run()
+        output_file = 'output_parallel.mp4'
+        self.assertEqual(dl.stitch(output_file, cleartempfiles=True, parallel=True), [output_file])
+        self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+        self.assertFalse([f for f in os.listdir('output_parallel') if f.endswith('.tmp')], 'Temp files not removed')
+
+    def test_poll_scheduler(self):
+        scheduler = live._PollScheduler()
+        self.assertEqual(scheduler.next_wait(2, 0, 100.0), 2)
+
+        # segment ending at media time 10s seen at 100s
+        scheduler.observe(10.0, 1.0, 100.0)
+        self.assertAlmostEqual(scheduler.next_wait(1, 0, 100.2), 0.9)
+        # stale edge is ignored
+        scheduler.observe(10.0, 1.0, 100.5)
+        self.assertAlmostEqual(scheduler.next_wait(1, 0, 100.2), 0.9)
+        # overdue, back off up to the update period
+        self.assertAlmostEqual(scheduler.next_wait(1, 1, 101.2), 0.2)
+        self.assertAlmostEqual(scheduler.next_wait(1, 3, 101.2), 0.8)
+        self.assertAlmostEqual(scheduler.next_wait(1, 10, 101.2), 1.0)
+        # earliest offset is used
+        scheduler.observe(11.0, 1.0, 100.5)
+        self.assertAlmostEqual(scheduler.next_wait(1, 0, 101.0), 0.6)
+
+    def test_recorder(self):
+        recorder = live.Recorder(max_workers=3, duplicate_etag_retry=10)
+        recorder.add('a', self.TEST_MPD_URL, 'output_recorder_a')
+        recorder.add('b', self.TEST_MPD_URL, 'output_recorder_b')
+        recorder.add('c', self.TEST_MPD_URL + 'x', 'output_recorder_c', max_connection_error_retry=1)
+        with self.assertRaises(ValueError):
+            recorder.add('a', self.TEST_MPD_URL, 'output_recorder_a')
+        self.assertIs(recorder.downloaders['a'].retry_scheduler, recorder.downloaders['c'].retry_scheduler)
+        recorder.remove('c')
+        self.assertFalse(recorder.is_recording('c'))
+        recorder.wait()
+        for key in ('a', 'b'):
+            dl = recorder.downloaders[key]
+            self.assertIs(dl.session, recorder.session)
+            output_file = 'output_recorder_{0!s}.mp4'.format(key)
+            dl.stitch(output_file, cleartempfiles=True)
+            self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+        self.assertEqual(sorted(recorder.metrics_snapshot().keys()), ['a', 'b'])
+        self.assertIn('ig_live_segments_downloaded_total{stream="a"}', recorder.prometheus_text())
+        recorder.stop()
+        self.assertLessEqual(len(recorder.pool._workers), 3)
+
+    def test_fair_queue(self):
+        queue = workers._FairQueue()
+        for i in range(3):
+            queue.put('a{0:d}'.format(i), key='a')
+        queue.put('b0', key='b')
+        queue.put('c0', key='c')
+        queue.close()
+        self.assertEqual(
+            [queue.get() for _ in range(6)],
+            ['a0', 'b0', 'c0', 'a1', 'a2', None])
+
+    def test_fair_queue_priority(self):
+        queue = workers._FairQueue()
+        queue.put('a0', key='a')
+        queue.put('b0', key='b')
+        queue.put('a1', key='a', priority=1)
+        queue.close()
+        self.assertEqual(
+            [queue.get() for _ in range(4)],
+            ['a1', 'a0', 'b0', None])
+
+    def test_timeline_gaps(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        # skip ahead by one segment
+        skipped_mpd_content = re.sub(r'(<S t="290033"[^>]*>)', r'\1<S t="292033" d="1000"/>', mpd_content)
+
+        dl = live.Downloader(mpd=self.TEST_MPD_URL, output_dir='output_gaps')
+        list(dl._iter_mpd_segments(dl._parse_mpd(mpd_content)[0]))
+        self.assertEqual(dl.gaps, [])
+        list(dl._iter_mpd_segments(dl._parse_mpd(skipped_mpd_content)[0]))
+        self.assertEqual(len(dl.gaps), 2)
+        for gap in dl.gaps:
+            self.assertEqual(gap['reason'], 'timeline')
+            self.assertLess(gap['start'], gap['end'])
+
+        self.assertTrue(dl._timeline.in_window('17875351285037717-281033.m4v'))
+        self.assertFalse(dl._timeline.in_window('17875351285037717-999.m4v'))
+        dl._on_segment_downloaded(
+            os.path.join('output_gaps', '17875351285037717-281033.m4v'),
+            identifier='17875351285037717-281033.m4v')
+        self.assertEqual(dl.gaps[-1]['reason'], 'download')
+        self.assertEqual(dl.gaps[-1]['segment'], '17875351285037717-281033.m4v')
+
+    def test_segment_index(self):
+        index = live._SegmentIndex()
+        for t in (3000, 1000, 2000):
+            index['17875351285037717-{0:d}.m4v'.format(t)] = '396w' if t < 3000 else '540w'
+        index['17875351285037717-1000.m4a'] = '396w'
+        index['17875351285037717-init.m4v'] = None
+        index.add('17875351285037717-01.m4v')
+        self.assertEqual(len(index), 6)
+        self.assertEqual(list(index), [
+            '17875351285037717-1000.m4v', '17875351285037717-2000.m4v', '17875351285037717-3000.m4v',
+            '17875351285037717-1000.m4a', '17875351285037717-init.m4v', '17875351285037717-01.m4v'])
+        self.assertEqual(index['17875351285037717-3000.m4v'], '540w')
+        self.assertIn('17875351285037717-01.m4v', index)
+        self.assertNotIn('17875351285037717-1.m4v', index)
+        self.assertNotIn('17875351285037717-1000.mp4', index)
+        with self.assertRaises(KeyError):
+            index['17875351285037717-4000.m4v']
+        index['17875351285037717-3000.m4v'] = '396w'
+        del index['17875351285037717-2000.m4v']
+        self.assertEqual(index, live._SegmentIndex({
+            '17875351285037717-1000.m4v': '396w', '17875351285037717-3000.m4v': '396w',
+            '17875351285037717-1000.m4a': '396w', '17875351285037717-init.m4v': None,
+            '17875351285037717-01.m4v': None}))
+        # labels are stored once
+        self.assertEqual(index._labels, ['540w', '396w'])
+
+    def test_downloader_query_string(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        mpd_content = mpd_content.replace('.m4v"', '.m4v?sig=1"').replace('.m4a"', '.m4a?sig=1"')
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content,
+                     headers={'Cache-Control': 'max-age=1000'})
+            self._add_segment_responses(rsps)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_query')
+            dl.run()
+            self.assertEqual(dl.metrics.snapshot()['segments_downloaded'], 20)
+            # completed segments are indexed by file name, without the query string
+            self.assertIn('17875351285037717-281033.m4v', dl._completed)
+            self.assertEqual(len(dl._completed), 20)
+            self.assertFalse(dl._completed._others)
+            self.assertEqual(json.loads(json.dumps(dl.segment_meta)), dl.segment_meta)
+
+    def test_downloader_backfill(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        recovered = 'http://127.0.01:8000/dash-hd1/17875351285037717-282033.m4v'
+        lost = 'http://127.0.01:8000/dash-hd1/17875351285037717-283033.m4v'
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content,
+                     headers={'Cache-Control': 'max-age=1000'})
+            rsps.add(responses.GET, recovered, status=404)
+            rsps.add(responses.GET, recovered, status=404)
+            for _ in range(4):
+                rsps.add(responses.GET, lost, status=404)
+            self._add_segment_responses(rsps)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_backfill',
+                max_connection_error_retry=1,
+                max_backfill_retry=1)
+            dl.run()
+            self.assertEqual(len([c for c in rsps.calls if c.request.url == recovered]), 3)
+            self.assertEqual(len([c for c in rsps.calls if c.request.url == lost]), 4)
+            rsps.remove(responses.GET, lost)
+            self.assertTrue(os.path.isfile(os.path.join('output_backfill', os.path.basename(recovered))))
+            self.assertEqual(
+                [(gap['reason'], gap['segment']) for gap in dl.gaps],
+                [('download', os.path.basename(lost))])
+            # finished downloads, failed or not, are released
+            self.assertEqual(dl.downloaders, {})
+            self.assertIn(os.path.basename(lost), dl._completed)
+            self.assertIn(os.path.basename(recovered), dl._completed)
+
+    def test_retry_scheduler(self):
+        scheduler = live.RetryScheduler(
+            base_delay=1, max_delay=4, failure_threshold=2, reset_timeout=0.2,
+            budget_ratio=0.5, min_retries_per_second=0, seed=1)
+        for attempt in range(1, 6):
+            self.assertLessEqual(scheduler.backoff(attempt), min(4, 2 ** (attempt - 1)))
+        self.assertLessEqual(scheduler.backoff(5, max_delay=0.5), 0.5)
+
+        url = 'http://example.com/a.m4v'
+        other_url = 'http://example.net/a.m4v'
+        scheduler.record(url, False)
+        self.assertEqual(scheduler.origin_wait(url), 0)
+        scheduler.record(url, False)
+        self.assertEqual(scheduler.circuit_state(url), 'open')
+        self.assertGreater(scheduler.origin_wait('http://example.com/b.m4v'), 0)
+        self.assertEqual(scheduler.origin_wait(other_url), 0)
+        time.sleep(0.2)
+        self.assertEqual(scheduler.circuit_state(url), 'half-open')
+        self.assertGreater(scheduler.origin_wait(url, trial=False), 0)
+        # one trial request at a time
+        self.assertEqual(scheduler.origin_wait(url), 0)
+        self.assertGreater(scheduler.origin_wait(url), 0)
+        # a failed trial opens the circuit again
+        scheduler.record(url, False)
+        self.assertEqual(scheduler.circuit_state(url), 'open')
+        time.sleep(0.2)
+        self.assertEqual(scheduler.origin_wait(url), 0)
+        scheduler.record(url, True)
+        self.assertEqual(scheduler.circuit_state(url), 'closed')
+
+        # the burst, plus half a retry per request recorded
+        retries = 0
+        while scheduler.acquire_retry():
+            retries += 1
+        self.assertEqual(retries, int(live.RetryScheduler.BUDGET_BURST))
+        scheduler.record(other_url, True)
+        self.assertFalse(scheduler.acquire_retry())
+        scheduler.record(other_url, True)
+        self.assertTrue(scheduler.acquire_retry())
+
+    def test_downloader_circuit_breaker(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        segment_origin = 'http://127.0.0.2:8000/'
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            mpd_content = mpd_content.replace('="../', '="{0!s}'.format(segment_origin))
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content,
+                     headers={'Cache-Control': 'max-age=1000'})
+            rsps.add(responses.GET, re.compile(re.escape(segment_origin) + '.*'), body=ConnectionError())
+
+            scheduler = live.RetryScheduler(failure_threshold=3, reset_timeout=60, seed=1)
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_circuit',
+                max_workers=1,
+                max_connection_error_retry=2,
+                max_backfill_retry=0,
+                retry_scheduler=scheduler)
+            dl.run()
+            segment_calls = [c for c in rsps.calls if c.request.url.startswith(segment_origin)]
+            # the segment origin is not tried again once its circuit opens
+            self.assertEqual(len(segment_calls), 3)
+            self.assertEqual(scheduler.circuit_state(segment_origin), 'open')
+            self.assertEqual(scheduler.circuit_state(self.TEST_MPD_URL), 'closed')
+            metrics = dl.metrics.snapshot()
+            self.assertGreater(metrics['requests_short_circuited'], 0)
+            # segments that waited for the origin until the download stopped did not use up retries
+            self.assertEqual(metrics['retries_denied'], 0)
+            self.assertEqual(metrics['segments_failed'], 20)
+
+    def test_downloader_outage_recovery(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        outage_ends = time.time() + 1
+
+        def segment_callback(request):
+            if time.time() < outage_ends:
+                raise ConnectionError()
+            return 200, {}, b'segment'
+
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            rsps.add_callback(responses.GET, re.compile(r'http://127\.0\.01:8000/dash-.*'), callback=segment_callback)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_outage',
+                duplicate_etag_retry=5)
+            dl.run()
+            metrics = dl.metrics.snapshot()
+            self.assertGreater(metrics['requests_short_circuited'], 0)
+            # the segments wait for the circuit to close instead of failing
+            self.assertEqual(metrics['segments_downloaded'], 20)
+            self.assertEqual(metrics['segments_failed'], 0)
+            self.assertEqual(dl.gaps, [])
+
+    def test_downloader_timeout(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        timed_out = set()
+
+        def segment_callback(request):
+            if request.url not in timed_out:
+                timed_out.add(request.url)
+                raise ReadTimeout()
+            return 200, {}, b'segment'
+
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=ReadTimeout())
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            rsps.add_callback(responses.GET, re.compile(r'http://127\.0\.01:8000/dash-.*'), callback=segment_callback)
+
+            scheduler = live.RetryScheduler(failure_threshold=100, base_delay=0.01, retry_budget=False, seed=1)
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_timeout',
+                duplicate_etag_retry=2,
+                retry_scheduler=scheduler)
+            dl.run()
+            metrics = dl.metrics.snapshot()
+            # timed out requests are retried
+            self.assertEqual(metrics['mpd_errors'], 1)
+            self.assertEqual(metrics['segments_downloaded'], 20)
+            self.assertEqual(metrics['segment_retries'], 20)
+            self.assertEqual(metrics['segments_inflight'], 0)
+            self.assertEqual(dl.downloaders, {})
+            self.assertEqual(dl.gaps, [])
+
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=ReadTimeout())
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_timeout',
+                max_connection_error_retry=0)
+            dl.run()
+            # the downloader is stopped when the mpd cannot be read
+            self.assertTrue(dl.is_aborted)
+            self.assertRaises(RuntimeError, dl.pool.submit, lambda: None)
+
+    def test_downloader_storage_error(self):
+        class FullStorage(live.LocalSegmentStorage):
+            def open_write(self, name):
+                if name == '17875351285037717-285033.m4v':
+                    raise IOError('No space left on device')
+                return super(FullStorage, self).open_write(name)
+
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            self._add_segment_responses(rsps)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_diskfull',
+                duplicate_etag_retry=2,
+                storage=FullStorage('output_diskfull'))
+            dl.run()
+            # the segment is reported as failed instead of being left in flight
+            self.assertEqual([(g['reason'], g['start']) for g in dl.gaps], [('download', 285.033)])
+            self.assertEqual(dl.downloaders, {})
+            metrics = dl.metrics.snapshot()
+            self.assertEqual(metrics['segments_failed'], 1)
+            self.assertEqual(metrics['segments_inflight'], 0)
+
+    def test_downloader_journal(self):
+        dl = live.Downloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_journal',
+            duplicate_etag_retry=10,
+            journal=True)
+        dl.run()
+        journal_file = os.path.join('output_journal', live.Downloader.JOURNAL_FILENAME)
+        self.assertTrue(os.path.isfile(journal_file), 'Journal not generated')
+
+        # resume skips completed segments
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content,
+                     headers={'Cache-Control': 'max-age=1000'})
+            resumed_dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_journal',
+                journal=True)
+            self.assertEqual(resumed_dl.stream_id, dl.stream_id)
+            self.assertEqual(resumed_dl.segment_meta, dl.segment_meta)
+            resumed_dl.run()
+            self.assertEqual(len(rsps.calls), 1)
+
+        # stitch from the journal alone
+        journal_dl = live.Downloader.from_journal('output_journal')
+        self.assertEqual(journal_dl.mpd, self.TEST_MPD_URL)
+        self.assertEqual(journal_dl.initial_buffered_duration, dl.initial_buffered_duration)
+        output_file = 'output_journal.mp4'
+        journal_dl.stitch(output_file, cleartempfiles=True)
+        self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+        self.assertFalse(os.path.isfile(journal_file), 'Journal not removed')
+
+    def test_downloader_journal_order(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            self._add_segment_responses(rsps)
+            # segments are done as soon as they are queued
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_journalorder',
+                duplicate_etag_retry=2,
+                singlethreaded=True,
+                journal=True)
+            dl.run()
+        with open(os.path.join('output_journalorder', live.Downloader.JOURNAL_FILENAME), 'r') as f:
+            record_types = [json.loads(line)['type'] for line in f if line.strip()]
+        # the stream can be rebuilt from any prefix of the journal that has a done segment
+        self.assertLess(record_types.index('stream'), record_types.index('done'))
+        self.assertEqual(record_types.count('done'), 20)
+
+    def test_worker_pool(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0, 'done': 0}
+
+        def work():
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+                state['done'] += 1
+
+        pool = live.WorkerPool(3)
+        jobs = [pool.submit(work) for _ in range(12)]
+        pool.shutdown(wait=True)
+        self.assertEqual(state['done'], 12)
+        self.assertLessEqual(state['peak'], 3)
+        self.assertFalse([j for j in jobs if j.is_alive()])
+        with self.assertRaises(RuntimeError):
+            pool.submit(work)
+
+    def test_downloader_shared_pool(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        pool = live.WorkerPool(2)
+        try:
+            with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+                rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+                self._add_segment_responses(rsps)
+
+                dl_a = live.Downloader(
+                    mpd=self.TEST_MPD_URL, output_dir='output_sharedpool_a', duplicate_etag_retry=2, pool=pool)
+                dl_b = live.Downloader(
+                    mpd=self.TEST_MPD_URL, output_dir='output_sharedpool_b', duplicate_etag_retry=2, pool=pool)
+                dl_a.run()
+                # stopping one downloader leaves the pool running for the others
+                dl_b.run()
+                self.assertEqual(dl_b.metrics.snapshot()['segments_downloaded'], 20)
+                with self.assertRaises(RuntimeError):
+                    dl_a.pool.submit(lambda: None)
+                pool.submit(lambda: None).join()
+        finally:
+            pool.shutdown(wait=True)
+
+    def test_downloader_stop_while_processing(self):
+        class StoppedDownloader(live.Downloader):
+            processed = 0
+
+            def _process_segment(self, *args):
+                self.processed += 1
+                if self.processed == 3:
+                    # stopped from another thread while the mpd is being processed
+                    t = threading.Thread(target=self.stop)
+                    t.start()
+                    t.join()
+                super(StoppedDownloader, self)._process_segment(*args)
+
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            self._add_segment_responses(rsps)
+
+            dl = StoppedDownloader(mpd=self.TEST_MPD_URL, output_dir='output_stopped')
+            dl.run()
+            self.assertTrue(dl.is_aborted)
+            metrics = dl.metrics.snapshot()
+            self.assertEqual(metrics['segments_downloaded'], 2)
+            self.assertEqual(metrics['segments_inflight'], 0)
+
+    def test_open_segment(self):
+        output_dir = 'output_opensegment'
+        storage = live.LocalSegmentStorage(output_dir)
+        output = os.path.join(output_dir, 'segment.m4v')
+
+        with self.assertRaises(IOError):
+            with storage.open_write('segment.m4v') as f:
+                f.write(b'incomplete')
+                raise IOError('Interrupted')
+        self.assertFalse(os.path.exists(output), 'Incomplete segment saved')
+        self.assertFalse(os.path.exists(output + '.part'), 'Temp file not removed')
+
+        with storage.open_write('segment.m4v') as f:
+            f.write(b'complete')
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), b'complete')
+        self.assertFalse(os.path.exists(output + '.part'), 'Temp file not removed')
+
     def test_downloader_404(self):
         def check_status():
             return True
@@ -156,6 +884,327 @@ class TestLive(unittest.TestCase):
             dl.stitch(output_file, cleartempfiles=True)
             self.assertFalse(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
 
+    @staticmethod
+    def _add_segment_responses(rsps):
+        for track, ext in (('dash-hd1', 'm4v'), ('dash-ld', 'm4a')):
+            rsps.add(responses.GET, 'http://127.0.01:8000/{0!s}/17875351285037717-init.{1!s}'.format(track, ext),
+                     body=b'init')
+            for i in range(10):
+                rsps.add(responses.GET, 'http://127.0.01:8000/{0!s}/17875351285037717-{1:d}.{2!s}'.format(
+                    track, 281033 + i * 1000, ext), body=b'segment')
+
+    @responses.activate
+    def test_downloader_conditional_mpd(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        last_modified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content,
+                     headers={'ETag': '"abc"', 'Last-Modified': last_modified})
+            rsps.add(responses.GET, self.TEST_MPD_URL, status=304)
+            rsps.add(responses.GET, self.TEST_MPD_URL, status=304)
+            self._add_segment_responses(rsps)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_conditional',
+                duplicate_etag_retry=2)
+            dl.run()
+            mpd_calls = [c for c in rsps.calls if c.request.url == self.TEST_MPD_URL]
+            self.assertEqual(len(mpd_calls), 3)
+            self.assertNotIn('If-None-Match', mpd_calls[0].request.headers)
+            for call in mpd_calls[1:]:
+                self.assertEqual(call.request.headers.get('If-None-Match'), '"abc"')
+                self.assertEqual(call.request.headers.get('If-Modified-Since'), last_modified)
+            self.assertEqual(dl.duplicate_etag_count, 2)
+            self.assertEqual(len(dl.segment_meta), 10)
+
+    def test_dvr_buffer(self):
+        storage = live.MemorySegmentStorage()
+        dvr = live._DvrBuffer(storage, 5)
+        self.assertIsNone(dvr.range)
+        for i in range(100):
+            name = 'segment-{0:d}.m4v'.format(i)
+            with storage.open_write(name) as f:
+                f.write(b'x')
+            evicted = dvr.add(name, float(i), float(i + 1))
+            self.assertEqual(evicted, ['segment-{0:d}.m4v'.format(i - 5)] if i >= 5 else [])
+            self.assertLessEqual(len(storage._segments), 5)
+        self.assertEqual(dvr.range, (95.0, 100.0))
+        self.assertEqual([s[0] for s in dvr.segments(97.5, 99.0)], ['segment-97.m4v', 'segment-98.m4v'])
+
+        with dvr.hold():
+            dvr.add('segment-100.m4v', 100.0, 101.0)
+            # kept until released
+            self.assertTrue(storage.exists('segment-95.m4v'))
+            self.assertEqual(dvr.range, (96.0, 101.0))
+        self.assertFalse(storage.exists('segment-95.m4v'))
+
+    def test_downloader_dvr(self):
+        dl = live.Downloader(mpd=self.TEST_MPD_URL, output_dir='output_dvr', duplicate_etag_retry=2)
+        with self.assertRaises(ValueError):
+            dl.export_clip('output_dvr.mp4')
+        self.assertIsNone(dl.dvr_range)
+
+        for output_dir, storage in (
+                ('output_dvr', None), ('output_dvr_local', live.LocalSegmentStorage('output_dvr_local'))):
+            # clips are muxed in-process, without ffmpeg
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL, output_dir=output_dir, duplicate_etag_retry=2,
+                dvr_window=4, storage=storage, ffmpeg_binary='ffmpeg-not-installed')
+            dl.run()
+            if not storage:
+                self.assertIsInstance(dl.storage, live.MemorySegmentStorage)
+                stored = dl.storage._segments.keys()
+            else:
+                stored = os.listdir(output_dir)
+            # only the window is kept
+            start, end = dl.dvr_range
+            self.assertAlmostEqual(end - start, 4)
+            self.assertEqual(len(stored), 8)
+            # the backlog older than the window is not downloaded
+            metrics = dl.metrics.snapshot()
+            self.assertEqual(metrics['backlog_skipped'], 12)
+            self.assertEqual(metrics['segments_downloaded'], 8)
+            self.assertEqual(len(dl.segment_meta), 4)
+            self.assertEqual(len(dl._completed), 8)
+
+            output_file = output_dir + '.mp4'
+            self.assertTrue(dl.export_clip(output_file, start=end - 2))
+            self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+            # the clip starts at 0, not at its time in the broadcast
+            clip = mp4._Track(output_file)
+            self.assertEqual(min([clip.fragment_time(fragment.moof) for fragment in clip.fragments]), 0.0)
+            self.assertFalse(dl.export_clip(output_dir + '_empty.mp4', start=end + 10))
+
+    def test_downloader_dvr_evicted(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+
+        def timeline(count, init_query=''):
+            content = re.sub(
+                r'(<S t="(\d+)" d="1000"/>)', lambda m: m.group(1) if int(m.group(2)) < 281033 + count * 1000 else '',
+                mpd_content)
+            return content.replace('-init.m4v"', '-init.m4v{0!s}"'.format(init_query)).replace(
+                '-init.m4a"', '-init.m4a{0!s}"'.format(init_query))
+
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=timeline(2))
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=timeline(5))
+            # a new init segment url makes the whole timeline be walked again
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=timeline(10, '?v=2'))
+            self._add_segment_responses(rsps)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL, output_dir='output_dvr', duplicate_etag_retry=2, dvr_window=2)
+            dl.run()
+            segment_calls = [
+                c.request.url for c in rsps.calls
+                if c.request.url != self.TEST_MPD_URL and '-init.' not in c.request.url]
+            # the segments evicted from the DVR while still in the mpd are not downloaded again
+            self.assertEqual(len(segment_calls), 20)
+            self.assertEqual(len(set(segment_calls)), 20)
+            self.assertEqual(dl.metrics.snapshot()['segments_downloaded'], 20)
+            self.assertEqual(len(dl.segment_meta), 2)
+
+    def test_status_check(self):
+        results = []
+        check = live._StatusCheck(lambda: True, results.append, 1)
+        check.start()
+        check.join()
+        self.assertEqual(results, [True])
+        # a result that arrives after the timeout is ignored
+        check = live._StatusCheck(lambda: time.sleep(0.05) or True, results.append, 0.01)
+        check.start()
+        check.join()
+        self.assertFalse(check.abandoned)
+        self.assertEqual(results, [True])
+
+    def test_downloader_status_check(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        release = threading.Event()
+        calls = []
+
+        try:
+            with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+                rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content.replace(
+                    'minimumUpdatePeriod="PT1S"', 'minimumUpdatePeriod="PT0S"'), headers={'ETag': '"abc"'})
+                self._add_segment_responses(rsps)
+
+                # a slow status check does not hold up the polls, and its result stops the stream
+                def slow_check_status():
+                    calls.append(dl.duplicate_etag_count)
+                    release.wait(0.3)
+                    return True
+
+                dl = live.Downloader(
+                    mpd=self.TEST_MPD_URL, output_dir='output_statuscheck', duplicate_etag_retry=100000,
+                    callback_check=slow_check_status, callback_interval=0.05)
+                dl.run()
+                self.assertEqual(len(calls), 1)
+                self.assertGreater(dl.duplicate_etag_count, calls[0])
+                self.assertLess(dl.duplicate_etag_count, 100000)
+                self.assertEqual(dl.metrics.snapshot()['status_checks'], 1)
+
+            with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+                rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content, headers={'ETag': '"abc"'})
+                self._add_segment_responses(rsps)
+
+                # timed out checks are given up on and run again on schedule
+                def hung_check_status():
+                    release.wait(5)
+                    return True
+
+                dl = live.Downloader(
+                    mpd=self.TEST_MPD_URL, output_dir='output_statuscheck', duplicate_etag_retry=3,
+                    callback_check=hung_check_status, callback_interval=0.2, callback_timeout=0.05)
+                dl.run()
+                self.assertEqual(dl.duplicate_etag_count, 3)
+                metrics = dl.metrics.snapshot()
+                self.assertGreater(metrics['status_checks'], 1)
+                self.assertEqual(metrics['status_check_timeouts'], metrics['status_checks'])
+        finally:
+            release.set()
+
+    def test_mpd_timeline_diff(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        # roll the timeline forward by one segment
+        rolled_mpd_content = re.sub(r'<S t="281033"[^>]*>', '', mpd_content)
+        rolled_mpd_content = re.sub(r'(<S t="290033"[^>]*>)', r'\1<S t="291033" d="1000"/>', rolled_mpd_content)
+
+        dl = live.Downloader(mpd=self.TEST_MPD_URL, output_dir='output_timelinediff')
+        segments = list(dl._iter_mpd_segments(dl._parse_mpd(mpd_content)[0]))
+        self.assertEqual(len(segments), 20)
+        self.assertEqual(len([s for s in segments if s[3]]), 2, 'Init segment not set')
+        self.assertEqual([s[0] for s in segments if not s[4]],
+                         ['17875351285037717-290033.m4v', '17875351285037717-290033.m4a'])
+        self.assertEqual(len(dl.segment_meta), 10)
+        self.assertGreater(dl.initial_buffered_duration, 0)
+        timeline_edge = dl.timeline_edge
+
+        segments = list(dl._iter_mpd_segments(dl._parse_mpd(mpd_content)[0]))
+        self.assertEqual(segments, [])
+
+        segments = list(dl._iter_mpd_segments(dl._parse_mpd(rolled_mpd_content)[0]))
+        self.assertEqual(
+            [s[0] for s in segments],
+            ['17875351285037717-291033.m4v', '17875351285037717-291033.m4a'])
+        self.assertEqual(len(dl.segment_meta), 11)
+        self.assertGreater(dl.timeline_edge, timeline_edge)
+
+        # video representation change walks the whole video timeline again
+        changed_mpd_content = re.sub(r'FBQualityLabel="[^"]+"', 'FBQualityLabel="720w"', rolled_mpd_content)
+        segments = list(dl._iter_mpd_segments(dl._parse_mpd(changed_mpd_content)[0]))
+        self.assertEqual(len(segments), 10)
+
+    def test_backlog_priority(self):
+        class RecordingPool(object):
+            max_workers = 1
+            pending_count = 0
+            alive_count = 0
+
+            def __init__(self):
+                self.submitted = []
+
+            def submit_prioritized(self, priority, fn, **kwargs):
+                self.submitted.append((priority, kwargs['identifier']))
+
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        pool = RecordingPool()
+        dl = live.Downloader(mpd=self.TEST_MPD_URL, output_dir='output_backlog', pool=pool)
+        dl._process_mpd(dl._parse_mpd(mpd_content)[0])
+        self.assertEqual(len(pool.submitted), 20)
+        # live edge first, then the backlog oldest first
+        self.assertEqual(pool.submitted[:2], [
+            (0, '17875351285037717-290033.m4v'), (0, '17875351285037717-290033.m4a')])
+        self.assertEqual(set([priority for priority, _ in pool.submitted[2:]]), set([dl.BACKLOG_PRIORITY]))
+        self.assertEqual(pool.submitted[2][1], '17875351285037717-281033.m4v')
+
+        with self.assertRaises(ValueError):
+            live.Downloader(mpd=self.TEST_MPD_URL, output_dir='output_backlog', backlog_mode='newest')
+        dl = live.Downloader(mpd=self.TEST_MPD_URL, output_dir='output_backlog', backlog_mode='edge_only')
+        segments = list(dl._iter_mpd_segments(dl._parse_mpd(mpd_content)[0]))
+        self.assertEqual([(s[0], bool(s[3]), s[4]) for s in segments], [
+            ('17875351285037717-290033.m4v', True, False), ('17875351285037717-290033.m4a', True, False)])
+        self.assertEqual(list(dl.segment_meta.keys()), ['17875351285037717-290033.m4v'])
+        self.assertEqual(dl.metrics.snapshot()['backlog_skipped'], 18)
+        self.assertEqual(dl.gaps, [])
+        # new segments are not backlog
+        rolled_mpd_content = re.sub(r'(<S t="290033"[^>]*>)', r'\1<S t="291033" d="1000"/>', mpd_content)
+        segments = list(dl._iter_mpd_segments(dl._parse_mpd(rolled_mpd_content)[0]))
+        self.assertEqual([(s[0], s[3], s[4]) for s in segments], [
+            ('17875351285037717-291033.m4v', None, False), ('17875351285037717-291033.m4a', None, False)])
+
+    @responses.activate
+    def test_downloader_init_cache(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content)
+            # same init segment, different etag
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content + ' ')
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content,
+                     headers={'Cache-Control': 'max-age=1000'})
+            self._add_segment_responses(rsps)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_initcache')
+            dl.run()
+            init_calls = [c for c in rsps.calls if '-init.' in c.request.url]
+            self.assertEqual(len(init_calls), 2)
+
+    def test_downloader_metrics(self):
+        with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
+            mpd_content = f.read()
+        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content, headers={'ETag': '"abc"'})
+            rsps.add(responses.GET, self.TEST_MPD_URL, status=304)
+            rsps.add(responses.GET, self.TEST_MPD_URL, body=mpd_content,
+                     headers={'Cache-Control': 'max-age=1000'})
+            rsps.add(responses.GET, 'http://127.0.01:8000/dash-ld/17875351285037717-281033.m4a', status=404)
+            self._add_segment_responses(rsps)
+
+            dl = live.Downloader(
+                mpd=self.TEST_MPD_URL,
+                output_dir='output_metrics',
+                max_connection_error_retry=1)
+            dl.run()
+
+        snapshot = dl.metrics.snapshot()
+        self.assertEqual(snapshot['mpd_polls'], 3)
+        self.assertEqual(snapshot['mpd_not_modified'], 1)
+        self.assertEqual(snapshot['mpd_duplicates'], 1)
+        self.assertEqual(snapshot['mpd_errors'], 0)
+        self.assertEqual(snapshot['segments_downloaded'], 20)
+        self.assertEqual(snapshot['segments_failed'], 0)
+        self.assertEqual(snapshot['segments_inflight'], 0)
+        self.assertEqual(snapshot['segment_retries'], 1)
+        self.assertEqual(snapshot['segment_bytes'], 20 * len(b'segment'))
+        self.assertEqual(snapshot['segment_latency']['count'], 20)
+        self.assertEqual(snapshot['segment_retries_per_segment']['buckets'][1], (1, 20))
+        self.assertEqual(snapshot['mpd_poll_latency']['buckets'][-1][1], 3)
+        self.assertGreater(snapshot['bytes_per_second'], 0)
+        self.assertEqual(snapshot['live_edge_lag'], 0.0)
+        self.assertEqual(snapshot['workers_alive'], 0)
+
+        text = dl.metrics.prometheus_text(labels={'stream': '1"2'})
+        self.assertIn('# TYPE ig_live_mpd_polls_total counter', text)
+        self.assertIn('ig_live_mpd_polls_total{stream="1\\"2"} 3\n', text)
+        self.assertIn('ig_live_segment_download_seconds_bucket{le="+Inf",stream="1\\"2"} 20\n', text)
+        self.assertIn('ig_live_segment_download_seconds_count{stream="1\\"2"} 20\n', text)
+
+    def test_histogram(self):
+        histogram = metrics._Histogram((1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(
+            histogram.snapshot(),
+            {'buckets': [(1, 2), (5, 3), (float('inf'), 4)], 'count': 4, 'sum': 14.5})
+
     @responses.activate
     def test_downloader_resp_headers(self):
         with open('mpdstub/mpd/17875351285037717.mpd', 'r') as f:
@@ -0,0 +1,81 @@
+import unittest
+import sys
+import os
+import shutil
+
+try:
+    from instagram_private_api_extensions import live_async
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    try:
+        from instagram_private_api_extensions import live_async
+    except (ImportError, SyntaxError):
+        # requires python 3.5+ and aiohttp
+        live_async = None
+
+
+@unittest.skipIf(live_async is None, 'asyncio downloader is not available')
+class TestLiveAsync(unittest.TestCase):
+    """Tests for the asyncio live downloader."""
+
+    TEST_MPD_URL = 'http://127.0.0.1:8000/mpd/17875351285037717.mpd'
+
+    @classmethod
+    def setUpClass(cls):
+        for f in ('output_async.mp4', 'output_async_singlethreaded.mp4', 'output_async_404.mp4'):
+            if os.path.isfile(f):
+                os.remove(f)
+        for fd in ('output_async', 'output_async_singlethreaded', 'output_async_404'):
+            if os.path.exists(fd):
+                shutil.rmtree(fd, ignore_errors=True)
+
+    def test_downloader(self):
+        async def check_status():
+            return True
+
+        dl = live_async.AsyncDownloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_async',
+            duplicate_etag_retry=10,
+            callback_check=check_status)
+        # downloads run on the event loop, without threads or a requests session
+        self.assertIsNone(dl.pool)
+        self.assertIsNone(dl.session)
+        dl.run()
+        # aborted by the status check
+        self.assertLess(dl.duplicate_etag_count, 10)
+        self.assertEqual(dl.metrics.snapshot()['status_checks'], 1)
+        output_file = 'output_async.mp4'
+        dl.stitch(output_file, cleartempfiles=False)
+        self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+
+    def test_downloader_single_threaded(self):
+        def check_status():
+            return True
+
+        dl = live_async.AsyncDownloader(
+            mpd=self.TEST_MPD_URL,
+            output_dir='output_async_singlethreaded',
+            duplicate_etag_retry=10,
+            singlethreaded=True,
+            callback_check=check_status)
+        dl.run()
+        output_file = 'output_async_singlethreaded.mp4'
+        dl.stitch(output_file, cleartempfiles=True)
+        self.assertTrue(os.path.isfile(output_file), '{0!s} not generated'.format(output_file))
+
+    def test_downloader_404(self):
+        dl = live_async.AsyncDownloader(
+            mpd=self.TEST_MPD_URL + 'x',
+            output_dir='output_async_404',
+            max_connection_error_retry=2,
+            sleep_interval_before_retry=1)
+        dl.run()
+        output_file = 'output_async_404.mp4'
+        with self.assertRaises(Exception):
+            dl.stitch(output_file, cleartempfiles=False)
+        self.assertFalse(os.path.isfile(output_file), '{0!s} is generated'.format(output_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+import sys
+import os
+import glob
+import io
+import shutil
+import struct
+import subprocess
+
+try:
+    from instagram_private_api_extensions import mp4
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from instagram_private_api_extensions import mp4
+
+
+class TestMp4(unittest.TestCase):
+    """Tests for the fragmented mp4 muxer."""
+
+    OUTPUT_DIR = 'output_mp4'
+
+    @classmethod
+    def setUpClass(cls):
+        if os.path.exists(cls.OUTPUT_DIR):
+            shutil.rmtree(cls.OUTPUT_DIR, ignore_errors=True)
+        os.makedirs(cls.OUTPUT_DIR)
+        # assemble the live segments into a pair of fragmented mp4 streams
+        for track, ext in (('dash-hd1', 'm4v'), ('dash-ld', 'm4a')):
+            segments = sorted(
+                glob.glob('mpdstub/{0!s}/*[0-9].{1!s}'.format(track, ext)),
+                key=lambda x: int(x.rsplit('-', 1)[1].split('.')[0]))
+            with open(os.path.join(cls.OUTPUT_DIR, 'source.' + ext), 'wb') as outfile:
+                for segment in glob.glob('mpdstub/{0!s}/*-init.{1!s}'.format(track, ext)) + segments:
+                    with open(segment, 'rb') as f:
+                        outfile.write(f.read())
+
+    @staticmethod
+    def _stream_hashes(path):
+        return subprocess.check_output([
+            os.getenv('FFMPEG_BINARY', 'ffmpeg'), '-v', 'error', '-i', path,
+            '-map', '0', '-c', 'copy', '-f', 'streamhash', '-hash', 'md5', '-'])
+
+    @staticmethod
+    def _boxes(path):
+        boxes = []
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(8)
+                if not header:
+                    return boxes
+                size, box_type = struct.unpack('>I4s', header)
+                boxes.append(box_type)
+                f.seek(size - 8, os.SEEK_CUR)
+
+    def test_mux(self):
+        video_file = os.path.join(self.OUTPUT_DIR, 'source.m4v')
+        audio_file = os.path.join(self.OUTPUT_DIR, 'source.m4a')
+        output_file = os.path.join(self.OUTPUT_DIR, 'muxed.mp4')
+        mp4.mux(video_file, audio_file, output_file)
+
+        boxes = self._boxes(output_file)
+        self.assertEqual(boxes[:2], [b'ftyp', b'moov'])
+        self.assertEqual(boxes.count(b'moof'), 20)
+        self.assertEqual(boxes.count(b'mdat'), 20)
+        self.assertNotIn(b'sidx', boxes)
+
+        # same packets as a remux by ffmpeg
+        ffmpeg_output_file = os.path.join(self.OUTPUT_DIR, 'ffmpeg.mp4')
+        subprocess.check_call([
+            os.getenv('FFMPEG_BINARY', 'ffmpeg'), '-y', '-v', 'error', '-i', audio_file, '-i', video_file,
+            '-c:v', 'copy', '-c:a', 'copy', ffmpeg_output_file])
+        self.assertEqual(self._stream_hashes(output_file), self._stream_hashes(ffmpeg_output_file))
+
+    @staticmethod
+    def _segments(start=0):
+        """The init segment and the live segments from ``start`` of each track"""
+        segments = {}
+        for track, ext in (('dash-hd1', 'm4v'), ('dash-ld', 'm4a')):
+            media = sorted(
+                glob.glob('mpdstub/{0!s}/*[0-9].{1!s}'.format(track, ext)),
+                key=lambda x: int(x.rsplit('-', 1)[1].split('.')[0]))
+            segments[ext] = glob.glob('mpdstub/{0!s}/*-init.{1!s}'.format(track, ext)) + [
+                m for m in media if int(m.rsplit('-', 1)[1].split('.')[0]) >= start]
+        return segments
+
+    def test_mux_segments(self):
+        segments = self._segments()
+        output_file = os.path.join(self.OUTPUT_DIR, 'segments.mp4')
+        mp4.mux(segments['m4v'], segments['m4a'], output_file)
+
+        muxed_file = os.path.join(self.OUTPUT_DIR, 'muxed_source.mp4')
+        mp4.mux(os.path.join(self.OUTPUT_DIR, 'source.m4v'), os.path.join(self.OUTPUT_DIR, 'source.m4a'), muxed_file)
+        with open(output_file, 'rb') as f, open(muxed_file, 'rb') as muxed:
+            self.assertEqual(f.read(), muxed.read())
+
+        # from file objects, or with an opener, e.g. for segments that are kept in memory
+        file_objects_file = os.path.join(self.OUTPUT_DIR, 'file_objects.mp4')
+        sources = {}
+        for ext in ('m4v', 'm4a'):
+            sources[ext] = []
+            for segment in segments[ext]:
+                with open(segment, 'rb') as f:
+                    sources[ext].append(io.BytesIO(f.read()))
+        mp4.mux(sources['m4v'], sources['m4a'], file_objects_file)
+        self.assertFalse(sources['m4v'][0].closed)
+        opener_file = os.path.join(self.OUTPUT_DIR, 'opener.mp4')
+        opened = []
+
+        def opener(path):
+            opened.append(path)
+            return open(path, 'rb')
+
+        mp4.mux(segments['m4v'], segments['m4a'], opener_file, opener=opener)
+        self.assertEqual(sorted(set(opened)), sorted(segments['m4v'] + segments['m4a']))
+        for generated_file in (file_objects_file, opener_file):
+            with open(generated_file, 'rb') as f, open(muxed_file, 'rb') as muxed:
+                self.assertEqual(f.read(), muxed.read())
+
+    def test_mux_start_time(self):
+        # segments from the middle of the stream
+        segments = self._segments(start=285033)
+        video_start = mp4._Track(segments['m4v']).start_time()
+        audio_start = mp4._Track(segments['m4a']).start_time()
+        self.assertGreater(min(video_start, audio_start), 3.9)
+        output_file = os.path.join(self.OUTPUT_DIR, 'start_time.mp4')
+        mp4.mux(segments['m4v'], segments['m4a'], output_file)
+
+        # the output starts at 0 and the tracks keep their offset to each other
+        muxed = mp4._Track(output_file)
+        times = sorted([muxed.fragment_time(fragment.moof) for fragment in muxed.fragments])
+        self.assertEqual(times[0], 0.0)
+        self.assertAlmostEqual(times[1], abs(video_start - audio_start), places=3)
+
+    def test_mux_not_fragmented(self):
+        output_file = os.path.join(self.OUTPUT_DIR, 'replay.mp4')
+        with self.assertRaises(mp4.MuxError):
+            mp4.mux('mpdstub/replay_video.mp4', 'mpdstub/replay_audio.mp4', output_file)
+        self.assertFalse(mp4.try_mux('mpdstub/replay_video.mp4', 'mpdstub/replay_audio.mp4', output_file))
+        self.assertFalse(os.path.exists(output_file), 'Incomplete output not removed')
+
+    def test_try_mux(self):
+        video_file = os.path.join(self.OUTPUT_DIR, 'source.m4v')
+        audio_file = os.path.join(self.OUTPUT_DIR, 'source.m4a')
+        # left to ffmpeg
+        self.assertFalse(mp4.try_mux(video_file, audio_file, os.path.join(self.OUTPUT_DIR, 'muxed.mkv')))
+        self.assertTrue(mp4.try_mux(video_file, audio_file, os.path.join(self.OUTPUT_DIR, 'muxed.m4v')))
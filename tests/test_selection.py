@@ -0,0 +1,81 @@
+import unittest
+import sys
+import os
+import xml.etree.ElementTree
+import logging
+
+try:
+    from instagram_private_api_extensions import selection
+    from instagram_private_api_extensions.selection import RepresentationPolicy, representation_labels
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from instagram_private_api_extensions import selection
+    from instagram_private_api_extensions.selection import RepresentationPolicy, representation_labels
+
+
+def _representation(rep_id, width, height, bandwidth, label):
+    return xml.etree.ElementTree.Element('Representation', {
+        'id': rep_id, 'mimeType': 'video/mp4', 'width': str(width), 'height': str(height),
+        'bandwidth': str(bandwidth), 'FBQualityLabel': label})
+
+
+class TestSelection(unittest.TestCase):
+    """Tests for the representation selection policy."""
+
+    def setUp(self):
+        self.representations = [
+            _representation('1v', 396, 704, 500000, '396w'),
+            _representation('2v', 720, 1280, 2000000, '720w'),
+            _representation('3v', 540, 960, 1000000, '540w'),
+        ]
+
+    def test_labels(self):
+        self.assertEqual(representation_labels(self.representations[0]), ['396w', '396x704', '1v'])
+
+    def test_rank(self):
+        self.assertEqual(RepresentationPolicy().select(self.representations), 1)
+        self.assertEqual(RepresentationPolicy().select(self.representations, rendition=1), 2)
+        # clamped to the lowest
+        self.assertEqual(RepresentationPolicy().select(self.representations, rendition=5), 0)
+        self.assertEqual(RepresentationPolicy(labels=['540w', '396x704']).select(self.representations), 2)
+        self.assertEqual(
+            RepresentationPolicy(labels=['540w', '396x704']).select(self.representations, rendition=1), 0)
+        # no match
+        self.assertEqual(RepresentationPolicy(labels=['1080w']).select(self.representations), 1)
+
+    def test_labels_audio(self):
+        audio = [
+            xml.etree.ElementTree.Element('Representation', {
+                'id': '1a', 'mimeType': 'audio/mp4', 'audioSamplingRate': '44100', 'bandwidth': '50598'}),
+        ]
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        selection.logger.addHandler(handler)
+        try:
+            self.assertEqual(RepresentationPolicy(labels=['540w']).select(audio), 0)
+            self.assertEqual(records, [])
+            RepresentationPolicy(labels=['1080w']).select(self.representations)
+            self.assertEqual(len(records), 1)
+        finally:
+            selection.logger.removeHandler(handler)
+
+    def test_max_bandwidth(self):
+        self.assertEqual(RepresentationPolicy(max_bandwidth=1500000).select(self.representations), 2)
+        # nothing fits
+        self.assertEqual(RepresentationPolicy(max_bandwidth=1000).select(self.representations), 0)
+
+    def test_total_bandwidth(self):
+        policy = RepresentationPolicy(total_bandwidth=3000000)
+        self.assertEqual(policy.select(self.representations, key='a'), 1)
+        self.assertEqual(policy.select(self.representations, key='b'), 2)
+        # reselecting with the same key keeps its own share
+        self.assertEqual(policy.select(self.representations, key='b'), 2)
+        self.assertEqual(policy.reserved_bandwidth, 3000000)
+        # over budget
+        self.assertEqual(policy.select(self.representations, key='c'), 0)
+        self.assertEqual(policy.reserved_bandwidth, 3500000)
+        policy.release('a')
+        policy.release('c')
+        self.assertEqual(policy.select(self.representations, key='c'), 1)
+        self.assertEqual(policy.reserved_bandwidth, 3000000)